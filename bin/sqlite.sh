@@ -109,12 +109,11 @@ pscript=$(cat <<-EOF
 	import apsw
 	import sys
 	import signal
-	import time
 	
 	import db.dbmanager as dbmanager
-	import db.vsource as vsource
 
-	s=apsw.Shell()
+	# tables of Vertica cluster are registered in background, shell waits only for the tables it needs
+	s=dbmanager.Shell()
 	argsOptionAndDbfile=[a for a in sys.argv[1:] if a.startswith("-")]
 	argsCmdSQL=[a for a in sys.argv[1:] if not a.startswith("-")]
 	if len(argsCmdSQL) > 0 :
@@ -122,7 +121,7 @@ pscript=$(cat <<-EOF
 	
 	s.process_args(argsOptionAndDbfile)
 	
-	dbmanager.setup('${vDbName}', '${vMetaFile}', '${vAdminOSUser}', connection = s.db)
+	dbmanager.setup('${vDbName}', '${vMetaFile}', '${vAdminOSUser}', connection = s.db, lazy = (len(argsCmdSQL) == 0))
 
 	if len(argsCmdSQL) > 0 :
 	  for cs in argsCmdSQL :
@@ -131,21 +130,6 @@ pscript=$(cat <<-EOF
 	    else:
 	      s.process_sql(cs)
 	else:
-	  # tell background sync job it's busy now.
-	  __process_sql = s.process_sql
-	  def wrapProcessSQL(*args, **kargs) :
-	    vsource.setLastSQLiteActivityTime(time.time())
-	    __process_sql(*args, **kargs)
-	    vsource.setLastSQLiteActivityTime(time.time())
-	  s.process_sql = wrapProcessSQL
-    
-	  __process_complete_line = s.process_complete_line
-	  def wrapProcessCmdLine(*args, **kargs) :
-	    s.db.interrupt()
-	    vsource.setLastSQLiteActivityTime(time.time())
-	    __process_complete_line(*args, **kargs)
-	  s.process_complete_line = wrapProcessCmdLine
-
 	  intro="""
 Welcome to vDBAHelper! 
 Powered by SQLite version %s (APSW %s)
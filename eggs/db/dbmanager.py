@@ -8,6 +8,8 @@
 import os
 import glob
 import re
+import time
+import threading
 import logging
 
 import apsw
@@ -18,8 +20,14 @@ import db.vsource as vsource
 
 logger = logging.getLogger(__name__)
 
+# error of statement referencing table which is maybe registering in background
+NOSUCHTABLE = re.compile(r"no such table: (?:\w+\.)?(\w+)")
+# seconds before connecting cluster again to register its tables in background if it was not accessible, doubled after each failed attempt up to REGISTERMAXDELAY
+REGISTERDELAY = 10
+REGISTERMAXDELAY = 300
 
-def setup(vDbName = '', vMetaFile = '/opt/vertica/config/admintools.conf', vAdminOSUser = 'dbadmin', sqliteDBFile = '', connection = None):
+
+def setup(vDbName = '', vMetaFile = '/opt/vertica/config/admintools.conf', vAdminOSUser = 'dbadmin', sqliteDBFile = '', connection = None, lazy = False):
     """ Initialize APSW/SQLite
     Arguments:
         vDbName: string
@@ -31,26 +39,26 @@ def setup(vDbName = '', vMetaFile = '/opt/vertica/config/admintools.conf', vAdmi
         sqliteDBFile string
           local SQLite db file 
         connection: apsw.Connection, default is None
+        lazy: bool, default is False
+          if True, connecting Vertica cluster and registering its tables are done in background, connection is usable at once.
+          Use Cursor/Shell of this module to wait for tables not registered yet.
     Return: apsw.Connection. Using connection argument if it's not None, otherwise a new connection will be created. 
     """
 
-    vc = None
-    try :
-        if len(vMetaFile) > 0:
-            vc = vcluster.getVerticaCluster(vDbName = vDbName, vMetaFile = vMetaFile, vAdminOSUser = vAdminOSUser)
-        else :
-            msg = "will not connect to Vertica cluster. You can not access newest info of Vertica." 
-            print "Notice: %s" % msg
-            logger.info(msg)
-    except Exception:
-        msg = "connect to Vertica cluster failed. You can not access newest info of Vertica." 
-        print "ERROR: %s" % msg
-        logger.exception(msg)
-
     if connection is None :
         connection = apsw.Connection(sqliteDBFile)
 
-    if not vc is None :
+    if len(vMetaFile) == 0 :
+        msg = "will not connect to Vertica cluster. You can not access newest info of Vertica." 
+        print "Notice: %s" % msg
+        logger.info(msg)
+    elif lazy :
+        # tables not depending on catalog of cluster are registered now, others in background
+        vs = vsource.setup(connection, lazy = True)
+        t = threading.Thread(target=bootstrap, args=(vs, vDbName, vMetaFile, vAdminOSUser))
+        t.daemon = True
+        t.start()
+    elif not connect(vDbName, vMetaFile, vAdminOSUser) is None :
         vsource.setup(connection)
 
     # install etc/*.sql
@@ -77,6 +85,148 @@ def setup(vDbName = '', vMetaFile = '/opt/vertica/config/admintools.conf', vAdmi
     return connection
 
 
+def connect(vDbName, vMetaFile, vAdminOSUser, verbose = True) :
+    """ connect to Vertica cluster. Return: VerticaCluster, None if failed """
+
+    try :
+        return vcluster.getVerticaCluster(vDbName = vDbName, vMetaFile = vMetaFile, vAdminOSUser = vAdminOSUser)
+    except Exception:
+        msg = "connect to Vertica cluster failed. You can not access newest info of Vertica." 
+        if verbose :
+            print "ERROR: %s" % msg
+            logger.exception(msg)
+        else :
+            logger.debug(msg, exc_info=True)
+    return None
+
+
+def bootstrap(vs, vDbName, vMetaFile, vAdminOSUser) :
+    """ connect to Vertica cluster and register its tables in background. 
+    If cluster is not accessible, connecting and registering are retried with exponential backoff until catalog of cluster is fetched.
+    """
+
+    t = time.time()
+    connect(vDbName, vMetaFile, vAdminOSUser)
+    fetched = vs.bootstrap()
+    delay = REGISTERDELAY
+    while not fetched :
+        time.sleep(delay)
+        delay = min(delay * 2, REGISTERMAXDELAY)
+        if not connect(vDbName, vMetaFile, vAdminOSUser, verbose = False) is None :
+            fetched = vs.registerCatalog()
+    logger.info("Vertica cluster connected and tables registered in background in %.1f seconds." % (time.time() - t))
+
+
+def waitTable(e, waited) :
+    """ wait for table missing in error if it's registering in background.
+    Arguments:
+        e: apsw.SQLError
+        waited: set of tables have been waited for by the statement
+    Return: True if the statement should be retried
+    """
+
+    m = NOSUCHTABLE.search(str(e))
+    if m is None or m.group(1).lower() in waited :
+        return False
+    waited.add(m.group(1).lower())
+    return vsource.waitTable(m.group(1).lower())
+
+
+def getRemainder(statements, bindings, executed) :
+    """ statements of batch not executed yet, and their bindings.
+    Arguments:
+        statements: string, one or more SQL statements
+        bindings: None, sequence consumed by statements in turn, or dictionary
+        executed: list of (sql, bindings) of statements executed, got by exec tracer
+    Return: (statements, bindings), None if executed statements can not be located in batch
+    """
+
+    pos, consumed = 0, 0
+    for sql, b in executed :
+        pos = statements.find(sql, pos)
+        if pos < 0 :
+            return None
+        pos += len(sql)
+        if not b is None and not isinstance(b, dict) :
+            consumed += len(b)
+    if not bindings is None and not isinstance(bindings, dict) :
+        bindings = bindings[consumed:]
+    return statements[pos:], bindings
+
+
+def splitStatements(sql) :
+    """ split SQL text into complete statements, eg. "create trigger ... begin ...; end;" is one statement """
+
+    statements = []
+    begin = 0
+    for i, c in enumerate(sql) :
+        if c == ';' and apsw.complete(sql[begin:i+1]) :
+            statements.append(sql[begin:i+1])
+            begin = i + 1
+    if len(sql[begin:].strip()) > 0 :
+        statements.append(sql[begin:])
+    return statements
+
+
+class Cursor(object) :
+    """ apsw.Cursor waiting for tables registered in background """
+
+    def __init__(self, cursor) :
+        self.cursor = cursor
+
+    def execute(self, statements, bindings = None) :
+        waited = set()
+        while True :
+            # statements of batch executed before missing table is found, they are not executed again
+            executed = []
+            tracer = self.cursor.getexectrace()
+            effective = tracer or self.cursor.getconnection().getexectrace()
+            def trace(cursor, sql, b) :
+                executed.append((sql, b))
+                return effective(cursor, sql, b) if not effective is None else True
+            self.cursor.setexectrace(trace)
+            try :
+                return self.cursor.execute(statements, bindings)
+            except apsw.SQLError, e :
+                remainder = getRemainder(statements, bindings, executed)
+                if remainder is None or not waitTable(e, waited) :
+                    raise
+                statements, bindings = remainder
+            finally :
+                self.cursor.setexectrace(tracer)
+
+    def __iter__(self) :
+        return iter(self.cursor)
+
+    def __getattr__(self, name) :
+        return getattr(self.cursor, name)
+
+
+class Shell(apsw.Shell) :
+    """ apsw.Shell waiting for tables registered in background """
+
+    def process_sql(self, sql, bindings = None, internal = False, summary = None) :
+        # statements of batch are processed one by one, so only the statement missing table is processed again.
+        # Note: sequence bindings are consumed by statements in turn, batch with them is not split.
+        split = bindings is None or isinstance(bindings, dict)
+        statements = splitStatements(sql) if split else [sql]
+        retriable = split or len(splitStatements(sql)) <= 1
+        for statement in statements :
+            waited = set()
+            while True :
+                try :
+                    # cursor of shell has its own tracer instead of tracer of connection, which should see each statement
+                    tracer = self.db.getexectrace()
+                    if not internal and not tracer is None :
+                        tracer(None, statement, bindings)
+                    apsw.Shell.process_sql(self, statement, bindings, internal, summary)
+                    break
+                except apsw.SQLError, e :
+                    # missing table is found when preparing statement, nothing of it is executed
+                    if not retriable or not waitTable(e, waited) :
+                        raise
+
+
 def getSQLFromFile(f) :
     text = ""
     with open(f) as fin :
@@ -23,21 +23,6 @@ def create(vs):
     );""" % tableName
   vs.ddls.update({tableName: ddl})
 
-  # full text search local storage table ddl
-  ddl4local = """
-    CREATE VIRTUAL TABLE %s USING fts4(
-      time timestamp,
-      node_name varchar(20),
-      host_name varchar(20),
-      component varchar(30),
-      message varchar(2322),
-      notindexed=time, 
-      notindexed=node_name, 
-      notindexed=host_name, 
-      notindexed=component
-    );""" % tableName
-  vs.ddls4local.update({tableName: ddl4local})
-
   cursor = None 
   try :
     cursor = vs.connection.cursor()
@@ -56,6 +41,8 @@ def create(vs):
     vs.tables[tableName].columnTypes[u"rowid"] = "integer"
     # primary keys
     vs.tables[tableName].primaryKeys = None
+    # local storage is full text index on message
+    vs.tables[tableName].fullTextColumns = ["message"]
   finally :
     if not cursor is None :
       cursor.close();
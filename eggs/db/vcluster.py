@@ -4,19 +4,63 @@
 # Description: Vertica cluster communication and configuration
 # Author: DingQiang Liu
 
-import os, atexit
+import os, sys, atexit
 import socket
+import getpass
+import threading
+import time
+import inspect
+import linecache
 from multiprocessing.dummy import Pool as ThreadPool
 from functools import partial
 import re
 from ConfigParser import ConfigParser
+import Queue
+from collections import deque
 import logging
 
 import execnet
 
+import db.vworker as vworker
+from util.threadlocal import threadlocal_get
+
 
 logger = logging.getLogger(__name__)
 
+# seconds between heartbeats to resident workers, and seconds waiting for their replies
+HEARTBEATINTERVAL = 10
+HEARTBEATTIMEOUT = 5
+# seconds before reconnecting dead or unreachable node, doubled after each failed attempt up to RECONNECTMAXDELAY
+RECONNECTDELAY = 5
+RECONNECTMAXDELAY = 300
+# seconds waiting for resident worker acknowledging a loaded module
+MODULELOADTIMEOUT = 60
+# deadlines for receiving results of a request: seconds for all nodes, default seconds for each node, and seconds for specific nodes {nodeName: seconds}.
+# None means no limit. They can be overridden for queries of current thread by threadlocal "QUERYTIMEOUT"/"NODETIMEOUT".
+# Deadlines are opt-in, as results of nodes given up at deadlines are partial(see v_query_status).
+QUERYTIMEOUT = None
+NODETIMEOUT = None
+NODETIMEOUTS = {}
+# clusters with more nodes than RELAYTHRESHOLD are reached through relay nodes, each relay connects(by its own ssh) RELAYFANOUT other nodes, 
+# so ssh encryption and connections on this host scale with number of relays. None to always connect every node directly.
+RELAYTHRESHOLD = 64
+RELAYFANOUT = 16
+# maximum concurrent remote scans on each node, None for no limit. Waiting scans are admitted round-robin between classes of SCANCLASSES, 
+# class of scans of current thread is threadlocal "SCANCLASS", default is DEFAULTSCANCLASS. Background classes leave last scan slot of each node to others.
+MAXNODESCANS = 2
+SCANCLASSES = ("ui", "shell", "sync", )
+BACKGROUNDSCANCLASSES = ("sync", )
+DEFAULTSCANCLASS = "shell"
+# seconds a scan waits for slots on all nodes before giving up nodes not admitted yet, None for no limit
+ADMISSIONTIMEOUT = 300
+# identical or covered scans attach to scan in flight instead of launching another. Results of scan are buffered for attaching later, 
+# until they exceed SHAREDSCANBUFFER bytes. None to disable sharing.
+SHAREDSCANBUFFER = 64 * 1024 * 1024
+# arguments of scans returning partial aggregates, SQLite does not re-filter their results by time, so they are only shared on same time range
+PARTIALRESULTARGS = ("aggregate", "sketch", )
+
+
+__g_verticaClusterLock = threading.RLock()
 
 def getVerticaCluster(vDbName = '', vMetaFile = '/opt/vertica/config/admintools.conf', vAdminOSUser = 'dbadmin'):
   """
@@ -31,24 +75,87 @@ def getVerticaCluster(vDbName = '', vMetaFile = '/opt/vertica/config/admintools.
   """
   global __g_verticaCluster
   
-  try:
-    if len(__g_verticaCluster.executors) == 0 :
-      __g_verticaCluster = None
-    return __g_verticaCluster
-  except NameError:
-    __g_verticaCluster = VerticaCluster(vDbName, vMetaFile, vAdminOSUser)
-    if len(__g_verticaCluster.executors) == 0 :
-      msg = "Vertica cluster is not accessible! You can not access newest info of Vertica."
-      print "ERROR: %s" % msg
-      logger.error(msg)
-
-      __g_verticaCluster = None
-    else :
+  # callers wait while it's connecting in background
+  with __g_verticaClusterLock :
+    try:
+      return __g_verticaCluster
+    except NameError:
+      __g_verticaCluster = VerticaCluster(vDbName, vMetaFile, vAdminOSUser)
+      if len(__g_verticaCluster.executors) == 0 :
+        msg = "Vertica cluster is not accessible now! It will be reconnected in background, you can not access newest info of Vertica until then."
+        print "ERROR: %s" % msg
+        logger.error(msg)
       # close VerticaCluster automatically when exiting
       atexit.register(destroyVerticaCluster)
 
-  return __g_verticaCluster
+    return __g_verticaCluster
+
+
+
+def receive(mch, handler, timeout=None, nodeTimeouts=None) :
+  """ receive results from all channels until they are closed or their deadlines pass. 
+  Channels of nodes not finished before deadlines are closed, results received from them before are kept.
+  Arguments:
+    mch: execnet.MultiChannel, one channel for each node
+    handler: function(channel, item), called for each received item
+    timeout: seconds for all nodes, default is threadlocal "QUERYTIMEOUT" or QUERYTIMEOUT
+    nodeTimeouts: {nodeName: seconds}, default is NODETIMEOUTS, other nodes use threadlocal "NODETIMEOUT" or NODETIMEOUT
+  Return: {nodeName: (status, seconds)}, status is "finished", "truncated"(timeout after receiving results) or "timeout", 
+    including nodes given up before scan(see VerticaCluster.remoteCall)
+  """
+
+  if timeout is None :
+    timeout = threadlocal_get("QUERYTIMEOUT") or QUERYTIMEOUT
+  nodeTimeout = threadlocal_get("NODETIMEOUT") or NODETIMEOUT
+  if nodeTimeouts is None :
+    nodeTimeouts = NODETIMEOUTS
+
+  tbegin = time.time()
+  channels = dict([ (channel.gateway.id, channel) for channel in mch ])
+  deadlines = {}
+  for nodeName in channels :
+    limits = [ t for t in (timeout, nodeTimeouts.get(nodeName, nodeTimeout)) if not t is None ]
+    deadlines[nodeName] = tbegin + min(limits) if len(limits) > 0 else None
+  received = set()
+  status = {}
+
+  # scan slots of nodes are released as soon as nodes are finished or given up
+  release = getattr(mch, "release", lambda nodeName: None)
+  try :
+    q = mch.make_receive_queue(endmarker=None)
+    while len(status) < len(channels) :
+      pending = [ deadlines[n] for n in channels if not n in status and not deadlines[n] is None ]
+      wait = max(min(pending) - time.time(), 0) if len(pending) > 0 else None
+      try :
+        channel, item = q.get(timeout=wait) if not wait is None else q.get()
+      except Queue.Empty :
+        now = time.time()
+        for nodeName, channel in channels.iteritems() :
+          if not nodeName in status and not deadlines[nodeName] is None and deadlines[nodeName] <= now :
+            status[nodeName] = ("truncated" if nodeName in received else "timeout", now - tbegin)
+            release(nodeName)
+            try :
+              channel.close()
+            except Exception :
+              pass
+        continue
+
+      nodeName = channel.gateway.id
+      if nodeName in status :
+        # late results of node given up
+        continue
+      if item is None :
+        status[nodeName] = ("finished", time.time() - tbegin)
+        release(nodeName)
+      else :
+        received.add(nodeName)
+        handler(channel, item)
+  finally :
+    for nodeName in channels :
+      release(nodeName)
 
+  status.update(getattr(mch, "skipped", {}))
+  return status
 
 
 def destroyVerticaCluster():
@@ -84,49 +191,662 @@ class VerticaCluster:
     self.vAdminOSUser = vAdminOSUser
 
     self.executors = execnet.Group()
+    # resident workers on each node, {nodeName: Worker}
+    self.workers = {}
+    # guards membership of executors and workers, changed by heartbeat
+    self.lock = threading.Lock()
+    # dead or unreachable nodes waiting for reconnecting, {nodeName: (failed attempts, time of next attempt)}
+    self.reconnects = {}
+    # relay node of each node reached through relay, {nodeName: relayNodeName}
+    self.relays = {}
+    # admission control of remote scans on each node, {nodeName: Admission}
+    self.admissions = dict([ (nodeName, Admission()) for nodeName in self.nodeNames ])
+    # scans in flight which can be shared, guarded by scansLock
+    self.scans = []
+    self.scansLock = threading.Lock()
 
     # create executors in parallel
     self.initExecutersParallel()
+    # start resident workers, they keep remote modules loaded and serve all following requests
+    self.initWorkers()
+    # nodes not accessible at startup will be re-admitted by heartbeat
+    for nodeName in self.nodeNames :
+      if not nodeName in self.workers :
+        self.removeNode(nodeName, "not accessible at startup")
+    self.startHeartbeat()
 
     
   def initExecutersParallel(self) :
+    indexes = range(len(self.hostIPs))
+    if not RELAYTHRESHOLD is None and len(self.hostIPs) > RELAYTHRESHOLD :
+      # tree topology: relays first, each of them followed by RELAYFANOUT nodes reached through it
+      relayIndexes = indexes[::RELAYFANOUT + 1]
+      self.relays = dict([ (self.nodeNames[i], self.nodeNames[i - i % (RELAYFANOUT + 1)]) for i in indexes if not i in relayIndexes ])
+      self.registerExecuters(relayIndexes)
+      indexes = [ i for i in indexes if not i in relayIndexes ]
+    self.registerExecuters(indexes)
+
+
+  def registerExecuters(self, indexes) :
     pool = ThreadPool()
-    gws = pool.map(self.createExecuter, range(len(self.hostIPs)))
+    gws = pool.map(self.createExecuter, indexes)
     pool.close()
     pool.join()
     for gw in gws :
-      if not gw is None:
+      # gateways through relays are already in executors
+      if not gw is None and not gw in self.executors :
         self.executors._register(gw)
     
 
-  def createExecuter(self, i) :
+  def getRelay(self, nodeName) :
+    """ gateway of relay node which node should be reached through, None for connecting node directly """
+
+    relayName = self.relays.get(nodeName, None)
+    if relayName is None :
+      return None
+    with self.lock :
+      relays = [ gw for gw in self.executors if gw.id == relayName ]
+    return relays[0] if len(relays) > 0 else None
+
+
+  def isLocal(self, i) :
+    """ whether node is the host this tool runs on with verticaAdminOSUser, only an address of local host can be bound """
+
+    if getpass.getuser() != self.vAdminOSUser :
+      return False
+    s = socket.socket()
+    try :
+      s.bind((self.hostIPs[i], 0))
+      return True
+    except Exception :
+      return False
+    finally :
+      s.close()
+
+
+  def createExecuter(self, i, verbose=True) :
     gw = None
     s = socket.socket()
+    spec = "ssh=%s@%s//id=%s//python=/opt/vertica/oss/python/bin/python" % (self.vAdminOSUser, self.hostIPs[i], self.nodeNames[i])
+    relay = self.getRelay(self.nodeNames[i])
     try:
-      # check connectivity 
-      s.settimeout(3)
-      s.connect((self.hostIPs[i], 22)) 
-    
-      tg = execnet.Group()
-      gw = tg.makegateway("ssh=%s@%s//id=%s//python=/opt/vertica/oss/python/bin/python" % (self.vAdminOSUser, self.hostIPs[i], self.nodeNames[i]))
-      tg._unregister(gw)
-      del gw._group
+      if not relay is None :
+        # ssh from relay node to this node. Gateway is created in executors, where relay is found by id, and torn down with them
+        gw = self.executors.makegateway(spec + "//via=%s" % relay.id)
+      else :
+        tg = execnet.Group()
+        if self.isLocal(i) :
+          # node this tool runs on, skip ssh encryption and its process
+          gw = tg.makegateway("popen//id=%s//python=/opt/vertica/oss/python/bin/python" % self.nodeNames[i])
+        else :
+          # check connectivity 
+          s.settimeout(3)
+          s.connect((self.hostIPs[i], 22)) 
+          gw = tg.makegateway(spec)
+        tg._unregister(gw)
+        del gw._group
     except Exception: 
       msg = "ssh port 22 of Vertica node %s(%s) with user %s is not accessible! Ignore it, but you can not access newest info of this node." % (self.nodeNames[i], self.hostIPs[i], self.vAdminOSUser) 
-      print "\nERROR: %s" % msg
-      logger.exception(msg)
+      if verbose :
+        print "\nERROR: %s" % msg
+        logger.exception(msg)
+      else :
+        logger.debug(msg)
     finally:
       s.close()
 
     return gw
 
 
+  def initWorkers(self) :
+    for gw in self.executors :
+      try :
+        self.workers[gw.id] = Worker(gw)
+      except Exception :
+        msg = "start worker on Vertica node %s failed! Ignore it, but you can not access newest info of this node." % gw.id
+        print "\nERROR: %s" % msg
+        logger.exception(msg)
+
+
+  def remoteCall(self, module, args, nodeNames=None) :
+    """ call module.filterdata(channel, args) by resident worker on each node.
+    Arguments:
+      module: Module
+        remote module with function filterdata(channel, args)
+      args: dictionary
+        arguments for filterdata
+      nodeNames: list of nodename, default is None for all nodes
+    Return: ScanSubscription, one channel for each node. Scan slots of nodes are held until they are released by receive().
+      Nodes without scan slot in ADMISSIONTIMEOUT seconds are skipped, and reported as "timeout" by receive().
+    """
+
+    with self.lock :
+      workers = [ self.workers[gw.id] for gw in self.executors if (nodeNames is None or gw.id in nodeNames) and gw.id in self.workers ]
+
+    # attach to identical or covering scan in flight
+    shareable = not SHAREDSCANBUFFER is None and isShareable(args)
+    if shareable :
+      with self.scansLock :
+        for scan in self.scans :
+          subscription = scan.attach(module, args, [ w.gateway.id for w in workers ])
+          if not subscription is None :
+            logger.debug("scan of [%s] attached to scan in flight with arguments [%s]" % (args, scan.args))
+            return subscription
+
+    scanClass = threadlocal_get("SCANCLASS") or DEFAULTSCANCLASS
+    channels = []
+    admitted = {}
+    # {nodeName: ("timeout", seconds)}
+    skipped = {}
+    tbegin = time.time()
+    deadline = tbegin + ADMISSIONTIMEOUT if not ADMISSIONTIMEOUT is None else None
+    # slots are acquired in order of node names, so concurrent scans never wait for each other circularly
+    for worker in sorted(workers, key=lambda w: w.gateway.id) :
+      # wait for a scan slot on node, all nodes share one deadline
+      with self.lock :
+        admission = self.admissions[worker.gateway.id]
+      try :
+        admission.acquire(scanClass, max(deadline - time.time(), 0) if not deadline is None else None)
+      except StandardError, e:
+        skipped[worker.gateway.id] = ("timeout", time.time() - tbegin)
+        logger.error("no scan slot on Vertica node %s! Ignore it, but you can not access newest info of this node because [%s]" % (worker.gateway.id, str(e)))
+        continue
+      try :
+        channels.append(worker.call(module, args))
+        admitted[worker.gateway.id] = admission
+      except execnet.RemoteError, e:
+        # module failed on node, gateway is still healthy
+        admission.release()
+        msg = "call %s on Vertica node %s failed! Ignore it, but you can not access newest info of this node." % (module.__name__, worker.gateway.id)
+        print "\nERROR: %s" % msg
+        logger.error("%s because [%s]" % (msg, str(e)))
+      except Exception, e:
+        admission.release()
+        # gateway is broken, reconnect it in background
+        self.removeNode(worker.gateway.id, str(e))
+
+    scan = SharedScan(self, module, args, channels, admitted)
+    subscription = scan.subscribe(scan.channels.keys())
+    subscription.skipped = skipped
+    if shareable :
+      with self.scansLock :
+        self.scans.append(scan)
+    scan.start()
+    return subscription
+
+
+  def removeScan(self, scan) :
+    with self.scansLock :
+      if scan in self.scans :
+        self.scans.remove(scan)
+
+
+  def startHeartbeat(self) :
+    self.stopHeartbeatEvent = threading.Event()
+    t = threading.Thread(target=self.heartbeat)
+    t.daemon = True
+    t.start()
+
+
+  def heartbeat(self) :
+    """ check resident workers every HEARTBEATINTERVAL seconds, remove dead ones, and re-admit dead or unreachable nodes with exponential backoff """
+
+    while not self.stopHeartbeatEvent.is_set() :
+      self.stopHeartbeatEvent.wait(HEARTBEATINTERVAL)
+      if self.stopHeartbeatEvent.is_set() :
+        break
+      try :
+        self.checkWorkers()
+        self.readmitNodes()
+      except Exception, e:
+        logger.exception("heartbeat of Vertica cluster because [%s]." % str(e))
+
+
+  def checkWorkers(self) :
+    """ ping all workers concurrently, remove nodes not replying in HEARTBEATTIMEOUT seconds """
+
+    with self.lock :
+      workers = self.workers.items()
+    pings = []
+    for nodeName, worker in workers :
+      try :
+        pings.append((nodeName, worker.ping()))
+      except Exception, e:
+        self.removeNode(nodeName, str(e))
+    deadline = time.time() + HEARTBEATTIMEOUT
+    for nodeName, channel in pings :
+      try :
+        channel.receive(timeout=max(deadline - time.time(), 0.01))
+      except Exception, e:
+        self.removeNode(nodeName, "no heartbeat in %s seconds: %s" % (HEARTBEATTIMEOUT, str(e)))
+
+
+  def removeNode(self, nodeName, reason) :
+    """ remove gateway and worker of node, it will be reconnected after RECONNECTDELAY seconds. 
+      Scan slots of node are reset, scans waiting for them give up the node.
+    """
+
+    with self.lock :
+      self.workers.pop(nodeName, None)
+      if nodeName in self.admissions :
+        self.admissions[nodeName].close(reason)
+        self.admissions[nodeName] = Admission()
+      gws = [ gw for gw in self.executors if gw.id == nodeName ]
+      for gw in gws :
+        self.executors._unregister(gw)
+      if not nodeName in self.reconnects :
+        self.reconnects[nodeName] = (0, time.time() + RECONNECTDELAY)
+    logger.error("Vertica node %s is removed because [%s], it will be reconnected in background." % (nodeName, reason))
+    for gw in gws :
+      try :
+        gw.exit()
+      except Exception :
+        pass
+
+
+  def readmitNodes(self) :
+    """ reconnect nodes whose next attempt is due, in parallel """
+
+    now = time.time()
+    with self.lock :
+      due = [ nodeName for nodeName, (attempts, nextTime) in self.reconnects.items() if nextTime <= now ]
+    if len(due) == 0 :
+      return
+    pool = ThreadPool(len(due))
+    pool.map(self.readmitNode, due)
+    pool.close()
+    pool.join()
+
+
+  def readmitNode(self, nodeName) :
+    gw = self.createExecuter(self.nodeNames.index(nodeName), verbose=False)
+    worker = None
+    if not gw is None :
+      try :
+        worker = Worker(gw)
+      except Exception, e:
+        logger.debug("start worker on Vertica node %s because [%s]" % (nodeName, str(e)))
+        try :
+          gw.exit()
+        except Exception :
+          pass
+
+    with self.lock :
+      if worker is None :
+        attempts = self.reconnects.get(nodeName, (0, 0))[0] + 1
+        self.reconnects[nodeName] = (attempts, time.time() + min(RECONNECTDELAY * 2 ** attempts, RECONNECTMAXDELAY))
+        return
+      if not gw in self.executors :
+        self.executors._register(gw)
+      self.workers[nodeName] = worker
+      self.reconnects.pop(nodeName, None)
+    logger.info("Vertica node %s is re-admitted." % nodeName)
+
+
   def destroy(self):
+    self.stopHeartbeatEvent.set()
     if not self.executors is None :
       self.executors.terminate()
       self.executors = None
 
 
+class Admission:
+  """ admission control of remote scans on a node: at most MAXNODESCANS scans run concurrently, 
+    waiting scans are admitted in turn of their classes(round-robin), and background classes leave last slot to other classes.
+  """
+
+  def __init__(self):
+    self.cond = threading.Condition()
+    self.running = 0
+    # waiting scans of each class, {scanClass: deque of tickets}
+    self.waiting = dict([ (c, deque()) for c in SCANCLASSES ])
+    self.classes = list(SCANCLASSES)
+    # class admitted last time, next turn begins from following class
+    self.lastClass = None
+    # reason of closing when node is removed, slots of closed admission are never admitted again
+    self.closed = None
+
+
+  def acquire(self, scanClass, timeout=None) :
+    """ wait for a scan slot, raise StandardError if it's not admitted in timeout seconds or node is removed """
+
+    ticket = object()
+    deadline = time.time() + timeout if not timeout is None else None
+    with self.cond :
+      if not scanClass in self.waiting :
+        self.waiting[scanClass] = deque()
+        self.classes.append(scanClass)
+      self.waiting[scanClass].append(ticket)
+      while self.getNext() != ticket :
+        wait = deadline - time.time() if not deadline is None else None
+        if not self.closed is None or (not wait is None and wait <= 0) :
+          self.waiting[scanClass].remove(ticket)
+          # maybe scans behind it can be admitted now
+          self.cond.notify_all()
+          raise StandardError("node is removed because [%s]" % self.closed if not self.closed is None else "not admitted in %s seconds" % timeout)
+        self.cond.wait(wait)
+      self.waiting[scanClass].popleft()
+      self.running += 1
+      self.lastClass = scanClass
+      # maybe more slots for others
+      self.cond.notify_all()
+
+
+  def release(self) :
+    with self.cond :
+      self.running -= 1
+      self.cond.notify_all()
+
+
+  def close(self, reason) :
+    """ node is removed, wake up waiting scans to give it up """
+
+    with self.cond :
+      self.closed = reason
+      self.cond.notify_all()
+
+
+  def getNext(self) :
+    """ ticket of scan should be admitted now, None if no slot for waiting scans """
+
+    if not MAXNODESCANS is None and self.running >= MAXNODESCANS :
+      return None
+    # round-robin from class following last admitted one
+    start = self.classes.index(self.lastClass) + 1 if self.lastClass in self.classes else 0
+    for scanClass in self.classes[start:] + self.classes[:start] :
+      if len(self.waiting[scanClass]) == 0 :
+        continue
+      if scanClass in BACKGROUNDSCANCLASSES and not MAXNODESCANS is None and MAXNODESCANS > 1 and self.running >= MAXNODESCANS - 1 :
+        continue
+      return self.waiting[scanClass][0]
+    return None
+
+
+def isShareable(args) :
+  """ scans following files(sync) keep state on nodes, they are never shared. 
+    Time range of multi-range scan is not in its predicates, it's not shared too.
+  """
+
+  return not "follow" in args and not "timeRanges" in args
+
+
+def getTimeRange(predicates) :
+  """ range of time(column 0) predicates. Return: (low, low inclusive, high, high inclusive), None for unbounded side """
+
+  low, lowInclusive, high, highInclusive = None, True, None, True
+  for op, value in predicates.get(0, []) :
+    if op in (2, 4, 32) and (low is None or value > low or value == low and op == 4) :
+      low, lowInclusive = value, op != 4
+    if op in (2, 8, 16) and (high is None or value < high or value == high and op == 16) :
+      high, highInclusive = value, op != 16
+  return low, lowInclusive, high, highInclusive
+
+
+def isTimeRangeCovered(outer, inner) :
+  """ whether time range inner is inside time range outer, both are from getTimeRange """
+
+  oLow, oLowInclusive, oHigh, oHighInclusive = outer
+  iLow, iLowInclusive, iHigh, iHighInclusive = inner
+  for o, i in ((oLow, iLow), (oHigh, iHigh)) :
+    if not o is None and not i is None and isinstance(o, basestring) != isinstance(i, basestring) :
+      return False
+  if not oLow is None and (iLow is None or iLow < oLow or iLow == oLow and iLowInclusive and not oLowInclusive) :
+    return False
+  if not oHigh is None and (iHigh is None or iHigh > oHigh or iHigh == oHigh and iHighInclusive and not oHighInclusive) :
+    return False
+  return True
+
+
+class SharedScan:
+  """ a remote scan on nodes delivering results to all its subscriptions. 
+    Subscriptions attaching later get buffered results first, rows outside their predicates are filtered by SQLite, as pushed down predicates are not omitted.
+    Partial aggregates are not filtered by SQLite, they are only shared by subscriptions with same time range.
+  """
+
+  def __init__(self, vc, module, args, channels, admissions):
+    self.vc = vc
+    self.module = module
+    self.args = args
+    self.timeRange = getTimeRange(args["predicates"])
+    # {nodeName: channel}
+    self.channels = dict([ (channel.gateway.id, channel) for channel in channels ])
+    # scan slots held on nodes, {nodeName: Admission}
+    self.admissions = admissions
+    self.lock = threading.RLock()
+    # results received, [(nodeName, item)], None when they exceed SHAREDSCANBUFFER
+    self.buffer = []
+    self.bufferSize = 0
+    self.finished = set()
+    # subscriptions still receiving from each node, {nodeName: set of ScanSubscription}
+    self.subscriptions = dict([ (nodeName, set()) for nodeName in self.channels ])
+
+
+  def start(self) :
+    for nodeName, channel in self.channels.iteritems() :
+      channel.setcallback(partial(self.onItem, nodeName), endmarker=None)
+
+
+  def attach(self, module, args, nodeNames) :
+    """ subscribe to this scan if it returns all results of scan with module, args on nodes. Return: ScanSubscription, None if not match """
+
+    if module.__name__ != self.module.__name__ or any([ args.get(k, None) != self.args.get(k, None) for k in set(args.keys() + self.args.keys()) if k != "predicates" ]) :
+      return None
+    predicates, scanPredicates = args["predicates"], self.args["predicates"]
+    if any([ predicates.get(k, None) != scanPredicates.get(k, None) for k in set(predicates.keys() + scanPredicates.keys()) if k != 0 ]) :
+      return None
+    timeRange = getTimeRange(predicates)
+    if any([ k in args for k in PARTIALRESULTARGS ]) :
+      # buckets out of time range of subscriber can not be removed from partial aggregates
+      if timeRange != self.timeRange :
+        return None
+    elif not isTimeRangeCovered(self.timeRange, timeRange) :
+      return None
+    with self.lock :
+      if self.buffer is None or not set(nodeNames).issubset(self.channels.keys()) :
+        return None
+      return self.subscribe(nodeNames)
+
+
+  def subscribe(self, nodeNames) :
+    with self.lock :
+      subscription = ScanSubscription(self, [ self.channels[n] for n in nodeNames ])
+      for nodeName, item in self.buffer :
+        if nodeName in subscription.channels :
+          subscription.put(nodeName, item)
+      for nodeName in nodeNames :
+        if nodeName in self.finished :
+          subscription.put(nodeName, None)
+        else :
+          self.subscriptions[nodeName].add(subscription)
+      return subscription
+
+
+  def onItem(self, nodeName, item) :
+    """ called in receiver thread of gateway for each item, and None when channel is closed """
+
+    # Note: registry of scans is never touched with self.lock held, as attach() is called with registry locked
+    removed = False
+    with self.lock :
+      if item is None :
+        self.finished.add(nodeName)
+        removed = len(self.finished) == len(self.channels)
+      elif not self.buffer is None :
+        self.buffer.append((nodeName, item))
+        self.bufferSize += len(item) if isinstance(item, basestring) else 0
+        if self.bufferSize > SHAREDSCANBUFFER :
+          # too large to keep, no more attaching
+          self.buffer = None
+          removed = True
+      for subscription in self.subscriptions[nodeName] :
+        subscription.put(nodeName, item)
+      if item is None :
+        self.subscriptions[nodeName] = set()
+    if removed :
+      self.vc.removeScan(self)
+    if item is None :
+      self.release(nodeName)
+
+
+  def detach(self, subscription, nodeName) :
+    """ subscription stops receiving from node, node is given up when no subscription receives from it """
+
+    with self.lock :
+      subscriptions = self.subscriptions[nodeName]
+      if not subscription in subscriptions :
+        return
+      subscriptions.discard(subscription)
+      if len(subscriptions) > 0 or nodeName in self.finished :
+        return
+      # later subscriptions can not get complete results of node
+      self.buffer = None
+    self.vc.removeScan(self)
+    try :
+      self.channels[nodeName].close()
+    except Exception :
+      pass
+    self.release(nodeName)
+
+
+  def release(self, nodeName) :
+    with self.lock :
+      admission = self.admissions.pop(nodeName, None)
+    if not admission is None :
+      admission.release()
+
+
+class ScanSubscription:
+  """ results of a SharedScan for a receiver, used as execnet.MultiChannel by receive() """
+
+  def __init__(self, scan, channels):
+    self.scan = scan
+    # {nodeName: SubscribedChannel}
+    self.channels = dict([ (channel.gateway.id, SubscribedChannel(self, channel)) for channel in channels ])
+    self.queue = Queue.Queue()
+    # nodes given up before scan, {nodeName: (status, seconds)}
+    self.skipped = {}
+
+
+  def __len__(self) :
+    return len(self.channels)
+
+
+  def __iter__(self) :
+    return iter(self.channels.values())
+
+
+  def make_receive_queue(self, endmarker=None) :
+    """ queue of (channel, item), item is None when channel is closed """
+
+    return self.queue
+
+
+  def put(self, nodeName, item) :
+    self.queue.put((self.channels[nodeName], item))
+
+
+  def release(self, nodeName) :
+    """ stop receiving from node """
+
+    self.scan.detach(self, nodeName)
+
+
+class SubscribedChannel:
+  """ channel of node in a ScanSubscription, closing it only stops this subscription receiving from node """
+
+  def __init__(self, subscription, channel):
+    self.subscription = subscription
+    self.gateway = channel.gateway
+
+
+  def close(self) :
+    self.subscription.release(self.gateway.id)
+
+
+class Worker:
+  """ resident worker on a Vertica node. 
+    Filter modules are sent and compiled only once, and each request is served by its own channel, 
+    so concurrent requests are multiplexed on one gateway and state of modules on node persists between queries.
+  """
+
+  def __init__(self, gw):
+    self.gateway = gw
+    self.channel = gw.remote_exec(vworker)
+    self.loaded = set()
+    # modules being loaded, {name: {"done": threading.Event, "error": Exception}}
+    self.loading = {}
+    self.lock = threading.Lock()
+
+
+  def call(self, module, args) :
+    """ call module.filterdata(channel, args) on node
+    Arguments:
+      module: Module
+      args: dictionary
+    Return: execnet channel for results of this request
+    """
+
+    # modules which module depends on should be loaded first
+    for name in getattr(module, "REMOTEMODULES", []) + [module.__name__] :
+      self.load(name)
+    with self.lock :
+      channel = self.gateway.newchannel()
+      self.channel.send(("call", module.__name__, args, channel))
+
+    return channel
+
+
+  def load(self, name) :
+    """ send module to worker if it's not loaded yet. Acknowledge of worker is waited without self.lock, 
+    so heartbeat and calls of loaded modules are not blocked, and concurrent callers wait for the same loading.
+    """
+
+    loadchannel = None
+    with self.lock :
+      if name in self.loaded :
+        return
+      pending = self.loading.get(name, None)
+      if pending is None :
+        m = sys.modules[name]
+        # module generated on coordinator carries its source, eg. dstat of clustermon
+        source = getattr(m, "REMOTESOURCE", None)
+        if source is None :
+          linecache.updatecache(inspect.getsourcefile(m))
+          source = inspect.getsource(m)
+        loadchannel = self.gateway.newchannel()
+        self.channel.send(("load", name, source, loadchannel))
+        pending = self.loading[name] = {"done": threading.Event(), "error": None}
+
+    if loadchannel is None :
+      if not pending["done"].wait(MODULELOADTIMEOUT) :
+        raise StandardError("module [%s] is not loaded on node %s in %s seconds" % (name, self.gateway.id, MODULELOADTIMEOUT))
+    else :
+      try :
+        # module is loaded only when worker acknowledges it, a failure raises execnet.RemoteError with its traceback
+        loadchannel.receive(timeout=MODULELOADTIMEOUT)
+      except Exception, e:
+        pending["error"] = e
+      with self.lock :
+        # failed loading is tried again by next call
+        self.loading.pop(name, None)
+        if pending["error"] is None :
+          self.loaded.add(name)
+      pending["done"].set()
+    if not pending["error"] is None :
+      raise pending["error"]
+
+
+  def ping(self) :
+    """ ask worker for heartbeat
+    Return: execnet channel receiving reply of worker
+    """
+
+    with self.lock :
+      channel = self.gateway.newchannel()
+      self.channel.send(("ping", channel))
+
+    return channel
+
+
 def getVerticaDBConfig(vDbName = '', vMetaFile = '/opt/vertica/config/admintools.conf'):
   """ get configurations of Vertica database
   Arguments:
@@ -4,6 +4,7 @@
 # Description: SQLite virtual tables for Vertica data collectors
 # Author: DingQiang Liu
 
+import json
 import logging
 
 import db.vcluster as vcluster
@@ -12,23 +13,162 @@ import db.vdatacollectors_filterdata as vdatacollectors_filterdata
 
 logger = logging.getLogger(__name__)
 
+# name of aggregate pushdown table, eg. select node_name, sum(count), max(max) from dc_aggregate('dc_resource_acquisitions', 'memory_inuse_kb', 0) group by node_name
+AGGREGATETABLE = "dc_aggregate"
+# name of sketch table, eg. select approx_percentile(ddsketch, 0.99), approx_count_distinct(hll) from dc_sketch('dc_requests_issued', 'session_id', 3600, null) group by time
+SKETCHTABLE = "dc_sketch"
+# hidden columns of datacollector tables for sampling on nodes, eg. select * from dc_requests_issued(0.01, 42) 
+SAMPLECOLUMNS = ["sample_rate", "sample_seed"]
+# local cache of DDLs, columns, types and primary keys of datacollectors, valid while signature(Vertica version and DDL files listing) of catalog not changed
+CACHETABLE = "sync_catalog"
+
 
 def create(vs):
-  """ create and register virtual tables for Vertica datacollectors."""
+  """ create and register companion virtual tables for Vertica datacollectors, they do not depend on catalog of cluster."""
+
+  cursor = None 
+  try :
+    cursor = vs.connection.cursor()
+    schemaname = ""
+    if vs.connection.filename != "" :
+      schemaname = "v_internal"
+
+    # companion virtual table for aggregate pushdown on datacollectors
+    tableName = AGGREGATETABLE
+    ddl = """
+      CREATE TABLE %s (
+        time timestamp,
+        node_name varchar(20),
+        column_name varchar(128),
+        count integer,
+        sum,
+        min,
+        max,
+        table_name hidden varchar(128),
+        column_list hidden varchar(1000),
+        bucket_seconds hidden integer
+      );""" % tableName
+    vs.ddls.update({tableName: ddl})
+    cursor.execute("create virtual table %s using verticasource(aggregate)" % (tableName if schemaname == "" else schemaname+"."+tableName))
+    vs.tables[tableName].remotefiltermodule = vdatacollectors_filterdata
+    vs.tables[tableName].columns = [u"rowid", u"time", u"node_name", u"column_name", u"count", u"sum", u"min", u"max"]
+    vs.tables[tableName].hiddenColumns = {7: "table_name", 8: "column_list", 9: "bucket_seconds"}
+    vs.tables[tableName].primaryKeys = None
+
+    # companion virtual table for sketches on datacollectors
+    tableName = SKETCHTABLE
+    ddl = """
+      CREATE TABLE %s (
+        time timestamp,
+        node_name varchar(20),
+        column_name varchar(128),
+        group_value varchar(128),
+        count integer,
+        hll blob,
+        ddsketch blob,
+        table_name hidden varchar(128),
+        column_list hidden varchar(1000),
+        bucket_seconds hidden integer,
+        group_column hidden varchar(128)
+      );""" % tableName
+    vs.ddls.update({tableName: ddl})
+    cursor.execute("create virtual table %s using verticasource(sketch)" % (tableName if schemaname == "" else schemaname+"."+tableName))
+    vs.tables[tableName].remotefiltermodule = vdatacollectors_filterdata
+    vs.tables[tableName].columns = [u"rowid", u"time", u"node_name", u"column_name", u"group_value", u"count", u"hll", u"ddsketch"]
+    vs.tables[tableName].hiddenColumns = {7: "table_name", 8: "column_list", 9: "bucket_seconds", 10: "group_column"}
+    vs.tables[tableName].primaryKeys = None
+  finally :
+    if not cursor is None :
+      cursor.close();
+
+
+def fetch(vs):
+  """ get datacollectors from local cache, or from catalog of cluster if its signature changed. 
+  If signature of catalog is not available(eg. cluster is not accessible), datacollectors cached last time are used.
+  Return: (signature, {tableName: {"ddl": ddl, "columns": [...], "columnTypes": {...}, "primaryKeys": [...]}}), 
+    only "ddl" is available if they are not from cache. signature is None if catalog is not from cluster.
+  """
 
-  vc = vcluster.getVerticaCluster()
-  if vc is None or len(vc.executors) == 0 :
-    msg = "cluster is not accessible! You'd better restart this tool." 
-    print "ERROR: %s", msg
+  signature = None
+  try :
+    vc = vcluster.getVerticaCluster()
+    if not vc is None and len(vc.executors) > 0 :
+      signature = vc.executors[0].remote_exec(getSignature, catalogpath=vc.catPath).receive()
+  except Exception, e:
+    logger.debug("get signature of catalog because [%s]" % str(e), exc_info=True)
+
+  if signature is None :
+    tables = loadCache(vs, None)
+    msg = "cluster is not accessible now! %s Others will be registered when it's accessible." \
+        % ("%s datacollectors are registered from local cache." % len(tables) if len(tables) > 0 else "Datacollectors are not registered.")
+    print "ERROR: %s" % msg
     logger.error(msg)
-    return
+    return None, tables
+
+  tables = loadCache(vs, signature)
+  if len(tables) > 0 :
+    logger.info("%s datacollectors are loaded from local cache, signature of catalog is [%s]." % (len(tables), signature))
+    return signature, tables
 
   ddls = vc.executors[0].remote_exec(getDDLs, catalogpath=vc.catPath).receive()
+  return signature, dict([ (tableName, {"ddl": ddl}) for tableName, ddl in ddls.iteritems() ])
+
+
+def loadCache(vs, signature) :
+  """ load cached datacollectors with signature of catalog, or cached last time if signature is None. 
+  Return: {tableName: {"ddl", "columns", "columnTypes", "primaryKeys"}}, only "ddl" is available for tables failed registering last time.
+  """
+
+  # no cache for in-memory database
+  connection = vs.connectLocal()
+  if connection is None :
+    return {}
+  cursor = connection.cursor()
+  try :
+    cursor.execute("create table if not exists main.%s (table_name varchar(128) PRIMARY KEY, signature varchar(128), ddl, columns, column_types, primary_keys) WITHOUT ROWID" % CACHETABLE)
+    sql = "select table_name, ddl, columns, column_types, primary_keys from main.%s" % CACHETABLE
+    tables = {}
+    for tableName, ddl, columns, columnTypes, primaryKeys in cursor.execute(sql + (" where signature = ?" if not signature is None else ""), (signature, ) if not signature is None else None) :
+      tables[tableName] = {"ddl": ddl}
+      if not columns is None :
+        tables[tableName].update({"columns": json.loads(columns), "columnTypes": json.loads(columnTypes), "primaryKeys": json.loads(primaryKeys)})
+    return tables
+  finally :
+    cursor.close()
+    connection.close()
 
-  #TODO: debug dc_requests_issued
-  #ddls = {"dc_requests_issued": ddls["dc_requests_issued"]}
 
-  vs.ddls.update(ddls)
+def saveCache(vs, signature, tables) :
+  """ replace cached datacollectors with all tables in catalog if they are not from cache. 
+  Columns of tables failed registering are not cached, they are computed again when they are registered next time.
+  """
+
+  if signature is None or all([ "cached" in t for t in tables.itervalues() ]) :
+    return
+  connection = vs.connectLocal()
+  if connection is None :
+    return
+  cursor = connection.cursor()
+  try :
+    with connection :
+      cursor.execute("delete from main.%s" % CACHETABLE)
+      sql = "insert into main.%s values (?, ?, ?, ?, ?, ?)" % CACHETABLE
+      cursor.executemany(sql, ( (tableName, signature, t["ddl"]) + ((json.dumps(t["columns"]), json.dumps(t["columnTypes"]), json.dumps(t["primaryKeys"])) \
+          if "columns" in t else (None, None, None)) for tableName, t in tables.iteritems() ))
+    logger.info("%s datacollectors are cached locally, signature of catalog is [%s]." % (len(tables), signature))
+  finally :
+    cursor.close()
+    connection.close()
+
+
+def register(vs, tableName, t):
+  """ create and register virtual table for a Vertica datacollector.
+  Arguments:
+    t: {"ddl", "columns", "columnTypes", "primaryKeys"} from fetch(), columns, types and primary keys are computed and kept in it if they are not from cache.
+  """
+
+  ddl = t["ddl"]
+  vs.ddls[tableName] = ddl
 
   cursor = None 
   try :
@@ -37,46 +177,96 @@ def create(vs):
     if vs.connection.filename != "" :
       schemaname = "v_internal"
 
-    for tableName in ddls :
+    # hidden columns are only for virtual table, local storage keeps original ddl
+    pos = ddl.rfind(");")
+    vs.ddls4vtab[tableName] = ddl[:pos] + ",\n  sample_rate float hidden,\n  sample_seed integer hidden\n" + ddl[pos:]
+    try :
       cursor.execute("create virtual table %s using verticasource" % (tableName if schemaname == "" else schemaname+"."+tableName))
-      vs.tables[tableName].remotefiltermodule = vdatacollectors_filterdata
-
-    for tableName in ddls :
-      columns = [ columnName.lower() for _, columnName, _, _, _, _ in cursor.execute("pragma table_info('%s');" % tableName) ]
-      columns.insert(0, u"rowid")
-      vs.tables[tableName].columns = columns        
-      # only keep the first part of SQL typename
-      vs.tables[tableName].columnTypes = { columnName.lower(): columnType.split(' ')[0].split('(')[0].lower() for _, columnName, columnType, _, _, _ in cursor.execute("pragma table_info('%s');" % tableName) }
-      vs.tables[tableName].columnTypes[u"rowid"] = "integer"
-      # primary keys
-      primaryKeys = ["time", "node_name"]
-      if "transaction_id" in columns and "statement_id" in columns  and "path_id" in columns :
-        primaryKeys.append("transaction_id")
-        primaryKeys.append("statement_id")
-        primaryKeys.append("path_id")
-      elif "transaction_id" in columns and "statement_id" in columns  and "projection_oid" in columns :
-        primaryKeys.append("transaction_id")
-        primaryKeys.append("statement_id")
-        primaryKeys.append("projection_oid")
-      elif "transaction_id" in columns and "statement_id" in columns  and "sip_expr_id" in columns :
-        primaryKeys.append("transaction_id")
-        primaryKeys.append("statement_id")
-        primaryKeys.append("sip_expr_id")
-      elif "transaction_id" in columns and "statement_id" in columns :
-        primaryKeys.append("transaction_id")
-        primaryKeys.append("statement_id")
-      else :
-          for col in {"transaction_id", "txn_id", "session_id", "pool", "pool_name", "oid", "start_commit_id", "commit_epoch", "event_name", "device_name", "interface_id", "remote_node_name", "token_rounds", "path", "feature"} :
-            if col in columns :
-              primaryKeys.append(col)
-              break
-
-      vs.tables[tableName].primaryKeys = primaryKeys
+    except :
+      # table object is kept by Create() even if its ddl is rejected, forget it to register it again later
+      vs.tables.pop(tableName, None)
+      raise
+    vs.tables[tableName].remotefiltermodule = vdatacollectors_filterdata
+    vs.tables[tableName].watermarked = True
+    vs.tables[tableName].partitioned = True
+    if tableName.endswith("_by_second") :
+      vs.tables[tableName].resolution = 1
+    elif tableName.endswith("_by_minute") :
+      vs.tables[tableName].resolution = 60
+
+    if "columns" in t :
+      t["cached"] = True
+    else :
+      t.update(getColumnsInfo(cursor, tableName))
+    columns = t["columns"]
+    vs.tables[tableName].columns = columns        
+    vs.tables[tableName].columnTypes = t["columnTypes"]
+    # hidden columns follow all columns
+    vs.tables[tableName].hiddenColumns = dict([ (len(columns) - 1 + i, c) for i, c in enumerate(SAMPLECOLUMNS) ])
+    vs.tables[tableName].primaryKeys = t["primaryKeys"]
   finally :
     if not cursor is None :
       cursor.close();
 
 
+def getColumnsInfo(cursor, tableName) :
+  """ columns, types and primary keys of registered datacollector virtual table. Return: {"columns", "columnTypes", "primaryKeys"} """
+
+  columns = [ columnName.lower() for _, columnName, _, _, _, _ in cursor.execute("pragma table_info('%s');" % tableName) ]
+  columns.insert(0, u"rowid")
+  # only keep the first part of SQL typename
+  columnTypes = { columnName.lower(): columnType.split(' ')[0].split('(')[0].lower() for _, columnName, columnType, _, _, _ in cursor.execute("pragma table_info('%s');" % tableName) }
+  columnTypes[u"rowid"] = "integer"
+  # primary keys
+  primaryKeys = ["time", "node_name"]
+  if "transaction_id" in columns and "statement_id" in columns  and "path_id" in columns :
+    primaryKeys.append("transaction_id")
+    primaryKeys.append("statement_id")
+    primaryKeys.append("path_id")
+  elif "transaction_id" in columns and "statement_id" in columns  and "projection_oid" in columns :
+    primaryKeys.append("transaction_id")
+    primaryKeys.append("statement_id")
+    primaryKeys.append("projection_oid")
+  elif "transaction_id" in columns and "statement_id" in columns  and "sip_expr_id" in columns :
+    primaryKeys.append("transaction_id")
+    primaryKeys.append("statement_id")
+    primaryKeys.append("sip_expr_id")
+  elif "transaction_id" in columns and "statement_id" in columns :
+    primaryKeys.append("transaction_id")
+    primaryKeys.append("statement_id")
+  else :
+      for col in {"transaction_id", "txn_id", "session_id", "pool", "pool_name", "oid", "start_commit_id", "commit_epoch", "event_name", "device_name", "interface_id", "remote_node_name", "token_rounds", "path", "feature"} :
+        if col in columns :
+          primaryKeys.append(col)
+          break
+
+  return {"columns": columns, "columnTypes": columnTypes, "primaryKeys": primaryKeys}
+
+
+def getSignature(channel, catalogpath):
+  """ signature of datacollectors in catalog: Vertica version and hash of DDL files listing(name, size, modified time), without reading files """
+  import os
+  import glob
+  import hashlib
+  import subprocess
+
+  nodeName = channel.gateway.id.split('-')[0] # remove the tailing '-slave'
+  path = '%s/%s_catalog/DataCollector' % (catalogpath, nodeName)
+
+  version = ""
+  try :
+    version = subprocess.Popen(["/opt/vertica/bin/vertica", "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0].strip().split("\n")[0]
+  except Exception :
+    pass
+
+  listing = hashlib.md5()
+  for f in sorted(glob.glob(path + "/CREATE_*.sql")) :
+    st = os.stat(f)
+    listing.update("%s:%s:%s\n" % (os.path.basename(f), st.st_size, int(st.st_mtime)))
+
+  if not channel.isclosed():
+    channel.send("%s:%s" % (version, listing.hexdigest()))
+
 
 def getDDLs(channel, catalogpath):
   import os
@@ -9,6 +9,27 @@ from multiprocessing.dummy import Pool as ThreadPool
 from functools import partial
 import os, sys
 import glob
+import math
+import random
+
+import db.vsketch as vsketch
+
+
+# modules should be loaded before this module on remote node
+REMOTEMODULES = ["db.vsketch"]
+# filterdata accepts args["timeRanges"], union of time ranges searched in turn in one request
+MULTITIMERANGES = True
+
+INTEGERTYPES = ('integer', 'int', 'bigint', 'smallint', 'mediumint', 'tinyint', 'int2', 'int8', )
+TIMETYPES = ('date', 'datetime', 'timestamp', )
+FLOATTYPES = ('double', 'float', 'real', 'decimal', 'numeric', )
+
+# time range of datacollector log files, kept between queries by resident worker. {filename: ((inode, size, mtime), first time, last time)}
+FILETIMERANGES = {}
+# end of records sent for sync, kept between sync passes by resident worker. {filename: (inode, offset, last time)}
+FILEOFFSETS = {}
+# bytes read from end of file for its last record, doubled until a complete record is found
+TAILBYTES = 64 * 1024
 
 
 def prevRow(lines, recBegin, nFrom=None, nTo=None):
@@ -78,145 +99,532 @@ def nextRow(lines, recBegin, nFrom=None, nTo=None):
             row.append(columnValue.decode('string_escape'))
 
 
-def parseFile(f, args):
-    predicates = args["predicates"]
-    columns = args["columns"]
-    nodenum = args["nodenum"]
-    rowWidth = len(columns) - 1 + 2
+def sampleRows(lines, recBegin, rowWidth, rate, rng, nFrom=None, nTo=None):
+    """
+    get Bernoulli sample of rows from front end. Records have fixed number of lines, 
+    so unsampled records are skipped by their offset without parsing.
 
-    data = []
+    args : 
+    * lines: list of lines
+    * recBegin: mark for record begin.
+    * rowWidth: number of lines of a record
+    * rate: probability of each record being sampled, 0 < rate < 1
+    * rng: random.Random
+    * nFrom: low bound of line number
+    * nTo: upper bound of line number
+
+    return : 
+    * row: list of values.
+    """
+
+    pos = 0 if nFrom is None else nFrom
+    end = len(lines) if nTo is None else min(nTo, len(lines))
+    logRate = math.log(1.0 - rate)
+    while True :
+        # number of records skipped before next sampled one is geometric distributed
+        pos += int(math.log(1.0 - rng.random()) / logRate) * rowWidth
+        # re-align on record begin
+        while pos < end and lines[pos][:-1] != recBegin :
+            pos += 1
+        if pos >= end :
+            break
+        row = None
+        for nextPos, row in nextRow(lines, recBegin, pos, min(pos + rowWidth, end)) : break
+        if row is None :
+            pos += 1
+        else :
+            pos = nextPos
+            yield row
+
+
+def inTimeRange(firstTime, lastTime, minPredOp, minPredValue, maxPredOp, maxPredValue):
+    """
+    whether any time between firstTime and lastTime may match predicates.
+    """
+
+    #operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
+    if not minPredOp is None :
+        if (minPredOp in (2, 32, )) and (lastTime < minPredValue) or (minPredOp == 4) and (lastTime <= minPredValue) :
+            return False
+    if not maxPredOp is None :
+        if (maxPredOp in (2, 8, )) and (firstTime > maxPredValue) or (maxPredOp == 16) and (firstTime >= maxPredValue) :
+            return False
+    return True
 
-    recBegin=":DC" + args["tabletag"]
+
+def getTimeBounds(timePredicates):
+    """
+    tightest bounds of time predicates.
+
+    args :
+    * timePredicates: [[op, value], ...], operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
+
+    return : (minPredOp, minPredValue, maxPredOp, maxPredValue), or None if no time can match predicates.
+    """
 
     minPredOp, minPredValue, maxPredOp, maxPredValue = None, None, None, None
-    if 0 in predicates :
-        for op, val in predicates[0] :
-            #operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
-            if op in (2, 4, 32, ) :
-                if not minPredValue is None and ((val > minPredValue) and (minPredOp == 2) or (val < minPredValue) and (op == 2)) :
-                    return None
-                if minPredValue is None or (val >= minPredValue) and (op <= minPredOp) :
-                    minPredOp, minPredValue = op, val
-            if op in (2, 16, 8, ) :
-                if not maxPredValue is None and ((val < maxPredValue) and (maxPredOp == 2) or (val > maxPredValue) and (op == 2)) :
-                    return None
-                if maxPredValue is None or (val <= maxPredValue) and (op,maxPredOp, ) in ((2,16,), (2,8,), (16,8,),) :
-                    maxPredOp, maxPredValue = op, val
+    for op, val in timePredicates :
+        #operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
+        if op in (2, 4, 32, ) :
+            if not minPredValue is None and ((val > minPredValue) and (minPredOp == 2) or (val < minPredValue) and (op == 2)) :
+                return None
+            if minPredValue is None or (val >= minPredValue) and (op <= minPredOp) :
+                minPredOp, minPredValue = op, val
+        if op in (2, 16, 8, ) :
+            if not maxPredValue is None and ((val < maxPredValue) and (maxPredOp == 2) or (val > maxPredValue) and (op == 2)) :
+                return None
+            if maxPredValue is None or (val <= maxPredValue) and (op,maxPredOp, ) in ((2,16,), (2,8,), (16,8,),) :
+                maxPredOp, maxPredValue = op, val
     if not minPredValue is None and not maxPredValue is None and minPredValue > maxPredValue :
         return None
+    return minPredOp, minPredValue, maxPredOp, maxPredValue
+
+
+def seekRows(lines, recBegin, rowWidth, minPredOp, minPredValue, maxPredOp, maxPredValue):
+    """
+    binary search on time for line number range of rows matching time bounds.
+
+    return : (minPos, maxPos) for nextRow, or None if no row matches.
+    """
+
+    # binary search on time. operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
+    minPos, maxPos = None, None
+    # check first line from min side
+    pos, row = None, None
+    for pos, row in nextRow(lines, recBegin) : break
+    if row is None :
+        return None
+    if not maxPredOp is None :
+        time = long(row[0])
+        if ((maxPredOp==2) and(time > maxPredValue) or (maxPredOp==16) and (time >= maxPredValue) or (maxPredOp==8) and (time > maxPredValue)) :
+            return None
+    # move first line from min side
+    if not minPredOp is None :
+        minPos = minPos if not minPos is None else 0 
+        tmpMaxPos = maxPos if not maxPos is None else len(lines)
+        while not row is None :
+            time = long(row[0])
+            if (pos - minPos == rowWidth) and ((minPredOp==2) and (time == minPredValue) or (minPredOp==4) and (time > minPredValue) or (minPredOp==32) and (time >= minPredValue)) :
+                # found the first!
+                minPos = pos - rowWidth # minPos/maxPos is  line number range of row, pos is line number of next row
+                break
+            elif ((minPredOp==2) and (time < minPredValue) or (minPredOp==4) and (time <= minPredValue) or (minPredOp==32) and (time < minPredValue)) :
+                # move a half up
+                minPos = pos
+            else :
+                # move a half down
+                tmpMaxPos = pos - rowWidth # minPos/maxPos is  line number range of row, pos is line number of next row
+            pos, row = None, None
+            for pos, row in nextRow(lines, recBegin, minPos + (tmpMaxPos - minPos)/2/rowWidth*rowWidth, tmpMaxPos) : break
+    # check last line from max side
+    pos, row = None, None
+    for pos, row in prevRow(lines, recBegin) : break
+    if not minPredOp is None :
+        time = long(row[0])
+        if ((minPredOp==2) and (time < minPredValue) or (minPredOp==4) and (time <= minPredValue) or (minPredOp==32) and (time < minPredValue)) :
+            return None
+    # move last line from max side
+    if not maxPredOp is None :
+        tmpMinPos = minPos - 1 if not minPos is None else None # -1 for comming prevRow generator
+        maxPos = maxPos - 1 if not maxPos is None else len(lines) - 1
+        while not row is None :
+            time = long(row[0])
+            if (maxPos - pos == rowWidth) and ((maxPredOp==2) and(time == maxPredValue) or (maxPredOp==16) and (time < maxPredValue) or (maxPredOp==8) and (time <= maxPredValue)) :
+                # found the last!
+                maxPos = pos + rowWidth + 1 # more +1 for comming nextRow generator. # minPos/maxPos is  line number range of row, pos is line number of previous row 
+                break
+            elif ((maxPredOp==2) and(time > maxPredValue) or (maxPredOp==16) and (time >= maxPredValue) or (maxPredOp==8) and (time > maxPredValue)) :
+                # move a half down
+                maxPos = pos
+            else :
+                # move a half up
+                tmpMinPos = pos + rowWidth
+            pos, row = None, None
+            for pos, row in prevRow(lines, recBegin, maxPos - (maxPos - (tmpMinPos if not tmpMinPos is None else -1))/2/rowWidth*rowWidth, tmpMinPos) : break
+        if row is None :
+            maxPos = maxPos + 1 # more +1 for comming nextRow generator
+
+    return minPos, maxPos
+
+
+def readRows(f, args):
+    """
+    generate rows matching time predicates in datacollector log file.
+
+    args :
+    * f: filename
+    * args: {"columns", "predicates", "tabletag", "sample": {"rate", "seed"}(optional), 
+        "timeRanges": [[[op, value], ...], ...](optional, sorted disjoint time ranges, each is a list of time predicates, for union of them)}
+
+    return :
+    * row: list of column values, same order as table columns(without rowid).
+    """
+
+    predicates = args["predicates"]
+    columns = args["columns"]
+    rowWidth = len(columns) - 1 + 2
+
+    recBegin=":DC" + args["tabletag"]
+
+    # bounds of each time range, file is opened once and searched for ranges in turn
+    timeRanges = args.get("timeRanges", None)
+    if timeRanges is None :
+        timeRanges = [ predicates[0] ] if 0 in predicates else None
+    else :
+        # other time predicates(eg. since) apply to each range
+        timeRanges = [ r + predicates.get(0, []) for r in timeRanges ]
+    bounds = None
+    if not timeRanges is None :
+        bounds = [ b for b in (getTimeBounds(r) for r in timeRanges) if not b is None ]
+        if len(bounds) == 0 :
+            return
+
+    # skip file out of time range without reading it, if it has not been changed since last query
+    try :
+        st = os.stat(f)
+    except OSError :
+        # datacollectors file rotating
+        return
+    statKey = (st.st_ino, st.st_size, st.st_mtime)
+    if not bounds is None and f in FILETIMERANGES :
+        key, firstTime, lastTime = FILETIMERANGES[f]
+        if key == statKey :
+            bounds = [ b for b in bounds if inTimeRange(firstTime, lastTime, *b) ]
+            if len(bounds) == 0 :
+                return
+
+    sample = args.get("sample", None)
+    if not sample is None :
+        # same seed gets same sample of unchanged file
+        rng = random.Random("%s:%s" % (sample["seed"], os.path.basename(f))) if not sample["seed"] is None else random.Random()
+        records = lambda lines, nFrom=None, nTo=None: sampleRows(lines, recBegin, rowWidth, sample["rate"], rng, nFrom, nTo)
+    else :
+        records = lambda lines, nFrom=None, nTo=None: (row for _, row in nextRow(lines, recBegin, nFrom, nTo))
 
     try :
         with open(f) as fin :
             lines = fin.readlines()
-            if 0 in predicates :
-                # binary search on time. operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
-                minPos, maxPos = None, None
-                # check first line from min side
-                pos, row = None, None
-                for pos, row in nextRow(lines, recBegin) : break
-                if row is None :
-                    return None
-                if not maxPredOp is None :
-                    time = long(row[0])
-                    if ((maxPredOp==2) and(time > maxPredValue) or (maxPredOp==16) and (time >= maxPredValue) or (maxPredOp==8) and (time > maxPredValue)) :
-                        return None
-                # move first line from min side
-                if not minPredOp is None :
-                    minPos = minPos if not minPos is None else 0 
-                    tmpMaxPos = maxPos if not maxPos is None else len(lines)
-                    while not row is None :
-                        time = long(row[0])
-                        if (pos - minPos == rowWidth) and ((minPredOp==2) and (time == minPredValue) or (minPredOp==4) and (time > minPredValue) or (minPredOp==32) and (time >= minPredValue)) :
-                            # found the first!
-                            minPos = pos - rowWidth # minPos/maxPos is  line number range of row, pos is line number of next row
-                            break
-                        elif ((minPredOp==2) and (time < minPredValue) or (minPredOp==4) and (time <= minPredValue) or (minPredOp==32) and (time < minPredValue)) :
-                            # move a half up
-                            minPos = pos
-                        else :
-                            # move a half down
-                            tmpMaxPos = pos - rowWidth # minPos/maxPos is  line number range of row, pos is line number of next row
-                        pos, row = None, None
-                        for pos, row in nextRow(lines, recBegin, minPos + (tmpMaxPos - minPos)/2/rowWidth*rowWidth, tmpMaxPos) : break
-                # check last line from max side
-                pos, row = None, None
-                for pos, row in prevRow(lines, recBegin) : break
-                if not minPredOp is None :
-                    time = long(row[0])
-                    if ((minPredOp==2) and (time < minPredValue) or (minPredOp==4) and (time <= minPredValue) or (minPredOp==32) and (time < minPredValue)) :
-                        return None
-                # move last line from max side
-                if not maxPredOp is None :
-                    tmpMinPos = minPos - 1 if not minPos is None else None # -1 for comming prevRow generator
-                    maxPos = maxPos - 1 if not maxPos is None else len(lines) - 1
-                    while not row is None :
-                        time = long(row[0])
-                        if (maxPos - pos == rowWidth) and ((maxPredOp==2) and(time == maxPredValue) or (maxPredOp==16) and (time < maxPredValue) or (maxPredOp==8) and (time <= maxPredValue)) :
-                            # found the last!
-                            maxPos = pos + rowWidth + 1 # more +1 for comming nextRow generator. # minPos/maxPos is  line number range of row, pos is line number of previous row 
-                            break
-                        elif ((maxPredOp==2) and(time > maxPredValue) or (maxPredOp==16) and (time >= maxPredValue) or (maxPredOp==8) and (time > maxPredValue)) :
-                            # move a half down
-                            maxPos = pos
-                        else :
-                            # move a half up
-                            tmpMinPos = pos + rowWidth
-                        pos, row = None, None
-                        for pos, row in prevRow(lines, recBegin, maxPos - (maxPos - (tmpMinPos if not tmpMinPos is None else -1))/2/rowWidth*rowWidth, tmpMinPos) : break
-                    if row is None :
-                        maxPos = maxPos + 1 # more +1 for comming nextRow generator
-
-                # get result after predicates
-                for _, row in nextRow(lines, recBegin, minPos, maxPos) :
-                    time = long(row[0])
-                    # rowid = time * 10000 + nodenum
-                    row.insert(0, str(time*10000 + nodenum))
-                    data.append('\1'.join(row))
+            if not f in FILETIMERANGES or FILETIMERANGES[f][0] != statKey :
+                firstRow, lastRow = None, None
+                for _, firstRow in nextRow(lines, recBegin) : break
+                for _, lastRow in prevRow(lines, recBegin) : break
+                if not firstRow is None and not lastRow is None :
+                    FILETIMERANGES[f] = (statKey, long(firstRow[0]), long(lastRow[0]))
+            if not bounds is None :
+                for b in bounds :
+                    positions = seekRows(lines, recBegin, rowWidth, *b)
+                    if positions is None :
+                        continue
+                    # get result after predicates
+                    for row in records(lines, *positions) :
+                        yield row
             else :
-                # rowid = time * 10000 + nodenum
-                data = [ "%s\1%s" % (str(long(row[0])*10000 + nodenum), '\1'.join(row)) for _, row in nextRow(lines, recBegin) ]
+                for row in records(lines) :
+                    yield row
 
     except IOError, e :
         # ignore "IOError: [Errno 2] No such file or directory...", when datacollectors file rotating
         if 'No such file or directory' in str(e) :
             pass
+
+
+def followFile(f, args, mark):
+    """
+    get rows appended to datacollector log file since last sync, which ended on high-water mark. 
+    If file only grows since last sync, just read its tail from end of last sent record.
+
+    args :
+    * f: filename
+    * args: {"columns", "tabletag"}
+    * mark: time of last row synced from this file, None for never synced
+
+    return :
+    * rows: list of rows, row is list of column values, same order as table columns(without rowid).
+    * lastTime: new high-water mark of file, None if file is empty or not existing.
+    """
+
+    recBegin=":DC" + args["tabletag"]
+    try :
+        st = os.stat(f)
+    except OSError :
+        # datacollectors file rotating
+        return [], None
+
+    offset = 0
+    cached = FILEOFFSETS.get(f, None)
+    if not mark is None and not cached is None and cached[0] == st.st_ino and cached[2] == mark and cached[1] <= st.st_size :
+        offset = cached[1]
+
+    try :
+        with open(f) as fin :
+            fin.seek(offset)
+            data = fin.read()
+    except IOError :
+        return [], mark
+
+    # only complete records, the last one maybe is being written
+    end = data.rfind("\n.\n") + 3 if data.rfind("\n.\n") >= 0 else 0
+    lines = data[:end].splitlines(True)
+    if offset > 0 :
+        # all records after offset are new
+        rows = [ row for _, row in nextRow(lines, recBegin) ]
+    else :
+        rows = [ row for _, row in nextRow(lines, recBegin) if mark is None or long(row[0]) > mark ]
+
+    lastTime = mark
+    if len(rows) > 0 :
+        lastTime = max([ long(row[0]) for row in rows ] + ([mark] if not mark is None else []))
+    FILEOFFSETS[f] = (st.st_ino, offset + end, lastTime)
+
+    return rows, lastTime
+
+
+def lastRecordTime(f, recBegin):
+    """
+    get time of last complete record in datacollector log file, by only reading its tail.
+
+    return : time of last record, None if file is empty or not existing.
+    """
+
+    try :
+        with open(f) as fin :
+            fin.seek(0, os.SEEK_END)
+            size = fin.tell()
+            tail = TAILBYTES
+            while True :
+                offset = max(size - tail, 0)
+                fin.seek(offset)
+                lines = fin.read(size - offset).splitlines(True)
+                if offset > 0 :
+                    # first line maybe partial
+                    lines = lines[1:]
+                for _, row in prevRow(lines, recBegin) :
+                    return long(row[0])
+                if offset == 0 :
+                    return None
+                tail *= 2
+    except IOError :
+        return None
+
+
+def formatRows(rows, nodenum):
+    # rowid = time * 10000 + nodenum
+    data = [ "%s\1%s" % (str(long(row[0])*10000 + nodenum), '\1'.join(row)) for row in rows ]
     if len(data) > 0 :
         return '\2'.join(data)
     else :
         return None
 
 
-if __name__ == '__channelexec__' or __name__ == '__main__' :
-    # ignore stderr message when 'non-unicode character' == u'...' : UnicodeWarning: Unicode equal comparison failed to convert both arguments to Unicode - interpreting them as being unequal
-    sys.stderr = open(os.devnull, 'w')
+def parseFile(f, args):
+    return formatRows(readRows(f, args), args["nodenum"])
+
+
+def toValue(sqltype, value):
+    """
+    convert text value in datacollector log file for aggregation.
+
+    return : long/float for numeric, timestamp(Vertica inner long format) and boolean types, str for others, None for empty or incorrect value.
+    """
+
+    if len(value) == 0 :
+        return None
+    try :
+        if sqltype in INTEGERTYPES or sqltype in TIMETYPES :
+            # convert unsigned long to negative long. Note: INTEGER is numeric(18,0) in Vertica
+            lValue = long(value)
+            if lValue <= 0x7fffffffffffffff :
+                return lValue
+            else :
+                return lValue - 0x10000000000000000
+        elif sqltype in FLOATTYPES :
+            return float(value)
+        elif sqltype == 'boolean' :
+            return 1 if 'true' == value.lower() else 0
+        else :
+            return value
+    except ValueError :
+        return None
+
+
+def mergeAggregate(groups, key, partial):
+    """
+    merge partial aggregate into groups.
+
+    args :
+    * groups: {key: [count, sum, min, max]}
+    * key: group key
+    * partial: [count, sum, min, max]
+    """
+
+    agg = groups.get(key, None)
+    if agg is None :
+        groups[key] = list(partial)
+        return
+    count, total, minValue, maxValue = partial
+    agg[0] += count
+    if not total is None :
+        agg[1] = total if agg[1] is None else agg[1] + total
+    if not minValue is None and (agg[2] is None or minValue < agg[2]) :
+        agg[2] = minValue
+    if not maxValue is None and (agg[3] is None or maxValue > agg[3]) :
+        agg[3] = maxValue
+
+
+def aggregateFile(f, args, groups):
+    """
+    compute partial aggregates of rows in datacollector log file, grouped by time bucket and column.
+
+    args :
+    * f: filename
+    * args: {"columns", "columnTypes", "predicates", "tabletag", "aggregate": {"columns", "bucket"}}
+    * groups: {(bucket, columnName): [count, sum, min, max]}, column "*" for count(*). 
+    """
+
+    columns = args["columns"]
+    columnTypes = args["columnTypes"]
+    aggregate = args["aggregate"]
+    # bucket: seconds to microseconds, 0 for no time bucket
+    bucket = long(aggregate["bucket"] or 0) * 1000000
+    # index of column in row, rowid is not in row
+    aggColumns = [ (c, columns.index(c) - 1, columnTypes[columns.index(c)]) for c in aggregate["columns"] ]
+
+    for row in readRows(f, args) :
+        time = long(row[0])
+        timeBucket = time - time % bucket if bucket > 0 else None
+        mergeAggregate(groups, (timeBucket, "*"), [1, None, None, None])
+        for columnName, i, sqltype in aggColumns :
+            value = toValue(sqltype, row[i])
+            if value is None :
+                continue
+            # no sum for timestamp and string
+            total = value if (sqltype in INTEGERTYPES or sqltype in FLOATTYPES or sqltype == 'boolean') else None
+            mergeAggregate(groups, (timeBucket, columnName), [1, total, value, value])
+
+
+def sketchFile(f, args, groups):
+    """
+    build sketches of rows in datacollector log file, grouped by time bucket, column and value of group column.
+
+    args :
+    * f: filename
+    * args: {"columns", "columnTypes", "predicates", "tabletag", "sketch": {"columns", "bucket", "groupColumn"}}
+    * groups: {(bucket, columnName, groupValue): [count, HyperLogLog, DDSketch or None]}, DDSketch only for numeric columns.
+    """
+
+    columns = args["columns"]
+    columnTypes = args["columnTypes"]
+    sketch = args["sketch"]
+    # bucket: seconds to microseconds, 0 for no time bucket
+    bucket = long(sketch["bucket"] or 0) * 1000000
+    # index of column in row, rowid is not in row
+    sketchColumns = [ (c, columns.index(c) - 1, columnTypes[columns.index(c)]) for c in sketch["columns"] ]
+    groupIndex = columns.index(sketch["groupColumn"]) - 1 if sketch.get("groupColumn", None) else None
+
+    for row in readRows(f, args) :
+        time = long(row[0])
+        timeBucket = time - time % bucket if bucket > 0 else None
+        groupValue = row[groupIndex] if not groupIndex is None else None
+        for columnName, i, sqltype in sketchColumns :
+            value = row[i]
+            if len(value) == 0 :
+                continue
+            key = (timeBucket, columnName, groupValue)
+            sketches = groups.get(key, None)
+            if sketches is None :
+                sketches = [0, vsketch.HyperLogLog(), vsketch.DDSketch() if (sqltype in INTEGERTYPES or sqltype in FLOATTYPES) else None]
+                groups[key] = sketches
+            sketches[0] += 1
+            sketches[1].add(value)
+            if not sketches[2] is None :
+                number = toValue(sqltype, value)
+                if not number is None :
+                    sketches[2].add(number)
+
+
+def filterdata(channel, args):
+    """
+    parse datacollector log files of table on this node, send filtered rows back through channel.
+
+    args :
+    * channel: execnet channel
+    * args: {"catalogpath", "tablename", "columns", "predicates", "keywords", 
+        "follow": {"checkpoints": {nodeName: {filename: last time}}, "since": {nodeName: last time}}(optional, for sync),
+        "since": {nodeName: last time}(optional, only rows after high-water mark of local storage),
+        "timeRanges": [[[op, value], ...], ...](optional, sorted disjoint time ranges for union of them, searched in turn in each file)}
+    """
 
     nodeName = channel.gateway.id.split('-')[0] # remove the tailing '-slave'
-    args = channel.receive()
     args["nodenum"] = int(nodeName[-4:])
     tablename = args["tablename"]
     catalogpath = args["catalogpath"]
   
     
-    # predicate by node. predicates={columnIndx: [[predicate1:value1, predicate2:value2]]}
-    operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
-    predicates = args["predicates"]
-    if not 1 in predicates or all([eval("nodeName %s val" % operators[op]) for op, val in predicates[1]]) :
-        # log filename rule from tablename: remove leading 'dc_', remove '_' and capitalize first character of each word
-        tabletag = "".join([w.capitalize() for w in tablename.split('_')[1:] ])
-        args["tabletag"] = tabletag
-        path = '%s/%s_catalog/DataCollector' % (catalogpath, nodeName)
-    
-        # TODO: why multiple threads parsing not benifit for performance? The bottleneck is on I/O performance of my laptop?
-        data = [ parseFile(f, args) for f in glob.glob(path + "/" + tabletag + "_*.log") ]
-        data = [x for x in data if x is not None] # ignore empty file
+    # node_name predicates have been resolved by coordinator, requests only come to matching nodes.
+    if nodeName in args.get("since", {}) :
+        args["predicates"].setdefault(0, []).append([4, args["since"][nodeName]])
+    # log filename rule from tablename: remove leading 'dc_', remove '_' and capitalize first character of each word
+    tabletag = "".join([w.capitalize() for w in tablename.split('_')[1:] ])
+    args["tabletag"] = tabletag
+    path = '%s/%s_catalog/DataCollector' % (catalogpath, nodeName)
+
+    files = glob.glob(path + "/" + tabletag + "_*.log")
+    # forget rotated files
+    for f in [ k for k in FILETIMERANGES.keys() if k.startswith(path + "/" + tabletag + "_") and not k in files ] :
+        FILETIMERANGES.pop(f, None)
+    for f in [ k for k in FILEOFFSETS.keys() if k.startswith(path + "/" + tabletag + "_") and not k in files ] :
+        FILEOFFSETS.pop(f, None)
+
+    if "follow" in args :
+        # send newest time on node first, so coordinator knows how far it lags behind even if results are truncated, 
+        # then rows newer than high-water mark of each file, then new high-water marks
+        newest = [ t for t in (lastRecordTime(f, ":DC" + tabletag) for f in files) if not t is None ]
+        if not channel.isclosed() and len(newest) > 0 :
+            channel.send({"newest": {"node": nodeName, "time": max(newest)}})
+        marks = args["follow"]["checkpoints"].get(nodeName, {})
+        since = args["follow"]["since"].get(nodeName, None)
+        checkpoints = {}
+        for f in files :
+            filename = os.path.basename(f)
+            rows, lastTime = followFile(f, args, marks.get(filename, since))
+            if not lastTime is None :
+                checkpoints[filename] = lastTime
+            data = formatRows(rows, args["nodenum"])
+            if not channel.isclosed() and not data is None :
+                channel.send(data)
+        if not channel.isclosed() :
+            channel.send({"checkpoints": {"node": nodeName, "files": checkpoints}})
+        return
+
+    if "aggregate" in args :
+        # only send partial aggregates back, their size is proportional to number of groups, not rows.
+        groups = {}
+        for f in files :
+            aggregateFile(f, args, groups)
+        if not channel.isclosed() and len(groups) > 0 :
+            channel.send({"aggregates": [ [timeBucket, nodeName, columnName] + agg for (timeBucket, columnName), agg in groups.iteritems() ]})
+        return
+
+    if "sketch" in args :
+        # only send serialized sketches back
+        groups = {}
+        for f in files :
+            sketchFile(f, args, groups)
+        if not channel.isclosed() and len(groups) > 0 :
+            channel.send({"sketches": [ [timeBucket, nodeName, columnName, groupValue, count, hll.serialize(), ddsketch.serialize() if not ddsketch is None else None] \
+                for (timeBucket, columnName, groupValue), (count, hll, ddsketch) in groups.iteritems() ]})
+        return
+
+    # TODO: why multiple threads parsing not benifit for performance? The bottleneck is on I/O performance of my laptop?
+    data = [ parseFile(f, args) for f in files ]
+    data = [x for x in data if x is not None] # ignore empty file
   
-        #pool = ThreadPool()
-        #data = pool.map( partial(parseFile, args=args) , glob.glob(path + "/" + tabletag + "_*.log") )
-        #pool.close()
-        #pool.join()
-        #data = [x for x in data if x is not None] # ignore empty file
+    #pool = ThreadPool()
+    #data = pool.map( partial(parseFile, args=args) , glob.glob(path + "/" + tabletag + "_*.log") )
+    #pool.close()
+    #pool.join()
+    #data = [x for x in data if x is not None] # ignore empty file
   
-        if not channel.isclosed() and len(data) > 0 :
-            channel.send('\2'.join(data))
-            data = []
-
+    if not channel.isclosed() and len(data) > 0 :
+        channel.send('\2'.join(data))
+        data = []
@@ -349,27 +349,26 @@ def parseFile(f, args):
         return None
 
 
-if __name__ == '__channelexec__' or __name__ == '__main__' :
-    # ignore stderr message when 'non-unicode character' == u'...' : UnicodeWarning: Unicode equal comparison failed to convert both arguments to Unicode - interpreting them as being unequal
-    sys.stderr = open(os.devnull, 'w')
+def filterdata(channel, args):
+    """
+    parse dbLog on this node, send filtered rows back through channel.
+
+    args :
+    * channel: execnet channel
+    * args: {"catalogpath", "tablename", "columns", "predicates", "keywords"}
+    """
 
     nodeName = channel.gateway.id.split('-')[0] # remove the tailing '-slave'
-    args = channel.receive()
     args["nodeName"] = nodeName
 
     catalogpath = args["catalogpath"]
   
     
-    # predicate by node. predicates={columnIndx: [[predicate1:value1, predicate2:value2]]}
-    operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
-    predicates = args["predicates"]
-
-    if not 1 in predicates or all([eval("nodeName %s val" % operators[op]) for op, val in predicates[1]]) :
-        path = '%s/dbLog' % catalogpath
-        data = [ parseFile(path, args) ]
-        data = [x for x in data if x is not None] # ignore empty file
+    # node_name predicates have been resolved by coordinator, requests only come to matching nodes.
+    path = '%s/dbLog' % catalogpath
+    data = [ parseFile(path, args) ]
+    data = [x for x in data if x is not None] # ignore empty file
   
-        if not channel.isclosed() and len(data) > 0 :
-            channel.send('\2'.join(data))
-            data = []
-
+    if not channel.isclosed() and len(data) > 0 :
+        channel.send('\2'.join(data))
+        data = []
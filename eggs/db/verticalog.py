@@ -31,31 +31,6 @@ def create(vs):
     );""" % tableName
   vs.ddls.update({tableName: ddl})
 
-  # full text search local storage table ddl
-  ddl4local = """
-    CREATE VIRTUAL TABLE %s USING fts4(
-      time timestamp,
-      node_name varchar(20),
-      thread_name varchar(60),
-      thread_id varchar(28),
-      transaction_id integer,
-      component varchar(30),
-      level varchar(20),
-      elevel varchar(20),
-      enode varchar(20),
-      message varchar(2322),
-      notindexed=time, 
-      notindexed=node_name, 
-      notindexed=thread_name, 
-      notindexed=thread_id, 
-      notindexed=transaction_id, 
-      notindexed=component, 
-      notindexed=level, 
-      notindexed=elevel,
-      notindexed=enode
-    );""" % tableName
-  vs.ddls4local.update({tableName: ddl4local})
-
   cursor = None 
   try :
     cursor = vs.connection.cursor()
@@ -75,6 +50,8 @@ def create(vs):
     vs.tables[tableName].columnTypes[u"rowid"] = "integer"
     # primary keys
     vs.tables[tableName].primaryKeys = None
+    # local storage is full text index on message
+    vs.tables[tableName].fullTextColumns = ["message"]
   finally :
     if not cursor is None :
       cursor.close();
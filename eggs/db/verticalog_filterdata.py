@@ -440,25 +440,24 @@ def parseFileWithFilter(filename, args):
         return parseFile(filename, args)
 
 
-if __name__ == '__channelexec__' or __name__ == '__main__' :
-    # ignore stderr message when 'non-unicode character' == u'...' : UnicodeWarning: Unicode equal comparison failed to convert both arguments to Unicode - interpreting them as being unequal
-    sys.stderr = open(os.devnull, 'w')
+def filterdata(channel, args):
+    """
+    parse vertica.log on this node, send filtered rows back through channel.
+
+    args :
+    * channel: execnet channel
+    * args: {"catalogpath", "tablename", "columns", "predicates", "keywords"}
+    """
 
     nodeName = channel.gateway.id.split('-')[0] # remove the tailing '-slave'
-    args = channel.receive()
     args["nodeName"] = nodeName
 
     catalogpath = args["catalogpath"]
   
     
-    # predicate by node. predicates={columnIndx: [[predicate1:value1, predicate2:value2]]}
-    operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
-    predicates = args["predicates"]
-
-    if not 1 in predicates or all([eval("nodeName %s val" % operators[op]) for op, val in predicates[1]]) :
-        path = '%s/%s_catalog/' % (catalogpath, nodeName)
-        data = [ parseFileWithFilter(path + "vertica.log", args) ]
-        if not channel.isclosed() and len(data) > 0 :
-            channel.send('\2'.join(r for r in data if r is not None))
-            data = []
-
+    # node_name predicates have been resolved by coordinator, requests only come to matching nodes.
+    path = '%s/%s_catalog/' % (catalogpath, nodeName)
+    data = [ parseFileWithFilter(path + "vertica.log", args) ]
+    if not channel.isclosed() and len(data) > 0 :
+        channel.send('\2'.join(r for r in data if r is not None))
+        data = []
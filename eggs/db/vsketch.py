@@ -0,0 +1,226 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P. 
+# Description: mergeable sketches for approximate distinct count and quantiles, built on each node and merged on coordinator
+# Author: DingQiang Liu
+
+import math
+import struct
+import hashlib
+import zlib
+
+
+class HyperLogLog:
+    """ HyperLogLog sketch for approximate distinct count. """
+
+    def __init__(self, p=12, registers=None):
+        """
+        args :
+        * p: precision, 2**p registers, standard error is about 1.04/sqrt(2**p)
+        * registers: bytearray of registers, for deserialized sketch
+        """
+
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if not registers is None else bytearray(self.m)
+
+    def add(self, value):
+        if isinstance(value, unicode) :
+            value = value.encode("utf-8")
+        x = struct.unpack("<Q", hashlib.md5(str(value)).digest()[:8])[0]
+        idx = x >> (64 - self.p)
+        w = x & ((1 << (64 - self.p)) - 1)
+        # position of leftmost 1-bit in remaining bits
+        rank = (64 - self.p) - w.bit_length() + 1
+        if rank > self.registers[idx] :
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        if other.p != self.p :
+            raise ValueError("can not merge HyperLogLog with different precision %s and %s" % (self.p, other.p))
+        registers = self.registers
+        for i, r in enumerate(other.registers) :
+            if r > registers[i] :
+                registers[i] = r
+        return self
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum([ 2.0 ** -r for r in self.registers ])
+        zeros = len([ r for r in self.registers if r == 0 ])
+        if estimate <= 2.5 * m and zeros > 0 :
+            # small range correction: linear counting
+            estimate = m * math.log(float(m) / zeros)
+        return long(round(estimate))
+
+    def serialize(self):
+        return zlib.compress(struct.pack("<B", self.p) + str(self.registers))
+
+    @staticmethod
+    def deserialize(s):
+        s = zlib.decompress(str(s))
+        p = struct.unpack("<B", s[0])[0]
+        return HyperLogLog(p, bytearray(s[1:]))
+
+
+class DDSketch:
+    """ DDSketch for approximate quantiles with relative accuracy guarantee. """
+
+    def __init__(self, relativeAccuracy=0.01):
+        self.relativeAccuracy = relativeAccuracy
+        self.gamma = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+        self.logGamma = math.log(self.gamma)
+        # {bucket index: count}
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def key(self, value):
+        return int(math.ceil(math.log(value) / self.logGamma))
+
+    def value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value):
+        value = float(value)
+        if value > 0 :
+            k = self.key(value)
+            self.positive[k] = self.positive.get(k, 0) + 1
+        elif value < 0 :
+            k = self.key(-value)
+            self.negative[k] = self.negative.get(k, 0) + 1
+        else :
+            self.zeros += 1
+        self.count += 1
+        if self.min is None or value < self.min :
+            self.min = value
+        if self.max is None or value > self.max :
+            self.max = value
+
+    def merge(self, other):
+        if other.relativeAccuracy != self.relativeAccuracy :
+            raise ValueError("can not merge DDSketch with different relative accuracy %s and %s" % (self.relativeAccuracy, other.relativeAccuracy))
+        for k, c in other.positive.iteritems() :
+            self.positive[k] = self.positive.get(k, 0) + c
+        for k, c in other.negative.iteritems() :
+            self.negative[k] = self.negative.get(k, 0) + c
+        self.zeros += other.zeros
+        self.count += other.count
+        if not other.min is None and (self.min is None or other.min < self.min) :
+            self.min = other.min
+        if not other.max is None and (self.max is None or other.max > self.max) :
+            self.max = other.max
+        return self
+
+    def quantile(self, q):
+        if self.count == 0 or q < 0 or q > 1 :
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        result = None
+        # from the most negative value to the most positive value
+        for k in sorted(self.negative, reverse=True) :
+            seen += self.negative[k]
+            if seen > rank :
+                result = -self.value(k)
+                break
+        if result is None :
+            seen += self.zeros
+            if seen > rank :
+                result = 0.0
+        if result is None :
+            for k in sorted(self.positive) :
+                seen += self.positive[k]
+                if seen > rank :
+                    result = self.value(k)
+                    break
+        if result is None :
+            result = self.max
+        # exact value is known at both ends
+        return min(max(result, self.min), self.max)
+
+    def serialize(self):
+        parts = [ struct.pack("<dqqdd", self.relativeAccuracy, self.zeros, len(self.positive), self.min or 0.0, self.max or 0.0) ]
+        parts.extend([ struct.pack("<iq", k, c) for k, c in self.positive.iteritems() ])
+        parts.extend([ struct.pack("<iq", k, c) for k, c in self.negative.iteritems() ])
+        return zlib.compress("".join(parts))
+
+    @staticmethod
+    def deserialize(s):
+        s = zlib.decompress(str(s))
+        headerSize = struct.calcsize("<dqqdd")
+        pairSize = struct.calcsize("<iq")
+        relativeAccuracy, zeros, positiveCount, minValue, maxValue = struct.unpack("<dqqdd", s[:headerSize])
+        sketch = DDSketch(relativeAccuracy)
+        pairs = [ struct.unpack("<iq", s[i:i+pairSize]) for i in range(headerSize, len(s), pairSize) ]
+        sketch.positive = dict(pairs[:positiveCount])
+        sketch.negative = dict(pairs[positiveCount:])
+        sketch.zeros = zeros
+        sketch.count = zeros + sum(sketch.positive.itervalues()) + sum(sketch.negative.itervalues())
+        if sketch.count > 0 :
+            sketch.min, sketch.max = minValue, maxValue
+        return sketch
+
+
+def mergeSketch(groups, key, partial):
+    """
+    merge partial sketches into groups.
+
+    args :
+    * groups: {key: [count, HyperLogLog, DDSketch or None]}
+    * key: group key
+    * partial: [count, HyperLogLog, DDSketch or None]
+    """
+
+    sketches = groups.get(key, None)
+    if sketches is None :
+        groups[key] = list(partial)
+        return
+    sketches[0] += partial[0]
+    sketches[1].merge(partial[1])
+    if not partial[2] is None :
+        if sketches[2] is None :
+            sketches[2] = partial[2]
+        else :
+            sketches[2].merge(partial[2])
+
+
+def createFunctions(connection):
+    """
+    register SQL aggregate functions merging serialized sketches on connection:
+    * approx_count_distinct(hll): approximate distinct count
+    * approx_percentile(ddsketch, q): approximate q-quantile, q in [0, 1]
+    """
+
+    def countDistinctFactory():
+        def step(context, blob):
+            if not blob is None :
+                sketch = HyperLogLog.deserialize(blob)
+                if context[0] is None :
+                    context[0] = sketch
+                else :
+                    context[0].merge(sketch)
+        def final(context):
+            return context[0].count() if not context[0] is None else 0
+        return [None], step, final
+
+    def percentileFactory():
+        def step(context, blob, q):
+            if not blob is None :
+                sketch = DDSketch.deserialize(blob)
+                if context[0] is None :
+                    context[0] = sketch
+                else :
+                    context[0].merge(sketch)
+            context[1] = q
+        def final(context):
+            return context[0].quantile(float(context[1])) if not context[0] is None else None
+        return [None, None], step, final
+
+    connection.createaggregatefunction("approx_count_distinct", countDistinctFactory, 1)
+    connection.createaggregatefunction("approx_percentile", percentileFactory, 2)
@@ -14,9 +14,14 @@ import time
 from dateutil import parser as datetimeparser
 from decimal import Decimal
 import struct
+import re
 from operator import ior
 from itertools import islice
+from collections import deque
 import logging
+import weakref
+
+import apsw
 
 import db.vcluster as vcluster
 import db.vdatacollectors as vdatacollectors
@@ -24,48 +29,100 @@ import db.verticalog as verticalog
 import db.vdblog as vdblog
 import db.messages as messages
 import db.vsourceparser as vsourceparser
+import db.vdatacollectors_filterdata as vdatacollectors_filterdata
+import db.vsketch as vsketch
+import db.vstorage as vstorage
+from util.threadlocal import threadlocal_set, threadlocal_get
 
 
 logger = logging.getLogger(__name__)
 
-
-def getLastSQLiteActivityTime() :
-  global __g_LastSQLiteActivityTime
-  try:
-    if not __g_LastSQLiteActivityTime is None :
-      return __g_LastSQLiteActivityTime
-  except NameError:
-    __g_LastSQLiteActivityTime = time.time()
-  return __g_LastSQLiteActivityTime
-
-def setLastSQLiteActivityTime(newtime) :
-  global __g_LastSQLiteActivityTime
-  __g_LastSQLiteActivityTime = newtime
+# local table for high-water marks of synced data, each (table_name, node_name, file_name) has max_time. 
+# file_name is empty for node level mark.
+WATERMARKTABLE = "sync_watermarks"
+# local table for metrics of each sync pass, each (time, table_name, node_name) has rows, bytes, seconds and lag. Rows older than SYNCHISTORYDAYS days are deleted.
+SYNCHISTORYTABLE = "sync_history"
+SYNCHISTORYDAYS = 7
+# virtual table for current sync metrics of each (table_name, node_name)
+SYNCSTATSTABLE = "v_sync_stats"
+# virtual table for recent nodes whose results were truncated or empty because of deadlines, at most QUERYSTATUSKEEP rows
+QUERYSTATUSTABLE = "v_query_status"
+QUERYSTATUSKEEP = 1000
+# (time, table_name, node_name, status, bytes_received, seconds)
+QUERYSTATUS = deque(maxlen=QUERYSTATUSKEEP)
+# rows written in each transaction of sync
+SYNCBATCHSIZE = 5000
+# number of threads fetching tables from cluster concurrently for sync
+SYNCWORKERS = 4
+# limit of sync writing rate(bytes/second, estimated by size of values), leaving I/O for user queries
+SYNCWRITERATE = 2 * 1024 * 1024
+# seconds between sync passes
+SYNCINTERVAL = 3 * 60
+# milliseconds waiting for lock of local database
+BUSYTIMEOUT = 30000
+# seconds without user queries before merging segments of full text indexes
+FTSIDLESECONDS = 30
+# seconds between optimizing(merging all segments of) full text indexes when idle, None to disable
+FTSOPTIMIZEINTERVAL = None
 
 
-def setup(connection):
+def setup(connection, lazy=False):
   """ Register datacollectors of Vertica
   Arguments:
     connection: apsw.Connection
+    lazy: bool, default is False
+      if True, only tables not depending on catalog of cluster are registered now, call bootstrap() of returned VerticaSource later(eg. in background) to register others
+  Return: VerticaSource
+  """
+
+  global __g_verticaSource
+  __g_verticaSource = VerticaSource(connection, lazy)
+  return __g_verticaSource
+
+
+def waitTable(tablename, timeout=None) :
+  """ wait until table is registered if it is going to be registered by bootstrap in background.
+  Return: True if table is registered now, False if table will never be registered.
   """
 
-  VerticaSource(connection);
+  try :
+    vs = __g_verticaSource
+  except NameError :
+    return False
+  return vs.waitTable(tablename, timeout)
 
 
 # module for vertica sources
 class VerticaSource:
-  def __init__(self, connection):
+  def __init__(self, connection, lazy=False):
     self.tables = {}
     # ddls for virtual table
     self.ddls = {} # Note: ddl must end with ");" , as maybe syncJob will add primary key before it to compute local storage version ddls.
     # local storage version ddls. for complicated senario which not easy compute from  self.ddls
     self.ddls4local = {} 
+    # virtual table version ddls, eg. with hidden columns for arguments
+    self.ddls4vtab = {} 
     self.connection = connection
     connection.createmodule("verticasource", self)
+    # SQL functions merging sketches
+    vsketch.createFunctions(connection)
     if connection.filename != "" :
       connection.cursor().execute("attach ':memory:' as v_internal")
-  
-    # create datacollector virtual tables
+      connection.cursor().execute("attach ':memory:' as v_hybrid")
+    # hybrid tables on local storage and cluster
+    self.hybridTables = {}
+    # local tables decoding partitions of synced tables
+    self.localTables = {}
+    # tables going to be registered by bootstrap, {tablename: threading.Event set when it's registered}. 
+    self.pendingTables = {}
+    # tables users are waiting for, bootstrap registers them first
+    self.awaitedTables = set()
+    self.bootstrapLock = threading.Condition()
+    # set when bootstrap knows all tables going to be registered, and when it finishes
+    self.catalogFetched = threading.Event()
+    self.bootstrapped = threading.Event()
+
+    # create datacollectors companion virtual tables
     vdatacollectors.create(self)
     # create vertica log virtual table
     verticalog.create(self)
@@ -73,142 +130,671 @@ class VerticaSource:
     vdblog.create(self)
     # create Liunx /var/log/messages virtual table
     messages.create(self)
+    for tablename in self.tables.keys() :
+      self.createHybridAndLocalTables(tablename)
+    # nodes given up by deadlines, and function setting deadlines for queries of current thread
+    connection.cursor().execute("create virtual table %s using verticasource(querystatus)" % (QUERYSTATUSTABLE if connection.filename == "" else "v_internal." + QUERYSTATUSTABLE))
+    connection.createscalarfunction("set_query_timeout", setQueryTimeout)
+    if connection.filename != "" :
+      connection.cursor().execute("create virtual table v_internal.%s using verticasource(syncstats)" % SYNCSTATSTABLE)
 
-    # start data sync job if main database not in memory
-    self.syncJobCursor = None
+    # statistics for scheduling sync. {tablename: {"lastSync": time, "growth": rows/second}}
+    self.syncStats = {}
+    # metrics of last sync pass of each node. {(tablename, nodeName): {"time", "rows", "bytes", "remoteSeconds", "parseSeconds", "insertSeconds", "newest", "rowsTotal", "bytesTotal"}}
+    self.nodeSyncStats = {}
+    # last failure of sync of each table. {tablename: (time, message)}
+    self.syncFailures = {}
+    self.syncStartTime = time.time()
+    # times of each table appeared in user SQL. {tablename: count}
+    self.queryCounts = {}
+    # times of each column used in predicates against local tables since last index advice. {tablename: {columnName: count}}
+    self.predicateCounts = {}
+    # time of last user query, and last optimizing of full text indexes
+    self.lastQueryTime = time.time()
+    self.lastOptimizeTime = time.time()
+
+    self.writer = None
     if connection.filename != "" :
-      # start data sync job
-      self.syncJobCursor = connection.cursor()
+      # WAL: user queries read consistent snapshot while sync job is writing
+      connection.cursor().execute("pragma main.journal_mode=WAL")
+      connection.setbusytimeout(BUSYTIMEOUT)
+      # sync job writes through its own connection, never interrupted by or blocking user queries 
+      self.writer = apsw.Connection(connection.filename)
+      self.writer.setbusytimeout(BUSYTIMEOUT)
+      # dictionary of strings for compact encoding of partitions, only used by sync job
+      self.dictionary = vstorage.Dictionary()
       self.stopSyncJobEvent = threading.Event()
+
+    connection.setexectrace(self.exectracer)
+
+    if not lazy :
+      self.bootstrap()
+
+
+  def bootstrap(self) :
+    """ register datacollectors from catalog of cluster, then start data sync job. 
+    It can run in background thread, queries only wait for tables they need by waitTable().
+    Return: True if catalog of cluster is fetched, otherwise call registerCatalog() again when cluster is accessible.
+    """
+
+    fetched = self.registerCatalog()
+
+    # start data sync job if main database not in memory
+    if not self.writer is None :
       t = threading.Thread(target=self.syncJob)
       t.daemon = True
       t.start()
       # stop data sync job automatically when exiting
       atexit.register(self.stopSyncJob)
 
-    connection.setexectrace(self.exectracer)
+    return fetched
+
+
+  def connectLocal(self) :
+    """ new connection to local database for writing out of sync job, eg. caching catalog by bootstrap retried in background thread, 
+    so its transactions never interleave with those of sync job on self.writer.
+    Return: apsw.Connection, None for in-memory database
+    """
+
+    if self.writer is None :
+      return None
+    connection = apsw.Connection(self.connection.filename)
+    connection.setbusytimeout(BUSYTIMEOUT)
+    return connection
+
+
+  def registerCatalog(self) :
+    """ register datacollectors in catalog of cluster which are not registered yet, eg. after cluster was not accessible at startup.
+    Return: True if catalog of cluster is fetched
+    """
+
+    try :
+      try :
+        signature, catalog = vdatacollectors.fetch(self)
+      except Exception, e:
+        signature, catalog = None, {}
+        logger.exception("get datacollectors from cluster because [%s]." % str(e))
+      for tablename, t in catalog.iteritems() :
+        if tablename in self.tables and not "columns" in t :
+          # registered before, keep it in cache
+          table = self.tables[tablename]
+          t.update({"columns": table.columns, "columnTypes": table.columnTypes, "primaryKeys": table.primaryKeys})
+      with self.bootstrapLock :
+        self.pendingTables = dict([ (t, threading.Event()) for t in catalog if not t in self.tables ])
+        if len(self.pendingTables) > 0 :
+          self.bootstrapped.clear()
+      self.catalogFetched.set()
+
+      while True :
+        with self.bootstrapLock :
+          if len(self.pendingTables) == 0 :
+            break
+          awaited = [ t for t in self.awaitedTables if t in self.pendingTables ]
+          tablename = awaited[0] if len(awaited) > 0 else min(self.pendingTables)
+          registered = self.pendingTables.pop(tablename)
+          self.awaitedTables.discard(tablename)
+        try :
+          vdatacollectors.register(self, tablename, catalog[tablename])
+          self.createHybridAndLocalTables(tablename)
+        except Exception, e:
+          logger.exception("register datacollector [%s] because [%s]." % (tablename, str(e)))
+        finally :
+          registered.set()
+
+      # following startups skip discovery on cluster until its catalog changes
+      try :
+        vdatacollectors.saveCache(self, signature, catalog)
+      except Exception, e:
+        logger.exception("cache datacollectors locally because [%s]." % str(e))
+    finally :
+      self.catalogFetched.set()
+      self.bootstrapped.set()
+
+    return not signature is None
+
+
+  def waitTable(self, tablename, timeout=None) :
+    """ wait until table is registered if bootstrap is going to register it. 
+    Return: True if table is registered now, False if table will never be registered.
+    """
+
+    if self.bootstrapped.is_set() :
+      return False
+    self.catalogFetched.wait(timeout)
+    with self.bootstrapLock :
+      registered = self.pendingTables.get(tablename, None)
+      if registered is None :
+        return tablename in self.tables
+      self.awaitedTables.add(tablename)
+    logger.info("waiting for registering table [%s] ..." % tablename)
+    return registered.wait(timeout) and tablename in self.tables
 
 
   def stopSyncJob(self) :
     self.stopSyncJobEvent.set()
 
   
-  def syncJob(self) :
-    cursor = self.syncJobCursor
+  def getSyncTables(self) :
+    """ tables synced to local storage, they are got in each sync pass as datacollectors maybe registered later """
 
-    # for performance and reducing local file size, only sync datacollectors by day and hour
-    synctables = [x for x in self.tables]
-    for tablename in self.tables :
+    # for performance and reducing local file size, raw data of datacollectors by second/minute is not synced. 
+    # Their _by_second/_by_minute tables are synced and compacted into coarser buckets as they get older.
+    tables = dict(self.tables)
+    synctables = [x for x in tables if tables[x].syncable]
+    for tablename in tables :
       if tablename.startswith("dc_") and (tablename.endswith("_by_minute") or tablename.endswith("_by_second")) :
-        if tablename in synctables :
-          synctables.remove(tablename)
         basetable = tablename.split("_by_")[0] 
         if basetable in synctables :
           synctables.remove(basetable)
+    return synctables
+
+
+  def syncJob(self) :
+    cursor = self.writer.cursor()
+
+    # high-water marks of synced data
+    sql = "create table if not exists main.%s (table_name varchar(128), node_name varchar(128), file_name varchar(256), max_time, PRIMARY KEY(table_name, node_name, file_name)) WITHOUT ROWID" % WATERMARKTABLE
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+    # metrics of sync passes
+    sql = "create table if not exists main.%s (time timestamp, table_name varchar(128), node_name varchar(128), rows_fetched integer, bytes_fetched integer, remote_seconds float, parse_seconds float, insert_seconds float, lag_seconds float)" % SYNCHISTORYTABLE
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
 
+    # fetch from cluster concurrently, but only this thread writes local storage
+    pool = ThreadPool(SYNCWORKERS)
     while not self.stopSyncJobEvent.is_set() :
-      for tablename in synctables :
-        # active sync job after at least N seconds of last sqlite activity
-        while time.time() - getLastSQLiteActivityTime() < 3*60 :
-          time.sleep(10)
+      synctables = self.getSyncTables()
+      # hot tables first
+      ordered = sorted(synctables, key=self.getSyncPriority, reverse=True)
+      logger.debug("[syncJob] sync order: %s" % ordered)
+      tasks = []
+      for tablename in ordered :
+        try :
+          self.createLocalTable(cursor, tablename)
+          tasks.append((tablename, self.getWatermarks(cursor, tablename)))
+        except Exception, e:
+          logger.exception("prepare sync for table [%s] because [%s]." % (tablename, str(e)))
 
+      for tablename, fetched, tfetch in pool.imap_unordered(self.fetchTable, tasks) :
+        if isinstance(fetched, Exception) :
+          logger.error("sync data for table [%s] from Vertica because [%s]." % (tablename, str(fetched)))
+          self.syncFailures[tablename] = (time.time(), str(fetched))
+          continue
         try :
-          logger.info("[syncJob] Begin sync table [%s] at %s ..." % (tablename, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-          tbegin = time.time()
+          rows, marks, nodeStats = fetched
+          tinsert = time.time()
+          written = self.writeRows(cursor, tablename, rows, marks)
+          self.updateSyncStats(tablename, written)
+          self.recordSyncStats(cursor, tablename, rows, marks, nodeStats, time.time() - tinsert)
+          logger.info("[syncJob] synced table [%s], %s rows fetched in %.1f seconds, %s rows written." % (tablename, len(rows), tfetch, written))
+        except Exception, e:
+          logger.exception("sync data for table [%s] from Vertica because [%s]." % (tablename, str(e)))
+          self.syncFailures[tablename] = (time.time(), str(e))
 
-          # create real SQLite table. Actually we copy DDL of origional table and add PRIMARY KEY/WITHOUT ROWID for efficent storage and performance
-          sql = "select tbl_name from sqlite_master where lower(tbl_name)  = ?"
-          logger.debug("sql=%s, parameters=%s" % (sql, tablename))
-          tables = [ t for (t) in cursor.execute(sql, (tablename, )) ]
-          primaryKeys = self.tables[tablename].primaryKeys
-          if len(tables) == 0 :
-            sql = "drop table if exists %s" % tablename+"_tmp" 
-            logger.debug("sql=%s" % sql)
-            cursor.execute(sql)
-            
-            if tablename in self.ddls4local :
-              sql = self.ddls4local[tablename].replace(tablename, tablename+"_tmp")
-            else :
-              # set primary key for datacollectors
-              if (not primaryKeys is None) and (len(primaryKeys) > 0) :
-                sql = self.ddls[tablename].replace(tablename, tablename+"_tmp").replace(");",",PRIMARY KEY(%s)) WITHOUT ROWID;" % ",".join(self.tables[tablename].primaryKeys))
-              else :
-                sql = self.ddls[tablename].replace(tablename, tablename+"_tmp")
-            logger.debug("sql=%s" % sql)
-            cursor.execute(sql)
-            
-            sql = "insert into %s select * from %s" % (tablename+"_tmp", tablename)
-            logger.debug("sql=%s" % sql)
-            cursor.execute(sql)
-            sql = "alter table %s rename to %s" % (tablename+"_tmp", tablename)
-            logger.debug("sql=%s" % sql)
-            cursor.execute(sql)
-          else :
-            # filter on time on virtual table into temp table, for better performance
-            sql = "select count(1) from main.%s" % tablename
-            logger.debug("sql=%s" % sql)
-            for (rowcount,) in cursor.execute(sql) : break
-            if rowcount <= 0 :
-              sql = "insert into main.%s select * from v_internal.%s" % (tablename, tablename)
-              logger.debug("sql=%s" % sql)
-              cursor.execute(sql)
-            else:
-              sql = "drop table if exists __tmpdc"
-              logger.debug("sql=%s" % sql)
-              cursor.execute(sql)
-              sql = "create temp table __tmpdc as select * from v_internal.%s where time > (select min(time) from (select max(time) time from main.%s group by node_name))" % (tablename, tablename)
-              logger.debug("sql=%s" % sql)
-              cursor.execute(sql)
-              if (not primaryKeys is None) and (len(primaryKeys) > 0) :
-                sql = "insert into main.%s select * from __tmpdc where (%s) not in (select %s from main.%s)" % (tablename, ",".join(self.tables[tablename].primaryKeys), ",".join(self.tables[tablename].primaryKeys), tablename)
-                logger.debug("sql=%s" % sql)
-                cursor.execute(sql)
-              else :
-                sql = "delete from main.%s where time in (select time from __tmpdc)" % tablename 
-                logger.debug("sql=%s" % sql)
-                cursor.execute(sql)
-                sql = "insert into main.%s select * from __tmpdc" % tablename
-                logger.debug("sql=%s" % sql)
-                cursor.execute(sql)
-
-              sql = "drop table if exists __tmpdc"
-              logger.debug("sql=%s" % sql)
-              cursor.execute(sql)
-
-            # TODO: rotate tablesize
-            #cursor.execute("delete from main.%s where time < oldest-permit-for-size" % tablename)
-          
-          logger.info("[syncJob] synced table [%s] in %.1f seconds." % (tablename, time.time() - tbegin))
+      # drop old partitions for retention
+      try :
+        with self.writer :
+          vstorage.enforceRetention(cursor, [ self.tables[t] for t in synctables if self.tables[t].partitioned ])
+      except Exception, e:
+        logger.exception("enforce retention on local storage because [%s]." % str(e))
+
+      # downsample older partitions of fine-grained tables
+      for tablename in [ t for t in synctables if self.tables[t].partitioned and not self.tables[t].resolution is None ] :
+        try :
+          with self.writer :
+            vstorage.compact(cursor, self.tables[tablename])
         except Exception, e:
-          msg = str(e)
-          if not "InterruptError:" in msg :
-            logger.exception("sync data for table [%s] from Vertica because [%s]. SQL = [%s]" % (tablename, msg, sql))
+          logger.exception("compact local storage of table [%s] because [%s]." % (tablename, str(e)))
+
+      # secondary indexes on columns frequently used in predicates of user queries
+      workload, self.predicateCounts = self.predicateCounts, {}
+      try :
+        with self.writer :
+          vstorage.adviseIndexes(cursor, [ self.tables[t] for t in synctables if self.tables[t].partitioned ], workload)
+      except Exception, e:
+        logger.exception("advise secondary indexes on local storage because [%s]." % str(e))
+
+      # merge segments of full text indexes left by bulk inserts while users are idle
+      self.mergeFullText(cursor, [ t for t in synctables if not self.tables[t].fullTextColumns is None ])
       
       # wait N seconds for next sync loop
-      setLastSQLiteActivityTime(time.time())
+      self.stopSyncJobEvent.wait(SYNCINTERVAL)
+
+
+  def mergeFullText(self, cursor, tablenames) :
+    """ merge segments of full text indexes incrementally until done or users come back, and optimize them every FTSOPTIMIZEINTERVAL seconds """
+
+    optimize = not FTSOPTIMIZEINTERVAL is None and time.time() - self.lastOptimizeTime > FTSOPTIMIZEINTERVAL
+    for tablename in tablenames :
+      try :
+        more = True
+        while more and time.time() - self.lastQueryTime > FTSIDLESECONDS and not self.stopSyncJobEvent.is_set() :
+          with self.writer :
+            more = vstorage.mergeFullText(cursor, tablename)
+        if optimize and time.time() - self.lastQueryTime > FTSIDLESECONDS :
+          with self.writer :
+            vstorage.optimizeFullText(cursor, tablename)
+          self.lastOptimizeTime = time.time()
+      except Exception, e:
+        logger.exception("merge full text index of table [%s] because [%s]." % (tablename, str(e)))
+
+
+  def getSyncPriority(self, tablename) :
+    """ priority of table for sync: expected new rows since last sync, weighted by how often users query it """
+
+    stats = self.syncStats.get(tablename, {})
+    staleness = time.time() - stats.get("lastSync", self.syncStartTime)
+    return (1 + stats.get("growth", 1.0) * staleness) * (1 + self.queryCounts.get(tablename, 0))
+
+
+  def updateSyncStats(self, tablename, written) :
+    """ update growth rate(rows/second, moving average) of table after it's synced """
+
+    now = time.time()
+    stats = self.syncStats.setdefault(tablename, {})
+    if "lastSync" in stats and now > stats["lastSync"] :
+      growth = written / (now - stats["lastSync"])
+      stats["growth"] = growth if not "growth" in stats else (stats["growth"] + growth) / 2
+    stats["lastSync"] = now
+
+
+  def recordSyncStats(self, cursor, tablename, rows, marks, nodeStats, insertSeconds) :
+    """ keep metrics of sync pass of table for each node in memory and history table
+    Arguments:
+      rows: fetched rows, node_name is the second column
+      marks: new high-water marks, {nodeName: {fileName: maxTime}}
+      nodeStats: {nodeName: {"bytes", "parseSeconds", "remoteSeconds", "newest"}} of fetching, "newest" is high-water mark on node
+      insertSeconds: seconds of writing rows into local storage, for the whole table
+    """
+
+    # 946684800 is secondes between '1970-01-01 00:00:00'(Python) and '2000-01-01 00:00:00'(Vertica)
+    toSeconds = lambda t: float(parseVerticaTime(t) if isinstance(t, basestring) else t) / 1000000 + 946684800 if not t is None else None
+
+    now = time.time()
+    rowCounts = {}
+    for row in rows :
+      rowCounts[row[1]] = rowCounts.get(row[1], 0) + 1
+
+    history = []
+    for nodeName in set(nodeStats.keys() + marks.keys() + rowCounts.keys()) :
+      stats = self.nodeSyncStats.setdefault((tablename, nodeName), {"rowsTotal": 0, "bytesTotal": 0, "newest": None, "remoteNewest": None})
+      fetched = nodeStats.get(nodeName, {})
+      newest = toSeconds(marks.get(nodeName, {}).get("", None))
+      remoteNewest = toSeconds(fetched.get("newest", None))
+      stats.update({"time": now, "rows": rowCounts.get(nodeName, 0), "bytes": fetched.get("bytes", 0), "remoteSeconds": fetched.get("remoteSeconds", None), \
+          "parseSeconds": fetched.get("parseSeconds", None), "insertSeconds": insertSeconds})
+      stats["rowsTotal"] += stats["rows"]
+      stats["bytesTotal"] += stats["bytes"]
+      if not newest is None :
+        stats["newest"] = newest
+      if not remoteNewest is None :
+        stats["remoteNewest"] = remoteNewest
+      # local storage lags behind high-water mark on node when it was fetched, not behind now(quiet table does not lag)
+      stats["lag"] = max(stats["remoteNewest"] - (stats["newest"] if not stats["newest"] is None else 0), 0) if not stats["remoteNewest"] is None else None
+      history.append((datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S.%f"), tablename, nodeName, stats["rows"], stats["bytes"], \
+          stats["remoteSeconds"], stats["parseSeconds"], insertSeconds, stats["lag"]))
+
+    with self.writer :
+      sql = "insert into main.%s values (?, ?, ?, ?, ?, ?, ?, ?, ?)" % SYNCHISTORYTABLE
+      cursor.executemany(sql, history)
+      sql = "delete from main.%s where table_name = ? and time < ?" % SYNCHISTORYTABLE
+      cursor.execute(sql, (tablename, datetime.fromtimestamp(now - SYNCHISTORYDAYS * 86400).strftime("%Y-%m-%d %H:%M:%S.%f")))
+
+
+  def getLocalDDL(self, tablename) :
+    """ DDL of local storage. Actually we copy DDL of origional table and add PRIMARY KEY/WITHOUT ROWID for efficent storage and performance """
+
+    primaryKeys = self.tables[tablename].primaryKeys
+    if tablename in self.ddls4local :
+      return self.ddls4local[tablename]
+    # set primary key for datacollectors
+    if (not primaryKeys is None) and (len(primaryKeys) > 0) :
+      return self.ddls[tablename].replace(");",",PRIMARY KEY(%s)) WITHOUT ROWID;" % ",".join(primaryKeys))
+    return self.ddls[tablename]
+
+
+  def createLocalTable(self, cursor, tablename) :
+    """ create real SQLite table if not exists. Partitions of partitioned table are created when writing rows into them. """
+
+    if self.tables[tablename].partitioned :
+      try :
+        with self.writer :
+          vstorage.migrate(cursor, self.tables[tablename], self.dictionary)
+      except :
+        # new ids have been rolled back
+        self.dictionary.reset()
+        raise
+      return
+
+    if not self.tables[tablename].fullTextColumns is None :
+      with self.writer :
+        if vstorage.createFullText(cursor, self.tables[tablename]) :
+          # forget high-water marks of dropped local table
+          sql = "delete from main.%s where table_name = ?" % WATERMARKTABLE
+          logger.debug("sql=%s, parameters=%s" % (sql, tablename))
+          cursor.execute(sql, (tablename, ))
+      return
+
+    sql = "select tbl_name from sqlite_master where lower(tbl_name)  = ?"
+    logger.debug("sql=%s, parameters=%s" % (sql, tablename))
+    tables = [ t for (t) in cursor.execute(sql, (tablename, )) ]
+    if len(tables) > 0 :
+      return
+
+    sql = "drop table if exists %s" % tablename+"_tmp" 
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+    
+    sql = self.getLocalDDL(tablename).replace(tablename, tablename+"_tmp")
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+    sql = "alter table %s rename to %s" % (tablename+"_tmp", tablename)
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+
+    # forget high-water marks of dropped local table
+    sql = "delete from main.%s where table_name = ?" % WATERMARKTABLE
+    logger.debug("sql=%s, parameters=%s" % (sql, tablename))
+    cursor.execute(sql, (tablename, ))
+
+
+  def getWatermarks(self, cursor, tablename) :
+    """ get high-water marks of table
+    Return: ({nodeName: {fileName: maxTime}}, {nodeName: maxTime}), node level marks have empty fileName. 
+      maxTime is Vertica inner long format for watermarked tables, or string of local table.
+    """
+
+    checkpoints, since = {}, {}
+    sql = "select node_name, file_name, max_time from main.%s where table_name = ?" % WATERMARKTABLE
+    logger.debug("sql=%s, parameters=%s" % (sql, tablename))
+    for nodeName, fileName, maxTime in cursor.execute(sql, (tablename, )) :
+      if fileName == "" :
+        since[nodeName] = maxTime
+      else :
+        checkpoints.setdefault(nodeName, {})[fileName] = maxTime
+
+    sql = "select tbl_name from main.sqlite_master where lower(tbl_name) = ?"
+    if len(since) == 0 and len(cursor.execute(sql, (tablename, )).fetchall()) > 0 :
+      # local table synced before high-water marks, scan it once
+      sql = "select node_name, max(time) from main.%s group by node_name" % tablename
+      logger.debug("sql=%s" % sql)
+      since = dict([ (nodeName, parseVerticaTime(maxTime) if self.tables[tablename].watermarked else maxTime) for nodeName, maxTime in cursor.execute(sql) if not maxTime is None ])
+    return checkpoints, since
+
+
+  def fetchTable(self, task) :
+    """ fetch rows newer than high-water marks of table from cluster, it's called concurrently by sync workers without touching local storage.
+    Arguments:
+      task: (tablename, (checkpoints, since)), high-water marks from getWatermarks
+    Return: (tablename, (rows, new marks {nodeName: {fileName: maxTime}}, metrics {nodeName: {"bytes", "parseSeconds", "remoteSeconds"}}) or Exception, seconds of fetching)
+    """
+
+    tablename, (checkpoints, since) = task
+    # sync scans yield to queries of users on nodes
+    threadlocal_set("SCANCLASS", "sync")
+    tbegin = time.time()
+    try :
+      if self.tables[tablename].watermarked :
+        fetched = self.fetchByWatermarks(tablename, checkpoints, since)
+      else :
+        fetched = self.fetchByTime(tablename, since)
+    except Exception, e:
+      fetched = e
+    return tablename, fetched, time.time() - tbegin
+
+
+  def fetchByWatermarks(self, tablename, checkpoints, since) :
+    """ fetch rows newer than high-water marks of each (node, file), by tail-following files on nodes. Cost of each pass only depends on new rows. """
+
+    table = self.tables[tablename]
+    fetcher = Cursor(table)
+    # time of partitioned table is stored in Vertica inner format
+    columnTypes = [ "integer" if c == "time" and table.partitioned else table.columnTypes[c] for c in table.columns ]
+    newCheckpoints = fetcher.follow(checkpoints, since, columnTypes)
+    rows = [ [ unicode(v, "utf-8", "replace") if isinstance(v, str) else v for v in row[1:] ] for row in fetcher.data ]
+    fetcher.Close()
+
+    for nodeName, files in newCheckpoints.iteritems() :
+      marks = files.values() + ([since[nodeName]] if nodeName in since else [])
+      if len(marks) > 0 :
+        files[""] = max(marks)
+    return rows, newCheckpoints, fetcher.nodeStats
+
+
+  def fetchByTime(self, tablename, since) :
+    """ fetch rows not older than node level high-water marks of table, by time predicate on virtual table.
+    Rows at high-water mark are fetched again, as more rows with same time maybe arrived after last sync, see writeRows().
+    """
+
+    # filter on time on virtual table, then on high-water mark of each node
+    fetcher = Cursor(self.tables[tablename])
+    if len(since) == 0 :
+      fetcher.Filter(0, "", [])
+    else :
+      fetcher.Filter(1, "0_32", [min(since.values())])
+    rows = [ [ unicode(v, "utf-8", "replace") if isinstance(v, str) else v for v in row[1:] ] for row in fetcher.data ]
+    fetcher.Close()
+    # newest rows received from each node, including truncated ones
+    for row in rows :
+      stats = fetcher.nodeStats.setdefault(row[1], {"bytes": 0, "parseSeconds": 0.0, "remoteSeconds": None})
+      if not "newest" in stats or row[0] > stats["newest"] :
+        stats["newest"] = row[0]
+    # rows of truncated node may have gaps before its new high-water mark
+    rows = [ row for row in rows if fetcher.nodeStatus.get(row[1], ("finished", 0))[0] == "finished" ]
+    rows = [ row for row in rows if not row[1] in since or row[0] >= since[row[1]] ]
+
+    marks = dict(since)
+    for row in rows :
+      if not row[1] in marks or row[0] > marks[row[1]] :
+        marks[row[1]] = row[0]
+    return rows, dict([ (nodeName, {"": maxTime}) for nodeName, maxTime in marks.iteritems() ]), fetcher.nodeStats
+
+
+  def writeRows(self, cursor, tablename, rows, marks) :
+    """ write rows into local table in batches of SYNCBATCHSIZE rows, each batch in its own transaction. 
+    Duplicated rows are ignored by primary key of table. Table without primary keys can not tell duplicated rows, 
+    so its rows of oldest time fetched from each node are deleted before writing, as they are fetched again(see fetchByTime()).
+    New high-water marks are saved in transaction of last batch.
+    Arguments:
+      rows: list of rows
+      marks: new high-water marks, {nodeName: {fileName: maxTime}}
+    Return: number of written rows
+    """
+
+    table = self.tables[tablename]
+    primaryKeys = table.primaryKeys
+    # same SQL text reuses prepared statement from statement cache of connection
+    sql = "insert%s into main.%%s values (%s)" % (" or ignore" if (not primaryKeys is None) and (len(primaryKeys) > 0) else "", ",".join(["?"] * len(table.columns[1:])))
+
+    tbegin = time.time()
+    changes = self.writer.totalchanges()
+    written = 0
+    for i in range(0, max(len(rows), 1), SYNCBATCHSIZE) :
+      tbatch = time.time()
+      try :
+        with self.writer :
+          batch = rows[i:i+SYNCBATCHSIZE]
+          if i == 0 and not table.watermarked and (primaryKeys is None or len(primaryKeys) == 0) :
+            self.deleteOldestRows(cursor, table, rows)
+            changes = self.writer.totalchanges()
+          if table.partitioned :
+            # encode rows and route them to partitions by time
+            vstorage.writeRows(cursor, table, sql, batch, self.dictionary)
+          elif not table.fullTextColumns is None and len(batch) > 0 :
+            # full text index is updated by triggers on content table
+            cursor.executemany(sql % (vstorage.FTSCONTENTFORMAT % tablename), batch)
+          elif len(batch) > 0 :
+            cursor.executemany(sql % tablename, batch)
+          written = self.writer.totalchanges() - changes
+          if i + SYNCBATCHSIZE >= len(rows) :
+            self.saveWatermarks(cursor, tablename, marks)
+      except :
+        # new ids have been rolled back
+        self.dictionary.reset()
+        raise
+      # rate limit, sleep for the time writing batch should take
+      size = sum([ len(v) if isinstance(v, basestring) else 8 for row in batch for v in row ])
+      delay = float(size) / SYNCWRITERATE - (time.time() - tbatch)
+      if delay > 0 :
+        time.sleep(delay)
+
+    elapsed = time.time() - tbegin
+    logger.info("[syncJob] wrote %s rows into table [%s] in %.1f seconds, %.0f rows/second." % (written, tablename, elapsed, len(rows) / elapsed if elapsed > 0 else 0))
+    return written
+
+
+  def deleteOldestRows(self, cursor, table, rows) :
+    """ delete local rows of each node at oldest time of rows fetched from it, they are replaced by fetched rows """
+
+    oldest = {}
+    for row in rows :
+      if not row[1] in oldest or row[0] < oldest[row[1]] :
+        oldest[row[1]] = row[0]
+    name = vstorage.FTSCONTENTFORMAT % table.tablename if not table.fullTextColumns is None else table.tablename
+    sql = "delete from main.%s where node_name = ? and time = ?" % name
+    logger.debug("sql=%s" % sql)
+    cursor.executemany(sql, oldest.items())
+
+
+  def saveWatermarks(self, cursor, tablename, marks) :
+    """ replace high-water marks of each node in marks {nodeName: {fileName: maxTime}} """
+
+    for nodeName, files in marks.iteritems() :
+      sql = "delete from main.%s where table_name = ? and node_name = ?" % WATERMARKTABLE
+      logger.debug("sql=%s, parameters=%s" % (sql, (tablename, nodeName)))
+      cursor.execute(sql, (tablename, nodeName))
+      if len(files) > 0 :
+        sql = "insert into main.%s values (?, ?, ?, ?)" % WATERMARKTABLE
+        logger.debug("sql=%s" % sql)
+        cursor.executemany(sql, ( (tablename, nodeName, fileName, maxTime) for fileName, maxTime in files.iteritems() ))
+
+
+  def createHybridAndLocalTables(self, tablename) :
+    """ create hybrid virtual table in schema v_hybrid if table is synced by high-water marks.
+    create local virtual table in temp schema if table is partitioned, it shadows view of partitions for unqualified table name,
+    and pushes time/node_name predicates down to compact encoded partitions. 
+    """
+
+    if self.connection.filename == "" :
+      return
+    cursor = self.connection.cursor()
+    try :
+      if self.tables[tablename].watermarked :
+        cursor.execute("create virtual table v_hybrid.%s using verticasource(hybrid)" % tablename)
+      if self.tables[tablename].partitioned :
+        cursor.execute("create virtual table temp.%s using verticasource(local)" % tablename)
+    finally :
+      cursor.close()
 
 
   def Create(self, db, modulename, dbname, tablename, *args):
-    table = Table(tablename)
+    # args of "using verticasource(...)" choose kind of table
+    if "syncstats" in args :
+      table = SyncStatsTable(tablename, self)
+      return table.ddl, table
+    elif "querystatus" in args :
+      table = QueryStatusTable(tablename)
+      return table.ddl, table
+    elif "local" in args :
+      # same name with source table in another schema
+      table = LocalTable(tablename, self, self.tables[tablename])
+      self.localTables[tablename] = table
+      return self.ddls[tablename], table
+    elif "hybrid" in args :
+      # same name with source table in another schema
+      table = HybridTable(tablename, self, self.tables[tablename])
+      self.hybridTables[tablename] = table
+      return self.ddls[tablename], table
+    elif "aggregate" in args :
+      table = AggregateTable(tablename, self)
+    elif "sketch" in args :
+      table = SketchTable(tablename, self)
+    else :
+      table = Table(tablename)
     self.tables[tablename] = table
-    return self.ddls[tablename], table
+    return self.ddls4vtab.get(tablename, self.ddls[tablename]), table
 
   Connect=Create
   
   def exectracer(self, cursor, sql, bindings):
-    # TODO: it seems this tracer will not be called by shell
-    if not cursor is self.syncJobCursor :
-      # ignore background sync job
-	    # tell background sync job it's busy now.
-      setLastSQLiteActivityTime(time.time())
-      logger.debug("[EXECTRACER] CURSOR=%s, SQL=%s, BINDINGS=%s" % (cursor, sql, bindings))
+    # Note: cursor of shell has its own tracer, shell calls this tracer for each statement itself without cursor(see dbmanager.Shell).
+    # Note: background sync job writes through its own connection, it's not traced.
+    logger.debug("[EXECTRACER] CURSOR=%s, SQL=%s, BINDINGS=%s" % (cursor, sql, bindings))
+    self.lastQueryTime = time.time()
+    # union of time ranges in disjunctive predicates on each table, eg. "time between ? and ? or time between ? and ?", SQLite filters 
+    # virtual table once for each OR term, the first Filter fetches rows of all ranges in one request, others reuse them.
+    # Ranges and rows fetched for them only belong to this statement: they are rebuilt by each top-level statement of thread, 
+    # and dropped with its cursor. Nested statements(eg. reading local storage in Filter) keep them.
+    words = set(re.findall(r"\w+", sql.lower()))
+    if not threadlocal_get("NESTEDQUERIES") :
+      tablenames = [ t for t in words if t in self.tables and getattr(getattr(self.tables[t], "remotefiltermodule", None), "MULTITIMERANGES", False) ]
+      timeRanges = getTimeRanges(sql, bindings, tablenames)
+      # {tablename: (ranges, rows fetched for ranges {arguments except time predicates: rows})}
+      tableRanges = dict([ (t, (ranges, {})) for t, ranges in timeRanges.iteritems() ])
+      threadlocal_set("TIMERANGES", (weakref.ref(cursor) if not cursor is None else None, tableRanges) if len(tableRanges) > 0 else None)
+    # frequently queried tables are synced first
+    sql = sql.lower()
+    for word in words :
+      if word in self.tables :
+        self.queryCounts[word] = self.queryCounts.get(word, 0) + 1
+
+    # columns used in predicates against local tables, for advising secondary indexes. time and node_name are leading primary keys already.
+    localTables = [ t for t in words if t in self.localTables and re.search(r"v_internal\s*\.\s*%s\b" % t, sql) is None ]
+    if len(localTables) > 0 :
+      columns = set(re.findall(r"\b(\w+)\s*(?:=|<|>|!=|\bin\b|\blike\b|\bglob\b|\bbetween\b)", sql))
+      for tablename in localTables :
+        for c in columns.intersection(self.tables[tablename].columns[1:]).difference(["time", "node_name"]) :
+          counts = self.predicateCounts.setdefault(tablename, {})
+          counts[c] = counts.get(c, 0) + 1
 
     return True
 
 
 
+# SQLite index constraint operators pushed down to scan. 
+#   time: {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
+#   node_name: {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">=", 65: "LIKE"}, "IN (...)" comes as multiple Filter calls with "=="
+TIMEOPERATORS = (2, 4, 8, 16, 32, )
+NODENAMEOPERATORS = (2, 4, 8, 16, 32, 65, )
+
+def isPushdownConstraint(columnIndex, predicate) :
+  return (columnIndex == 0) and (predicate in TIMEOPERATORS) or (columnIndex == 1) and (predicate in NODENAMEOPERATORS)
+
+
+def matchNodeName(nodeName, op, value) :
+  """ evaluate node_name predicate on coordinator
+  Arguments:
+    nodeName: string
+    op: int, SQLite index constraint operator
+    value: string
+  Return: True if nodeName matches predicate
+  """
+
+  if value is None :
+    return False
+  if op == 65 :
+    # LIKE: case insensitive, '%' for any characters, '_' for single character
+    pattern = "".join([ ".*" if c == "%" else "." if c == "_" else re.escape(c) for c in value ]) + "$"
+    return not re.match(pattern, nodeName, re.IGNORECASE | re.DOTALL) is None
+  return {2: nodeName == value, 4: nodeName > value, 8: nodeName <= value, 16: nodeName < value, 32: nodeName >= value}[op]
+
+
 # table for datacollector
 class Table:
+  # whether data of table can be synced to local storage
+  syncable = True
+  # arguments given by hidden columns, {columnIndex: argumentName}
+  hiddenColumns = {}
+  # whether remote filter module can tail-follow files from high-water marks for sync
+  watermarked = False
+  # whether local storage is partitioned by time
+  partitioned = False
+  # seconds between rows of fine-grained table(eg. dc_*_by_second), older rows in local storage will be compacted into coarser buckets
+  resolution = None
+  # columns of full text index in local storage, eg. ["message"]
+  fullTextColumns = None
+
   def __init__(self, tablename):
     self.tablename=tablename
     self.columns = []
@@ -219,6 +805,13 @@ class Table:
     #   self.columns
     #   self.columnTypes
     #   self.primaryKeys
+    #   self.hiddenColumns
+
+  def isArgument(self, columnIndex, predicate):
+    return columnIndex in self.hiddenColumns and predicate == 2
+
+  def isPushdown(self, columnIndex, predicate):
+    return isPushdownConstraint(columnIndex, predicate)
 
   def BestIndex(self, constraints, orderbys):
     """
@@ -231,23 +824,33 @@ class Table:
     """
 
     logger.debug("[BESTINDEX] tablename=%s, constraints=%s, orderbys=%s" % (self.tablename, constraints, orderbys))
-    if len(constraints) > 0 and any([ 1 if columnIndex in (0,1,) else 0 for (columnIndex, predicate) in constraints ]) == 1 : 
-      # only filter on time(0) and node_name(1) column
+    isUsable = lambda columnIndex, predicate: self.isPushdown(columnIndex, predicate) or self.isArgument(columnIndex, predicate)
+    if len(constraints) > 0 and any([ 1 if isUsable(columnIndex, predicate) else 0 for (columnIndex, predicate) in constraints ]) == 1 : 
+      # only filter on time(0) and node_name(1) column, and arguments(eg. sample_rate) in hidden columns
       # arg appearance order
       argOrders = []
       i = 0
       for (columnIndex, predicate) in constraints : 
-        if columnIndex in (0, 1) :
+        if self.isPushdown(columnIndex, predicate) :
           argOrders.append(i)
           i += 1
+        elif self.isArgument(columnIndex, predicate) :
+          # hidden columns are not real columns, omit checking by SQLite
+          argOrders.append((i, True))
+          i += 1
         else :
           argOrders.append(None)
-      # indexID: 1: time, 2: node_name, 3: time and nodename
-      indexID = reduce(ior, [ columnIndex+1 if columnIndex in (0,1,) else 0 for (columnIndex, predicate) in constraints ])
+      # indexID: 1: time, 2: node_name, 3: time and nodename, 0: none of them, plus 4: other columns
+      indexID = reduce(ior, [ {0: 1, 1: 2}.get(columnIndex, 4) if self.isPushdown(columnIndex, predicate) else 0 for (columnIndex, predicate) in constraints ])
       # indexName: columnIndx_predicate[+columnIndx_predicate]*
-      indexName = "+".join([ "%s_%s" % (columnIndex, predicate) for (columnIndex, predicate) in filter(lambda x: x[0] in (0,1,), constraints) ])
+      indexName = "+".join([ "%s_%s" % (columnIndex, predicate) for (columnIndex, predicate) in filter(lambda x: isUsable(x[0], x[1]), constraints) ])
       # cost
-      cost = {1: 10, 2: 1000, 3: 1}[indexID] 
+      cost = {0: 100000, 1: 10, 2: 1000, 3: 1}[indexID & 3] 
+      if indexID & 4 :
+        cost = cost / 10.0
+      if any([ self.isArgument(columnIndex, predicate) for (columnIndex, predicate) in constraints ]) :
+        # plan must take arguments, as SQLite can not evaluate them on hidden columns
+        cost = cost / 1000.0
 
       return (argOrders, indexID, indexName, False, cost)
     else : 
@@ -271,6 +874,12 @@ class Cursor:
     self.table = table
     self.data = None
     self.pos=0
+    # values of hidden columns, {argumentName: value}
+    self.arguments = {}
+    # metrics of receiving results from each node, {nodeName: {"bytes", "parseSeconds", "remoteSeconds"}}
+    self.nodeStats = {}
+    # status of receiving results from each node, {nodeName: (status, seconds)}, status is "finished", "truncated" or "timeout"
+    self.nodeStatus = {}
 
 
   def Eof(self):
@@ -281,6 +890,8 @@ class Cursor:
 
   def Column(self, col):
     if (col == 0) : logger.debug( "[COLUMN] tablename=%s, cursor=%s, pos=%s" % (self.table.tablename, self, self.pos))
+    if col in self.table.hiddenColumns :
+      return self.arguments.get(self.table.hiddenColumns[col], None)
 
     try :
       value = self.data[self.pos][1+col]
@@ -308,30 +919,12 @@ class Cursor:
     self.pos=0
     vc = vcluster.getVerticaCluster()
     if vc is None or len(vc.executors) == 0 :
-      logger.error("cluster is not accessible! You'd better restart this tool.")
+      logger.error("cluster is not accessible now! It will be reconnected in background.")
       return
 
-    #predicates {columnIndx: [[predicate1:value1, predicate2:value2]]} 
-    predicates = {}
+    predicates = getPredicates(indexname, constraintargs)
+    self.arguments = self.getArguments(predicates)
     columns = self.table.columns
-    if not indexname is None and len(indexname) > 0 and not constraintargs is None and len(constraintargs) > 0 :
-      #indexname columnIndx_predicate_[+columnIndx_predicate]* 
-      for i, pred in enumerate(indexname.split("+")) :
-        lstPred = pred.split("_")
-        col = int(lstPred[0])
-        op = int(lstPred[1])
-        val = constraintargs[i]
-        if col == 0 :
-          # time: string to long
-          if val is None :
-            # -9223372036854775808(-0x8000000000000000) means null in Vertica
-            val = -0x8000000000000000 
-          else :
-            # 946684800 is secondes between '1970-01-01 00:00:00'(Python) and '2000-01-01 00:00:00'(Vertica)
-            val = long(datetimeparser.parse(val).strftime('%s%f'))-946684800*1000000
-        predCol = predicates[col] if col in predicates else []
-        predCol.append([op, val])
-        predicates[col] = predCol
 
     # get dynamic filter
     keywords = None
@@ -339,32 +932,730 @@ class Cursor:
     if getfilter :
       keywords = getfilter()
 
-    logger.debug("[FILTER] tablename=%s, cursor=%s, pos=%s, indexnum=%s, indexname=%s, constraintargs=%s, predicates=%s, keywords=%s, remotefiltermodule=%s" % (self.table.tablename, self, self.pos, indexnum, indexname, constraintargs, predicates, keywords, self.table.remotefiltermodule.__name__))
-    # call remote function
-    mch = vc.executors.remote_exec(self.table.remotefiltermodule)
-    mch.send_each({"catalogpath":vc.catPath, "tablename":self.table.tablename, "columns":columns, "predicates":predicates, "keywords":keywords})
-
-    q = mch.make_receive_queue(endmarker=None)
-    terminated = 0
-    while 1:
-      channel, rows = q.get()
-      if rows is None :
-        terminated += 1
-        if terminated == len(mch):
-          break
-        continue
-      else: 
-        logger.debug("[FILTER] rows size=%s" % len(rows))
-        try :
-          columnTypes = [self.table.columnTypes[c] for c in columns]
-          
-          # use C extension module for better performance. Note: vsourceparser.parseRows can not accept unicode string at now.
-          tuples = vsourceparser.parseRows(rows, columnTypes)
-          #tuples = parseRows(rows, columnTypes)
+    logger.debug("[FILTER] tablename=%s, cursor=%s, pos=%s, indexnum=%s, indexname=%s, constraintargs=%s, predicates=%s, keywords=%s, arguments=%s, remotefiltermodule=%s" % (self.table.tablename, self, self.pos, indexnum, indexname, constraintargs, predicates, keywords, self.arguments, self.table.remotefiltermodule.__name__))
+
+    args = {"catalogpath":vc.catPath, "tablename":self.table.tablename, "columns":columns, "predicates":predicates, "keywords":keywords}
+    # sampling on nodes, eg. select * from dc_requests_issued(0.01)
+    sampleRate = self.arguments.get("sample_rate", None)
+    if not sampleRate is None :
+      try :
+        sampleRate = float(sampleRate)
+      except ValueError :
+        sampleRate = -1
+      if sampleRate < 0 or sampleRate > 1 :
+        raise StandardError("sample_rate [%s] should be a number between 0 and 1" % self.arguments["sample_rate"])
+      if sampleRate == 0 :
+        return
+      if sampleRate < 1 :
+        args["sample"] = {"rate": sampleRate, "seed": self.arguments.get("sample_seed", None)}
+
+    # fetch all time ranges of this table in statement in one request, if range of this Filter is one of them. 
+    # Only remote modules declaring MULTITIMERANGES accept args["timeRanges"].
+    cacheKey = None
+    tableRanges = getStatementTimeRanges(self.table.tablename)
+    if not tableRanges is None and 0 in predicates and getattr(self.table.remotefiltermodule, "MULTITIMERANGES", False) :
+      timeRanges, cache = tableRanges
+      timeRange = vcluster.getTimeRange(predicates)
+      if any([ vcluster.isTimeRangeCovered(r, timeRange) for r in timeRanges ]) :
+        cacheKey = (repr(sorted([ (k, v) for k, v in predicates.iteritems() if k != 0 ])), repr(keywords), repr(args.get("sample", None)))
+        if cacheKey in cache :
+          # rows out of range of this Filter will be filtered by SQLite, as pushed down predicates are not omitted
+          self.data = cache[cacheKey]
+          return
+        predicates.pop(0)
+        args["timeRanges"] = [ getRangePredicates(r) for r in timeRanges ]
+
+    # call remote function by resident workers
+    mch = self.remoteCall(vc, args)
+    if mch is None :
+      return
+
+    columnTypes = [self.table.columnTypes[c] for c in columns]
+    self.receive(mch, lambda channel, rows: self.parseData(rows, columnTypes))
+    if not cacheKey is None and all([ status == "finished" for status, _ in self.nodeStatus.itervalues() ]) :
+      cache[cacheKey] = self.data
+
+
+  def parseData(self, rows, columnTypes) :
+    logger.debug("[FILTER] rows size=%s" % len(rows))
+    try :
+      # use C extension module for better performance. Note: vsourceparser.parseRows can not accept unicode string at now.
+      tuples = vsourceparser.parseRows(rows, columnTypes)
+      #tuples = parseRows(rows, columnTypes)
+
+      self.data.extend(tuples)
+    except Exception, e:
+      raise StandardError("[%s] on table [%s]" % (str(e), self.table.tablename))
+
+
+  def follow(self, checkpoints, since, columnTypes=None) :
+    """ fetch rows appended since last sync into self.data, by tail-following datacollector files on nodes
+    Arguments:
+      checkpoints: {nodeName: {fileName: lastTime}}, high-water marks of files synced before
+      since: {nodeName: lastTime}, high-water mark of node for files not in checkpoints
+      columnTypes: types for parsing columns, default is types of table
+    Return: new checkpoints {nodeName: {fileName: lastTime}}, empty if cluster is not accessible.
+      Newest time on each node is kept in self.nodeStats[nodeName]["newest"].
+    """
+
+    self.data = []
+    self.pos=0
+    newCheckpoints = {}
+    vc = vcluster.getVerticaCluster()
+    if vc is None or len(vc.executors) == 0 :
+      logger.error("cluster is not accessible now! It will be reconnected in background.")
+      return newCheckpoints
+
+    columns = self.table.columns
+    if columnTypes is None :
+      columnTypes = [self.table.columnTypes[c] for c in columns]
+    mch = self.remoteCall(vc, {"catalogpath":vc.catPath, "tablename":self.table.tablename, "columns":columns, "predicates":{}, "keywords":None, \
+        "follow": {"checkpoints": checkpoints, "since": since}})
+    if mch is None :
+      return newCheckpoints
+
+    def handler(channel, item) :
+      if isinstance(item, dict) and "newest" in item :
+        # high-water mark on node, for lag of sync
+        self.nodeStats[channel.gateway.id]["newest"] = item["newest"]["time"]
+      elif isinstance(item, dict) :
+        newCheckpoints[item["checkpoints"]["node"]] = item["checkpoints"]["files"]
+      else :
+        self.parseData(item, columnTypes)
+    self.receive(mch, handler)
+
+    return newCheckpoints
+
+
+  def getArguments(self, predicates) :
+    """ take "==" predicates on hidden columns out of predicates as arguments
+    Arguments:
+      predicates: {columnIndx: [[predicate1, value1], [predicate2, value2]]}
+    Return: {argumentName: value}
+    """
+
+    return dict([ (self.table.hiddenColumns[col], predicates.pop(col)[0][1]) for col in self.table.hiddenColumns if col in predicates ])
+
+
+  def remoteCall(self, vc, args) :
+    """ call remote filter module on nodes matching node_name predicates in args["predicates"]
+    Arguments:
+      vc: VerticaCluster
+      args: dictionary of arguments for remote filter module
+    Return: execnet.MultiChannel, or None if no node matches
+    """
+
+    # route request only to nodes matching node_name predicates
+    nodeNames = None
+    predicates = args["predicates"]
+    if 1 in predicates :
+      nodePredicates = predicates.pop(1)
+      nodeNames = [ n for n in vc.nodeNames if all([ matchNodeName(n, op, val) for op, val in nodePredicates ]) ]
+      if len(nodeNames) == 0 :
+        return None
+
+    mch = vc.remoteCall(self.table.remotefiltermodule, args, nodeNames)
+    if len(mch) == 0 :
+      return None
+    return mch
+
+
+  def receive(self, mch, handler) :
+    """ receive results from all channels until they are closed or their deadlines pass(see vcluster.receive), status of each node is kept in self.nodeStatus
+    Arguments:
+      mch: execnet.MultiChannel
+      handler: function(channel, item), called for each received item
+    """
+
+    def receiveItem(channel, item) :
+      stats = self.nodeStats.setdefault(channel.gateway.id, {"bytes": 0, "parseSeconds": 0.0, "remoteSeconds": None})
+      tparse = time.time()
+      handler(channel, item)
+      stats["parseSeconds"] += time.time() - tparse
+      if isinstance(item, basestring) :
+        stats["bytes"] += len(item)
+
+    # straggling nodes are given up at their deadlines, results received from them are kept
+    self.nodeStatus = vcluster.receive(mch, receiveItem)
+    for nodeName, (status, seconds) in self.nodeStatus.iteritems() :
+      stats = self.nodeStats.setdefault(nodeName, {"bytes": 0, "parseSeconds": 0.0, "remoteSeconds": None})
+      if status == "finished" :
+        # node finished, including transferring
+        stats["remoteSeconds"] = seconds
+      else :
+        logger.warning("results of table [%s] from node %s are %s after %.1f seconds, %s bytes received." % (self.table.tablename, nodeName, "truncated" if status == "truncated" else "empty", seconds, stats["bytes"]))
+        QUERYSTATUS.append((datetime.fromtimestamp(time.time()).strftime("%Y-%m-%d %H:%M:%S.%f"), self.table.tablename, nodeName, status, stats["bytes"], seconds))
+
+
+
+# local table for partitioned tables
+class LocalTable(Table):
+  """
+  rows of synced table decoded from compact encoded partitions in local storage. Predicates on time and node_name are pushed down 
+  to integer columns of partitions, and partitions out of time range are skipped, eg.
+    select * from dc_requests_issued where time > datetime('now', '-1 day')
+  Note: it falls back to cluster if table has not been synced yet.
+  """
+
+  syncable = False
+
+  def __init__(self, tablename, vs, source):
+    Table.__init__(self, tablename)
+    self.vs = vs
+    self.source = source
+    self.remotefiltermodule = source.remotefiltermodule
+    self.columns = source.columns
+    self.columnTypes = source.columnTypes
+    self.primaryKeys = None
+
+  def isPushdown(self, columnIndex, predicate):
+    # comparisons on other columns are pushed down to partitions too, where they may use secondary indexes
+    return isPushdownConstraint(columnIndex, predicate) or (columnIndex > 1 and predicate in TIMEOPERATORS)
+
+  def Open(self):
+    cursor = LocalCursor(self)
+    logger.debug("[Open] CURSOR=%s" % cursor)
+    return cursor
+
+
+
+# cursor for local table
+class LocalCursor(Cursor):
+  def Filter(self, indexnum, indexname, constraintargs):
+    # Note: nested queries share read snapshot of running user query.
+    cursor = self.table.vs.connection.cursor()
+    beginNestedQueries()
+    try :
+      if len(vstorage.getPartitions(cursor, self.table.tablename)) == 0 :
+        return Cursor.Filter(self, indexnum, indexname, constraintargs)
+
+      self.data = []
+      self.pos=0
+      predicates = getPredicates(indexname, constraintargs)
+      logger.debug("[FILTER] tablename=%s, cursor=%s, indexname=%s, constraintargs=%s, predicates=%s" % (self.table.tablename, self, indexname, constraintargs, predicates))
+      self.readLocal(cursor, predicates)
+    finally :
+      endNestedQueries()
+      cursor.close()
+
+
+  def readLocal(self, cursor, predicates) :
+    """ append rows matching time/node_name predicates from partitions of table to self.data, rowid is time * 10000 + node number as rows from cluster """
+
+    tablename = self.table.tablename
+    operators = {2: "=", 4: ">", 8: "<=", 16: "<", 32: ">="}
+    timePredicates = predicates.get(0, [])
+    partitions = [ p for p in vstorage.getPartitions(cursor, tablename) if vstorage.isPartitionInRange(p, timePredicates) ]
+    if len(partitions) == 0 :
+      return
+
+    # predicates on encoded columns, values are literals as SQL text is the same for all partitions.
+    # Note: SQLite checks all predicates on result again.
+    conditions = [ "time %s %s" % (operators[op], long(val)) for op, val in timePredicates ]
+    if 1 in predicates :
+      sql = "select id, value from main.%s" % vstorage.DICTIONARYTABLE
+      ids = [ str(id) for id, value in cursor.execute(sql) if all([ matchNodeName(value, op, val) for op, val in predicates[1] ]) ]
+      conditions.append("node_name in (%s)" % ",".join(ids))
+    for col in [ c for c in predicates if c > 1 ] :
+      column = self.table.columns[1+col]
+      for op, val in predicates[col] :
+        if isinstance(val, (int, long)) :
+          literal = str(val)
+        elif isinstance(val, float) :
+          literal = repr(val)
+        elif isinstance(val, basestring) :
+          literal = "'%s'" % val.replace("'", "''")
+        else :
+          continue
+        if vstorage.isDictionaryColumn(column, self.table.columnTypes[column]) :
+          conditions.append("%s in (select id from main.%s where value %s %s)" % (column, vstorage.DICTIONARYTABLE, operators[op], literal))
+        else :
+          conditions.append("%s %s %s" % (column, operators[op], literal))
+    sql = vstorage.getSelectSQL(self.table, partitions, conditions, rowid=True)
+    logger.debug("[FILTER] sql=%s" % sql)
+    for row in cursor.execute(sql) :
+      self.data.append(list(row))
+
+
+
+# hybrid table for synced datacollectors
+class HybridTable(LocalTable):
+  """
+  rows up to high-water mark of each node come from local storage, only newer rows are fetched from cluster, eg.
+    select * from v_hybrid.dc_requests_issued where time > datetime('now', '-1 day')
+  """
+
+  def Open(self):
+    cursor = HybridCursor(self)
+    logger.debug("[Open] CURSOR=%s" % cursor)
+    return cursor
+
+
+
+# cursor for hybrid table
+class HybridCursor(LocalCursor):
+  def Filter(self, indexnum, indexname, constraintargs):
+    self.data = []
+    self.pos=0
+    vc = vcluster.getVerticaCluster()
+    if vc is None or len(vc.executors) == 0 :
+      logger.error("cluster is not accessible now! It will be reconnected in background.")
+      return
+
+    tablename = self.table.tablename
+    predicates = getPredicates(indexname, constraintargs)
+    logger.debug("[FILTER] tablename=%s, cursor=%s, indexname=%s, constraintargs=%s, predicates=%s" % (tablename, self, indexname, constraintargs, predicates))
+
+    # Note: nested queries share read snapshot of running user query, so high-water marks are consistent with local rows.
+    cursor = self.table.vs.connection.cursor()
+    beginNestedQueries()
+    try :
+      sql = "select node_name, max_time from main.%s where table_name = ? and file_name = ''" % WATERMARKTABLE
+      if len(cursor.execute("select tbl_name from main.sqlite_master where lower(tbl_name) = ?", (WATERMARKTABLE, )).fetchall()) > 0 :
+        since = dict(cursor.execute(sql, (tablename, )).fetchall())
+      else :
+        since = {}
+
+      # local rows
+      if len(since) > 0 :
+        self.readLocal(cursor, predicates)
+    finally :
+      endNestedQueries()
+      cursor.close()
+
+    # newer rows from cluster
+    logger.debug("[FILTER] %s local rows, fetch rows after %s" % (len(self.data), since))
+    mch = self.remoteCall(vc, {"catalogpath":vc.catPath, "tablename":tablename, "columns":self.table.columns, "predicates":predicates, "keywords":None, "since":since})
+    if mch is None :
+      return
+
+    # rowid is time * 10000 + node number given by remote filter, so OR terms filtering table again get same rowid for same row
+    columnTypes = [self.table.columnTypes[c] for c in self.table.columns]
+    self.receive(mch, lambda channel, rows: self.parseData(rows, columnTypes))
+
+
+
+# sync metrics table
+class SyncStatsTable(Table):
+  """
+  current sync metrics of each (table_name, node_name): metrics of last sync pass, totals since startup, lag of newest synced row 
+  behind newest row on node when it was fetched, and last failure of table, eg.
+    select * from v_sync_stats order by lag_seconds desc
+  Metrics of each sync pass in last days are in local table sync_history.
+  """
+
+  syncable = False
+  ddl = """
+    CREATE TABLE %s (
+      table_name varchar(128),
+      node_name varchar(128),
+      last_sync_time timestamp,
+      rows_fetched integer,
+      bytes_fetched integer,
+      remote_seconds float,
+      parse_seconds float,
+      insert_seconds float,
+      lag_seconds float,
+      total_rows integer,
+      total_bytes integer,
+      last_failure_time timestamp,
+      last_failure varchar(1024)
+    );""" % SYNCSTATSTABLE
+
+  def __init__(self, tablename, vs):
+    Table.__init__(self, tablename)
+    self.vs = vs
+    self.columns = ["rowid", "table_name", "node_name", "last_sync_time", "rows_fetched", "bytes_fetched", "remote_seconds", "parse_seconds", \
+        "insert_seconds", "lag_seconds", "total_rows", "total_bytes", "last_failure_time", "last_failure"]
+
+  def BestIndex(self, constraints, orderbys):
+    return None
+
+  def Open(self):
+    cursor = SyncStatsCursor(self)
+    logger.debug("[Open] CURSOR=%s" % cursor)
+    return cursor
+
+
+
+# cursor for sync metrics table
+class SyncStatsCursor(Cursor):
+  def Filter(self, indexnum, indexname, constraintargs):
+    self.data = []
+    self.pos=0
+    formatTime = lambda t: datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S.%f") if not t is None else None
+
+    # Note: metrics are updated by sync job concurrently
+    failures = dict(self.table.vs.syncFailures)
+    synced = set()
+    for (tablename, nodeName), stats in sorted(self.table.vs.nodeSyncStats.items()) :
+      failureTime, failure = failures.get(tablename, (None, None))
+      self.data.append([len(self.data), tablename, nodeName, formatTime(stats["time"]), stats["rows"], stats["bytes"], stats["remoteSeconds"], \
+          stats["parseSeconds"], stats["insertSeconds"], stats["lag"], \
+          stats["rowsTotal"], stats["bytesTotal"], formatTime(failureTime), failure])
+      synced.add(tablename)
+    # tables never synced successfully
+    for tablename, (failureTime, failure) in sorted(failures.iteritems()) :
+      if not tablename in synced :
+        self.data.append([len(self.data), tablename, None, None, None, None, None, None, None, None, None, None, formatTime(failureTime), failure])
+
+
+
+# deadline status table
+class QueryStatusTable(Table):
+  """
+  recent nodes whose results were truncated or empty because they did not finish before deadlines, eg.
+    select set_query_timeout(30, 10);
+    select count(*) from dc_requests_issued;
+    select * from v_query_status order by time desc;
+  """
+
+  syncable = False
+  ddl = """
+    CREATE TABLE %s (
+      time timestamp,
+      table_name varchar(128),
+      node_name varchar(128),
+      status varchar(20),
+      bytes_received integer,
+      seconds float
+    );""" % QUERYSTATUSTABLE
+
+  def __init__(self, tablename):
+    Table.__init__(self, tablename)
+    self.columns = ["rowid", "time", "table_name", "node_name", "status", "bytes_received", "seconds"]
+
+  def BestIndex(self, constraints, orderbys):
+    return None
+
+  def Open(self):
+    cursor = QueryStatusCursor(self)
+    logger.debug("[Open] CURSOR=%s" % cursor)
+    return cursor
+
+
+
+# cursor for deadline status table
+class QueryStatusCursor(Cursor):
+  def Filter(self, indexnum, indexname, constraintargs):
+    self.data = [ [i] + list(status) for i, status in enumerate(list(QUERYSTATUS)) ]
+    self.pos=0
+
+
+
+def setQueryTimeout(querySeconds=None, nodeSeconds=None) :
+  """ SQL function set_query_timeout(querySeconds[, nodeSeconds]): deadlines of following queries in current thread, 
+  for all nodes and for each node. NULL or 0 means default(see vcluster.QUERYTIMEOUT/NODETIMEOUT, no deadline by default).
+  Note: following queries return partial results of nodes not finished in time, these nodes are listed in v_query_status.
+  """
+
+  threadlocal_set("QUERYTIMEOUT", float(querySeconds) if querySeconds else None)
+  threadlocal_set("NODETIMEOUT", float(nodeSeconds) if nodeSeconds else None)
+  return querySeconds
+
+
+
+# aggregate table for datacollectors
+class AggregateTable(Table):
+  """
+  partial aggregates(count/sum/min/max) computed on each node, grouped by node and time bucket, then combined here. 
+  Arguments are given by hidden columns table_name, column_list and bucket_seconds, eg.
+    select node_name, sum(count), max(max) from dc_aggregate('dc_resource_acquisitions', 'memory_inuse_kb', 0) 
+    where column_name = 'memory_inuse_kb' and time > '2017-04-02 00:00:00' group by node_name
+  Note: predicates on "time" filter original rows, "time" column of result is begin of time bucket.
+  """
+
+  syncable = False
+
+  def __init__(self, tablename, vs):
+    Table.__init__(self, tablename)
+    self.vs = vs
+    # Note: followings will be set in *.create function just after "create virtual table TABLENAME using verticasource(aggregate)":
+    #   self.hiddenColumns: {columnIndex: argumentName}
+
+  def BestIndex(self, constraints, orderbys):
+    logger.debug("[BESTINDEX] tablename=%s, constraints=%s, orderbys=%s" % (self.tablename, constraints, orderbys))
+    if not any([ self.isArgument(columnIndex, predicate) and self.hiddenColumns[columnIndex] == "table_name" for (columnIndex, predicate) in constraints ]) :
+      # table_name is required
+      return None
+
+    argOrders = []
+    indexNames = []
+    i = 0
+    for (columnIndex, predicate) in constraints : 
+      if isPushdownConstraint(columnIndex, predicate) or self.isArgument(columnIndex, predicate) :
+        # omit checking by SQLite except node_name, as time predicates have been applied on original rows.
+        argOrders.append((i, columnIndex != 1))
+        indexNames.append("%s_%s" % (columnIndex, predicate))
+        i += 1
+      else :
+        argOrders.append(None)
+
+    return (argOrders, 0, "+".join(indexNames), False, 1)
+
+  def Open(self):
+    cursor = AggregateCursor(self)
+    logger.debug("[Open] CURSOR=%s" % cursor)
+    return cursor
+
+
+
+# cursor for aggregate table
+class AggregateCursor(Cursor):
+  def Filter(self, indexnum, indexname, constraintargs):
+    self.data = []
+    self.pos=0
+    vc = vcluster.getVerticaCluster()
+    if vc is None or len(vc.executors) == 0 :
+      logger.error("cluster is not accessible now! It will be reconnected in background.")
+      return
+
+    predicates = getPredicates(indexname, constraintargs)
+    self.arguments = self.getArguments(predicates)
+    
+    # aggregate on source table
+    tablename = (self.arguments.get("table_name", None) or "").lower()
+    sourceTable = self.table.vs.tables.get(tablename, None)
+    if sourceTable is None or getattr(sourceTable, "remotefiltermodule", None) != self.table.remotefiltermodule :
+      raise StandardError("[%s] is not a datacollector table, aggregate is only supported on datacollectors" % tablename)
+    aggColumns = [ c.strip().lower() for c in (self.arguments.get("column_list", None) or "").split(",") if len(c.strip()) > 0 ]
+    for c in aggColumns :
+      if not c in sourceTable.columns[1:] :
+        raise StandardError("column [%s] does not exist in table [%s]" % (c, tablename))
+
+    logger.debug("[FILTER] tablename=%s, cursor=%s, indexname=%s, constraintargs=%s, predicates=%s, arguments=%s" % (self.table.tablename, self, indexname, constraintargs, predicates, self.arguments))
+
+    args = {"catalogpath":vc.catPath, "tablename":tablename, "columns":sourceTable.columns, "columnTypes":[sourceTable.columnTypes[c] for c in sourceTable.columns], "predicates":predicates, "keywords":None}
+    args.update(self.remoteArguments(sourceTable, aggColumns))
+    mch = self.remoteCall(vc, args)
+    if mch is None :
+      return
+
+    # combine partial results from each node
+    groups = {}
+    self.receive(mch, lambda channel, item: self.combine(groups, item))
+    self.output(groups, sourceTable)
+
+
+  def remoteArguments(self, sourceTable, aggColumns) :
+    return {"aggregate": {"columns": aggColumns, "bucket": self.arguments.get("bucket_seconds", None) or 0}}
+
+  def combine(self, groups, item) :
+    for row in item["aggregates"] :
+      vdatacollectors_filterdata.mergeAggregate(groups, tuple(row[:3]), row[3:])
+
+  def output(self, groups, sourceTable) :
+    for (timeBucket, nodeName, columnName), (count, total, minValue, maxValue) in sorted(groups.iteritems()) :
+      if sourceTable.columnTypes.get(columnName, None) in vdatacollectors_filterdata.TIMETYPES :
+        minValue, maxValue = formatVerticaTime(minValue), formatVerticaTime(maxValue)
+      self.data.append([len(self.data), formatVerticaTime(timeBucket), nodeName, columnName, count, total, minValue, maxValue])
+
+
+
+# sketch table for datacollectors
+class SketchTable(AggregateTable):
+  """
+  mergeable sketches(HyperLogLog for distinct count, DDSketch for quantiles of numeric columns) built on each node, grouped by node, time bucket 
+  and value of an optional group column, then merged here. Arguments are given by hidden columns table_name, column_list, bucket_seconds and group_column.
+  Use SQL aggregate functions approx_count_distinct(hll) and approx_percentile(ddsketch, q) to merge them further, eg.
+    select group_value pool_name, approx_percentile(ddsketch, 0.99) p99, approx_count_distinct(hll) 
+    from dc_sketch('dc_resource_acquisitions', 'memory_inuse_kb', 0, 'pool_name') 
+    where time > '2017-04-02 00:00:00' group by 1
+  """
+
+  def Open(self):
+    cursor = SketchCursor(self)
+    logger.debug("[Open] CURSOR=%s" % cursor)
+    return cursor
+
+
+
+# cursor for sketch table
+class SketchCursor(AggregateCursor):
+  def remoteArguments(self, sourceTable, aggColumns) :
+    groupColumn = (self.arguments.get("group_column", None) or "").strip().lower()
+    if len(groupColumn) > 0 and not groupColumn in sourceTable.columns[1:] :
+      raise StandardError("column [%s] does not exist in table [%s]" % (groupColumn, sourceTable.tablename))
+    return {"sketch": {"columns": aggColumns, "bucket": self.arguments.get("bucket_seconds", None) or 0, "groupColumn": groupColumn if len(groupColumn) > 0 else None}}
+
+  def combine(self, groups, item) :
+    for timeBucket, nodeName, columnName, groupValue, count, hll, ddsketch in item["sketches"] :
+      vsketch.mergeSketch(groups, (timeBucket, nodeName, columnName, groupValue), \
+          [count, vsketch.HyperLogLog.deserialize(hll), vsketch.DDSketch.deserialize(ddsketch) if not ddsketch is None else None])
+
+  def output(self, groups, sourceTable) :
+    for (timeBucket, nodeName, columnName, groupValue), (count, hll, ddsketch) in sorted(groups.iteritems()) :
+      self.data.append([len(self.data), formatVerticaTime(timeBucket), nodeName, columnName, groupValue, count, \
+          buffer(hll.serialize()), buffer(ddsketch.serialize()) if not ddsketch is None else None])
+
+
+
+def getPredicates(indexname, constraintargs) :
+  """ get predicates from index name and constraint arguments generated by BestIndex
+  Arguments:
+    indexname: string, columnIndx_predicate[+columnIndx_predicate]* 
+    constraintargs: list of values
+  Return: predicates {columnIndx: [[predicate1, value1], [predicate2, value2]]}, value of time is Vertica inner long format
+  """
+
+  predicates = {}
+  if not indexname is None and len(indexname) > 0 and not constraintargs is None and len(constraintargs) > 0 :
+    for i, pred in enumerate(indexname.split("+")) :
+      lstPred = pred.split("_")
+      col = int(lstPred[0])
+      op = int(lstPred[1])
+      val = constraintargs[i]
+      if col == 0 :
+        # time: string to long
+        if val is None :
+          # -9223372036854775808(-0x8000000000000000) means null in Vertica
+          val = -0x8000000000000000 
+        else :
+          val = parseVerticaTime(val)
+      predCol = predicates[col] if col in predicates else []
+      predCol.append([op, val])
+      predicates[col] = predCol
+  return predicates
+
+
+TIMEVALUE = r"('(?:[^']|'')*'|\?\d*|[:@$]\w+)"
+TIMERANGEPATTERN = re.compile(r"(?:\b(\w+)\s*\.\s*)?\btime\s+between\s+%s\s+and\s+%s|(?:\b(\w+)\s*\.\s*)?\btime\s*(>=|>)\s*%s\s+and\s+(?:(\w+)\s*\.\s*)?\btime\s*(<=|<)\s*%s" \
+    % (TIMEVALUE, TIMEVALUE, TIMEVALUE, TIMEVALUE), re.IGNORECASE)
+# the only table of statement in from clause: [schema.]table[(arguments)] [[as] alias]
+FROMCLAUSEPATTERN = re.compile(r"^\s*(?:\w+\s*\.\s*)?(\w+)\s*(?:\([^()]*\))?(?:\s+(?:as\s+)?(\w+))?\s*;?\s*$")
+
+def getTimeRanges(sql, bindings, tablenames) :
+  """ get union of closed time ranges in disjunctive predicates on table of statement, eg.
+    "time between ? and ? or time between ? and ?", "r.time >= '2017-04-02 20:00:00' and r.time < '2017-04-02 21:00:00' or ..."
+  Only statements on a single table are matched, without join, subquery or compound select. Time column may be qualified by name or alias 
+  of the table. Ranges of other statements are ambiguous in text, their time ranges are fetched one by one.
+  Arguments:
+    sql: string
+    bindings: sequence or dictionary of values for parameters in sql
+    tablenames: list of lowercase names of tables referenced in sql
+  Return: {tablename: sorted and merged time ranges [(low, low inclusive, high, high inclusive)]}, value of time is Vertica inner long format. 
+    Only table having multiple time ranges in disjunction is included.
+  """
+
+  if len(tablenames) == 0 or re.search(r"\bor\b", sql, re.IGNORECASE) is None :
+    return {}
+  # mask string literals, for counting positional parameters before each value
+  masked = re.sub(r"'(?:[^']|'')*'", lambda m: "'" + "_" * (len(m.group(0)) - 2) + "'", sql)
+  params = [ m.start() for m in re.finditer(r"\?(?!\d)", masked) ]
+
+  # the only table and its alias
+  lowered = masked.lower()
+  words = re.findall(r"\w+", lowered)
+  if words.count("select") != 1 or words.count("from") != 1 or len(set(words).intersection(["join", "union", "except", "intersect"])) > 0 :
+    return {}
+  clause = re.split(r"\b(?:where|group|order|limit|having|window)\b", re.split(r"\bfrom\b", lowered)[1])[0]
+  m = FROMCLAUSEPATTERN.match(clause)
+  if m is None or not m.group(1) in tablenames :
+    return {}
+  tablename = m.group(1)
+  qualifiers = set([None, tablename, m.group(2)])
+
+  def getValue(m, i) :
+    value = m.group(i)
+    if value.startswith("'") :
+      return value[1:-1].replace("''", "'")
+    if value.startswith("?") :
+      if isinstance(bindings, dict) :
+        return None
+      index = int(value[1:]) - 1 if len(value) > 1 else len([ p for p in params if p < m.start(i) ])
+      return bindings[index] if not bindings is None and index < len(bindings) else None
+    return bindings.get(value[1:], None) if isinstance(bindings, dict) else None
+
+  ranges = []
+  for m in TIMERANGEPATTERN.finditer(masked) :
+    # values are taken from original sql at same position of masked one
+    m = TIMERANGEPATTERN.match(sql, m.start(), m.end())
+    if m is None :
+      continue
+    if not m.group(2) is None :
+      used = [m.group(1)]
+      low, lowInclusive, high, highInclusive = getValue(m, 2), True, getValue(m, 3), True
+    else :
+      used = [m.group(4), m.group(7)]
+      low, lowInclusive, high, highInclusive = getValue(m, 6), m.group(5) == ">=", getValue(m, 9), m.group(8) == "<="
+    if any([ not (q.lower() if not q is None else None) in qualifiers for q in used ]) :
+      # time of something else, eg. column of a table-valued function
+      return {}
+    if not isinstance(low, basestring) or not isinstance(high, basestring) :
+      continue
+    try :
+      ranges.append((parseVerticaTime(low), lowInclusive, parseVerticaTime(high), highInclusive))
+    except (ValueError, OverflowError) :
+      continue
+
+  return { tablename: mergeTimeRanges(ranges) } if len(ranges) > 1 else {}
+
+
+def getStatementTimeRanges(tablename) :
+  """ time ranges of table in statement running on this thread and rows fetched for them, see exectracer. 
+  Return: (ranges, {arguments except time predicates: rows}), None if there is no multiple time ranges of table or statement is finished.
+  """
+
+  statementRanges = threadlocal_get("TIMERANGES")
+  if statementRanges is None :
+    return None
+  owner, tableRanges = statementRanges
+  if not owner is None and owner() is None :
+    # cursor of statement is gone, drop rows of it
+    threadlocal_set("TIMERANGES", None)
+    return None
+  return tableRanges.get(tablename, None)
+
+
+def beginNestedQueries() :
+  """ statements executed by this thread from now on are nested in running statement, until endNestedQueries() """
+
+  threadlocal_set("NESTEDQUERIES", (threadlocal_get("NESTEDQUERIES") or 0) + 1)
+
+
+def endNestedQueries() :
+  threadlocal_set("NESTEDQUERIES", threadlocal_get("NESTEDQUERIES") - 1)
+
+
+def mergeTimeRanges(ranges) :
+  """ sort and merge overlapping time ranges [(low, low inclusive, high, high inclusive)], empty ones are removed """
+
+  merged = []
+  for low, lowInclusive, high, highInclusive in sorted(ranges, key=lambda r: (r[0], not r[1])) :
+    if low > high or low == high and not (lowInclusive and highInclusive) :
+      continue
+    if len(merged) > 0 and (low < merged[-1][2] or low == merged[-1][2] and (lowInclusive or merged[-1][3])) :
+      mLow, mLowInclusive, mHigh, mHighInclusive = merged[-1]
+      if high > mHigh or high == mHigh and highInclusive :
+        merged[-1] = (mLow, mLowInclusive, high, highInclusive)
+    else :
+      merged.append((low, lowInclusive, high, highInclusive))
+  return merged
+
+
+def getRangePredicates(timeRange) :
+  """ time predicates [[predicate1, value1], [predicate2, value2]] of time range (low, low inclusive, high, high inclusive) """
+
+  low, lowInclusive, high, highInclusive = timeRange
+  return [[32 if lowInclusive else 4, low], [8 if highInclusive else 16, high]]
+
+
+def parseVerticaTime(value) :
+  """ convert string to Vertica inner datetime, eg: '2017-04-02 20:42:35.737558' should be 544452155737558 """
+
+  # 946684800 is secondes between '1970-01-01 00:00:00'(Python) and '2000-01-01 00:00:00'(Vertica)
+  return long(datetimeparser.parse(value).strftime('%s%f'))-946684800*1000000
+
+
+def formatVerticaTime(lValue) :
+  """ convert Vertica inner datetime to string, eg: 544452155737558 should be '2017-04-02 20:42:35.737558' """
+
+  # -9223372036854775808(-0x8000000000000000) means null in Vertica
+  if lValue is None or lValue == -0x8000000000000000 :
+    return None
+  # 946684800 is secondes between '1970-01-01 00:00:00'(Python) and '2000-01-01 00:00:00'(Vertica)
+  return datetime.fromtimestamp(float(lValue)/1000000+946684800).strftime("%Y-%m-%d %H:%M:%S.%f")
 
-          self.data.extend(tuples)
-        except Exception, e:
-          raise StandardError("[%s] on table [%s]" % (str(e), self.table.tablename))
 
 # Note: please sync vsourceparser/vsourceparser.c with following function
 def parseRows(rows, columnTypes):
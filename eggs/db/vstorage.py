@@ -0,0 +1,675 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: time partitioned local storage for synced tables
+# Author: DingQiang Liu
+
+import re
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# local storage of synced table is split into tables by day, eg. dc_requests_issued_p20170402,
+# and a view with original table name union all of them.
+# Note: SQLite limits number of SELECTs in a compound SELECT to 500 by default.
+PARTITIONFORMAT = "%s_p%s"
+# partition of rows without time
+NULLPARTITION = "00000000"
+
+# retention: partitions older than RETENTIONDAYS days will be dropped, then oldest partitions will be dropped until size of partitions is under DISKBUDGET bytes.
+# Other data(eg. full text tables, sync history) is not budgeted, and partitions of current day are never dropped.
+RETENTIONDAYS = 90
+DISKBUDGET = 4 * 1024 * 1024 * 1024
+
+# compact encoding of partitions, decoded into original layout by views and local virtual tables:
+#   time: integer, microseconds since '2000-01-01 00:00:00'(Vertica inner format)
+#   low-cardinality strings(node_name, *_type, *_state, ...): integer id of value in dictionary table
+DICTIONARYTABLE = "sync_dictionary"
+DICTIONARYCOLUMNPATTERN = re.compile(r"^(node_name|.*_name|.*_type|.*_state|.*_status|.*_category|.*_mode|.*_level|.*_pool|pool_.*)$")
+INTEGERTYPES = ('integer', 'int', 'bigint', 'smallint', 'mediumint', 'tinyint', 'int2', 'int8', )
+FLOATTYPES = ('double', 'float', 'real', 'decimal', 'numeric', )
+# 946684800 is secondes between '1970-01-01 00:00:00'(Python) and '2000-01-01 00:00:00'(Vertica)
+VERTICAEPOCH = 946684800
+
+
+def isDictionaryColumn(columnName, columnType):
+  return columnType in ('varchar', 'char', ) and not DICTIONARYCOLUMNPATTERN.match(columnName) is None
+
+
+def encodeTime(value):
+  """ convert local time string to Vertica inner format, eg. '2017-04-02 20:42:35.737558' should be 544452155737558 """
+
+  # -9223372036854775808(-0x8000000000000000) means null in Vertica
+  if value is None or value == -0x8000000000000000 :
+    return None
+  if isinstance(value, (int, long)) :
+    return value
+  seconds = long(time.mktime(datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S").timetuple()))
+  micros = long((value[20:26] + "000000")[:6]) if len(value) > 20 else 0
+  return (seconds - VERTICAEPOCH) * 1000000 + micros
+
+
+def getDecodeExpression(table, columnName):
+  """ SQL expression decoding column of partition into original value """
+
+  if columnName == "time" :
+    return "datetime(time / 1000000 + %s, 'unixepoch', 'localtime') || '.' || substr('000000' || (time %% 1000000), -6)" % VERTICAEPOCH
+  if isDictionaryColumn(columnName, table.columnTypes[columnName]) :
+    return "(select value from main.%s where id = %s)" % (DICTIONARYTABLE, columnName)
+  return columnName
+
+
+class Dictionary:
+  """ ids of strings for compact encoding, cached by the only writer of local storage """
+
+  def __init__(self):
+    self.ids = None
+
+  def load(self, cursor):
+    cursor.execute("create table if not exists main.%s (id integer primary key, value text unique)" % DICTIONARYTABLE)
+    self.ids = dict([ (value, id) for id, value in cursor.execute("select id, value from main.%s" % DICTIONARYTABLE) ])
+
+  def encode(self, cursor, value):
+    if value is None :
+      return None
+    if self.ids is None :
+      self.load(cursor)
+    id = self.ids.get(value, None)
+    if id is None :
+      id = len(self.ids) + 1
+      cursor.execute("insert into main.%s values (?, ?)" % DICTIONARYTABLE, (id, value))
+      self.ids[value] = id
+    return id
+
+  def reset(self):
+    """ forget cached ids, eg. after rollback of transaction which added new values """
+
+    self.ids = None
+
+
+def encodeRows(cursor, table, rows, dictionary):
+  """ encode rows(without rowid) of table for partitions """
+
+  encoders = []
+  for c in table.columns[1:] :
+    if c == "time" :
+      encoders.append(encodeTime)
+    elif isDictionaryColumn(c, table.columnTypes[c]) :
+      encoders.append(lambda v: dictionary.encode(cursor, v))
+    else :
+      encoders.append(None)
+  return [ [ v if encoders[i] is None else encoders[i](v) for i, v in enumerate(row) ] for row in rows ]
+
+
+def getStorageDDL(table, name):
+  """ DDL of partition with compact encoding """
+
+  columns = []
+  for c in table.columns[1:] :
+    columnType = "integer" if c == "time" or isDictionaryColumn(c, table.columnTypes[c]) else table.columnTypes[c]
+    columns.append("%s %s" % (c, columnType))
+  if not table.primaryKeys is None and len(table.primaryKeys) > 0 :
+    return "CREATE TABLE main.%s (%s, PRIMARY KEY(%s)) WITHOUT ROWID" % (name, ", ".join(columns), ",".join(table.primaryKeys))
+  return "CREATE TABLE main.%s (%s)" % (name, ", ".join(columns))
+
+
+def getPartitionKey(timeValue):
+  """ partition key of time in Vertica inner format, eg. 544452155737558('2017-04-02 20:42:35.737558') is in partition '20170402' """
+
+  if timeValue is None :
+    return NULLPARTITION
+  return datetime.fromtimestamp(float(timeValue) / 1000000 + VERTICAEPOCH).strftime("%Y%m%d")
+
+
+def isPartitionInRange(partition, predicates):
+  """ whether partition may have rows matching time predicates
+  Arguments:
+    predicates: [[op, value]], value is Vertica inner format
+  """
+
+  if partition == NULLPARTITION :
+    return len(predicates) == 0
+  #operators = {2: "==", 4: ">", 8: "<=", 16: "<", 32: ">="}
+  day = datetime.strptime(partition, "%Y%m%d")
+  low = encodeTime(day.strftime("%Y-%m-%d %H:%M:%S"))
+  high = encodeTime((day + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"))
+  for op, val in predicates :
+    if op == 2 :
+      low, high = max(low, val), min(high, val + 1)
+    elif op == 4 :
+      low = max(low, val + 1)
+    elif op == 32 :
+      low = max(low, val)
+    elif op == 16 :
+      high = min(high, val)
+    elif op == 8 :
+      high = min(high, val + 1)
+  return low < high
+
+
+def getPartitions(cursor, tablename):
+  """ get partition keys of table in ascending order """
+
+  pattern = re.compile("^%s_p(\d{8})$" % re.escape(tablename.lower()))
+  sql = "select tbl_name from main.sqlite_master where type = 'table' and lower(tbl_name) like ?"
+  partitions = [ pattern.match(name.lower()) for (name, ) in cursor.execute(sql, (tablename.lower() + "_p%", )) ]
+  return sorted([ m.group(1) for m in partitions if not m is None ])
+
+
+def getRowidExpression(table):
+  """ SQL expression of rowid of partition row, same as remote filter: time * 10000 + node number(last 4 digits of node_name) """
+
+  return "coalesce(time, 0) * 10000 + coalesce(cast(substr(%s, -4) as integer), 0)" % getDecodeExpression(table, "node_name")
+
+
+def getSelectSQL(table, partitions, conditions=[], rowid=False):
+  """ SQL on partitions of table, returning rows in original layout
+  Arguments:
+    partitions: list of partition keys
+    conditions: list of SQL conditions on encoded columns of partitions
+    rowid: bool, if True, first column is rowid from getRowidExpression
+  """
+
+  columns = ", ".join(([ "%s as rowid" % getRowidExpression(table) ] if rowid else []) + [ "%s as %s" % (getDecodeExpression(table, c), c) for c in table.columns[1:] ])
+  where = (" where " + " and ".join(conditions)) if len(conditions) > 0 else ""
+  return " union all ".join([ "select %s from main.%s%s" % (columns, PARTITIONFORMAT % (table.tablename, p), where) for p in partitions ])
+
+
+def refreshView(cursor, table):
+  """ recreate view of table on all its partitions, drop it if no partition """
+
+  partitions = getPartitions(cursor, table.tablename)
+  sql = "drop view if exists main.%s" % table.tablename
+  logger.debug("sql=%s" % sql)
+  cursor.execute(sql)
+  if len(partitions) > 0 :
+    sql = "create view main.%s as %s" % (table.tablename, getSelectSQL(table, partitions))
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+
+
+def ensurePartitions(cursor, table, partitions):
+  """ create partitions of table if not existing
+  Arguments:
+    partitions: list of partition keys
+  """
+
+  existing = set(getPartitions(cursor, table.tablename))
+  created = set(partitions) - existing
+  for p in created :
+    sql = getStorageDDL(table, PARTITIONFORMAT % (table.tablename, p))
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+  if len(created) > 0 :
+    # secondary indexes advised for table
+    for c in getIndexedColumns(cursor, table.tablename) :
+      createIndexes(cursor, table, c, created)
+    refreshView(cursor, table)
+
+
+def writeRows(cursor, table, sql, rows, dictionary):
+  """ encode rows and route them into partitions by time
+  Arguments:
+    sql: insert statement, with placeholder %s for name of partition
+    rows: list of rows without rowid, time is Vertica inner format or string
+  """
+
+  partitions = {}
+  for row in encodeRows(cursor, table, rows, dictionary) :
+    partitions.setdefault(getPartitionKey(row[0]), []).append(row)
+  ensurePartitions(cursor, table, partitions.keys())
+  for p, partitionRows in partitions.iteritems() :
+    cursor.executemany(sql % (PARTITIONFORMAT % (table.tablename, p)), partitionRows)
+
+
+def migrate(cursor, table, dictionary, batchSize=5000):
+  """ encode rows of local table synced before partitioning, and of partitions in original layout, into partitions """
+
+  tablename = table.tablename
+  sources = []
+  sql = "select tbl_name from main.sqlite_master where lower(tbl_name) = ? and type = 'table'"
+  sources.extend([ name for (name, ) in cursor.execute(sql, (tablename.lower(), )) ])
+  for p in getPartitions(cursor, tablename) :
+    name = PARTITIONFORMAT % (tablename, p)
+    if any([ c == "time" and (t or "").lower() != "integer" for _, c, t, _, _, _ in cursor.execute("pragma main.table_info(%s)" % name) ]) :
+      sources.append(name)
+  if len(sources) == 0 :
+    return
+
+  logger.info("[storage] encoding %s into partitions of table [%s] ..." % (sources, tablename))
+  # view refers to sources
+  if not tablename in sources :
+    cursor.execute("drop view if exists main.%s" % tablename)
+  sql = "insert or ignore into main.%%s values (%s)" % ",".join(["?"] * len(table.columns[1:]))
+  reader = cursor.getconnection().cursor()
+  for source in sources :
+    legacy = source + "_legacy"
+    cursor.execute("alter table main.%s rename to %s" % (source, legacy))
+    rows = reader.execute("select %s from main.%s" % (", ".join(table.columns[1:]), legacy))
+    while True :
+      batch = list(islice(rows, batchSize))
+      if len(batch) == 0 :
+        break
+      writeRows(cursor, table, sql, batch, dictionary)
+    cursor.execute("drop table main.%s" % legacy)
+  reader.close()
+  refreshView(cursor, table)
+
+
+def getUsedSize(cursor):
+  """ bytes used by main database, not including free pages """
+
+  for (pageCount, ) in cursor.execute("pragma main.page_count") : break
+  for (freeCount, ) in cursor.execute("pragma main.freelist_count") : break
+  for (pageSize, ) in cursor.execute("pragma main.page_size") : break
+  return (pageCount - freeCount) * pageSize
+
+
+def getTableSizes(cursor):
+  """ bytes used by each table of main database including its indexes, {tableName: bytes}. 
+  Return: None if dbstat virtual table is not available in SQLite(SQLITE_ENABLE_DBSTAT_VTAB)
+  """
+
+  try :
+    pages = dict(cursor.execute("select name, sum(pgsize) from dbstat group by name").fetchall())
+  except Exception :
+    return None
+  sizes = {}
+  for name, tableName in cursor.execute("select name, tbl_name from main.sqlite_master where type in ('table', 'index')") :
+    sizes[tableName] = sizes.get(tableName, 0) + pages.get(name, 0)
+  return sizes
+
+
+def dropPartitions(cursor, table, partitions):
+  for p in partitions :
+    sql = "drop table if exists main.%s" % (PARTITIONFORMAT % (table.tablename, p))
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+  refreshView(cursor, table)
+
+
+def enforceRetention(cursor, tables):
+  """ drop whole partitions older than RETENTIONDAYS, then oldest days of all tables until size of partitions is under DISKBUDGET.
+  Arguments:
+    tables: list of partitioned tables
+  Return: number of dropped partitions
+  """
+
+  partitions = dict([ (t.tablename, getPartitions(cursor, t.tablename)) for t in tables ])
+  dropped = 0
+
+  # by age, rows without time are the oldest
+  oldest = (datetime.now() - timedelta(days=RETENTIONDAYS)).strftime("%Y%m%d")
+  for t in tables :
+    expired = [ p for p in partitions[t.tablename] if p < oldest ]
+    if len(expired) > 0 :
+      dropPartitions(cursor, t, expired)
+      partitions[t.tablename] = [ p for p in partitions[t.tablename] if not p in expired ]
+      dropped += len(expired)
+
+  # by size, only when whole database exceeds budget, as measuring partitions reads all pages
+  if getUsedSize(cursor) > DISKBUDGET :
+    sizes = getTableSizes(cursor)
+    if sizes is None :
+      logger.warning("[retention] size of partitions is not available without dbstat of SQLite, used size of whole local database is budgeted.")
+      getSize = lambda: getUsedSize(cursor)
+    else :
+      names = [ PARTITIONFORMAT % (t.tablename, p) for t in tables for p in partitions[t.tablename] ]
+      budgeted = [ sum([ sizes.get(name, 0) for name in names ]) ]
+      getSize = lambda: budgeted[0]
+
+    # current day is being synced, it would be written again
+    today = datetime.now().strftime("%Y%m%d")
+    days = sorted(set([ p for t in tables for p in partitions[t.tablename] if p < today ]))
+    for day in days :
+      if getSize() <= DISKBUDGET :
+        break
+      for t in tables :
+        if day in partitions[t.tablename] :
+          dropPartitions(cursor, t, [day])
+          dropped += 1
+          if not sizes is None :
+            budgeted[0] -= sizes.get(PARTITIONFORMAT % (t.tablename, day), 0)
+
+  if dropped > 0 :
+    logger.info("[retention] dropped %s partitions, used size of local database is %s bytes." % (dropped, getUsedSize(cursor)))
+  return dropped
+
+
+# compaction of fine-grained tables(eg. dc_*_by_second): [(age in days, bucket seconds)], partitions older than age are rolled into coarser buckets.
+COMPACTIONLEVELS = [(2, 60), (14, 3600)]
+# local table for compaction state, each (table_name, partition) has bucket_seconds it has been compacted into.
+COMPACTIONTABLE = "sync_compactions"
+# aggregation rules by column name, first matched rule wins: (prefixes, suffixes, aggregate function)
+AGGREGATERULES = [
+    ((), ("_start_value", "_start_time", ), "min"),
+    ((), ("_end_value", "_end_time", ), "max"),
+    (("min_", ), ("_min", ), "min"),
+    (("max_", ), ("_max", ), "max"),
+    (("avg_", "average_", ), ("_avg", "_average", ), "avg"),
+    (("total_", ), ("_count", "_sum", "_squares", "_total", "records", ), "sum"),
+]
+
+
+def getAggregate(columnName, columnType):
+  """ aggregate function of column when rows are rolled into coarser buckets, derived from column name and type """
+
+  name = columnName.lower()
+  if name == "start_time" :
+    return "min"
+  if name == "end_time" :
+    return "max"
+  for prefixes, suffixes, func in AGGREGATERULES :
+    if any([ name.startswith(p) for p in prefixes ]) or any([ name.endswith(s) for s in suffixes ]) :
+      return func
+  if columnType in INTEGERTYPES or columnType in FLOATTYPES :
+    return "avg"
+  # timestamp, varchar, boolean: first one
+  return "min"
+
+
+def compactPartition(cursor, table, partition, bucket):
+  """ roll rows of partition into buckets of seconds, grouped by bucket, node and primary keys.
+  Rows of different nodes are never rolled together, as rowid is computed from time and node.
+  """
+
+  name = PARTITIONFORMAT % (table.tablename, partition)
+  tmpName = name + "_c"
+  # time is microseconds in partitions, buckets are aligned to '2000-01-01 00:00:00'
+  bucketTime = "time - time %% %s" % (bucket * 1000000)
+  keys = [ c for c in ["node_name"] + (table.primaryKeys or []) if c in table.columns and c != "time" ]
+  keys = sorted(set(keys), key=keys.index)
+  selects = []
+  for c in table.columns[1:] :
+    columnType = table.columnTypes[c]
+    if c == "time" :
+      selects.append(bucketTime)
+    elif c in keys :
+      selects.append(c)
+    else :
+      func = getAggregate(c, columnType)
+      if func == "avg" and columnType in INTEGERTYPES :
+        selects.append("cast(round(avg(%s)) as integer)" % c)
+      else :
+        selects.append("%s(%s)" % (func, c))
+  groupBys = [ bucketTime ] + keys
+
+  # rows are rolled in place, so view on partitions is untouched
+  sql = "drop table if exists temp.%s" % tmpName
+  logger.debug("sql=%s" % sql)
+  cursor.execute(sql)
+  sql = "create temp table %s as select %s from main.%s group by %s" % (tmpName, ", ".join(selects), name, ", ".join(groupBys))
+  logger.debug("sql=%s" % sql)
+  cursor.execute(sql)
+  sql = "delete from main.%s" % name
+  logger.debug("sql=%s" % sql)
+  cursor.execute(sql)
+  sql = "insert into main.%s select * from temp.%s" % (name, tmpName)
+  logger.debug("sql=%s" % sql)
+  cursor.execute(sql)
+  sql = "drop table temp.%s" % tmpName
+  logger.debug("sql=%s" % sql)
+  cursor.execute(sql)
+
+
+def compact(cursor, table):
+  """ keep recent partitions at full resolution, roll older ones into coarser buckets by COMPACTIONLEVELS.
+  Arguments:
+    table: partitioned table with resolution(seconds of original rows), and primary keys starting with time
+  Return: number of compacted partitions
+  """
+
+  tablename = table.tablename
+  sql = "create table if not exists main.%s (table_name varchar(128), partition varchar(8), bucket_seconds integer, PRIMARY KEY(table_name, partition)) WITHOUT ROWID" % COMPACTIONTABLE
+  cursor.execute(sql)
+  sql = "select partition, bucket_seconds from main.%s where table_name = ?" % COMPACTIONTABLE
+  compacted = dict(cursor.execute(sql, (tablename, )).fetchall())
+
+  count = 0
+  today = datetime.now()
+  for p in getPartitions(cursor, tablename) :
+    if p == NULLPARTITION :
+      continue
+    age = (today - datetime.strptime(p, "%Y%m%d")).days
+    buckets = [ bucket for days, bucket in COMPACTIONLEVELS if age >= days and bucket > table.resolution ]
+    if len(buckets) == 0 or compacted.get(p, 0) >= max(buckets) :
+      continue
+    compactPartition(cursor, table, p, max(buckets))
+    sql = "insert or replace into main.%s values (?, ?, ?)" % COMPACTIONTABLE
+    cursor.execute(sql, (tablename, p, max(buckets)))
+    count += 1
+
+  # forget dropped partitions
+  sql = "delete from main.%s where table_name = ? and not partition in (%s)" % (COMPACTIONTABLE, ",".join([ "'%s'" % p for p in getPartitions(cursor, tablename) ]))
+  cursor.execute(sql, (tablename, ))
+
+  if count > 0 :
+    logger.info("[compaction] compacted %s partitions of table [%s]." % (count, tablename))
+  return count
+
+
+# secondary indexes advised by workload: columns used in predicates of user queries on local tables are indexed in all partitions,
+# if they are queried frequently(decayed by half every INDEXHALFLIFE seconds) weighted by their selectivity, under INDEXBUDGET bytes.
+INDEXTABLE = "sync_indexes"
+INDEXBUDGET = 512 * 1024 * 1024
+INDEXHALFLIFE = 24 * 3600
+# index is created when score(decayed frequency * weight) reaches INDEXMINSCORE, and dropped when it falls under INDEXDROPSCORE
+INDEXMINSCORE = 3
+INDEXDROPSCORE = 0.5
+# weight of column is its selectivity, but at least INDEXMINWEIGHT, so low-cardinality columns(eg. pool_name) are indexed when they are filtered frequently
+INDEXMINWEIGHT = 0.1
+# rows of newest partition sampled for selectivity(distinct values / rows)
+INDEXSAMPLEROWS = 10000
+INDEXFORMAT = "ix_%s_%s"
+
+
+def getIndexedColumns(cursor, tablename):
+  sql = "select tbl_name from main.sqlite_master where lower(tbl_name) = ?"
+  if len(cursor.execute(sql, (INDEXTABLE, )).fetchall()) == 0 :
+    return []
+  sql = "select column_name from main.%s where table_name = ? and indexed = 1" % INDEXTABLE
+  return [ c for (c, ) in cursor.execute(sql, (tablename, )) ]
+
+
+def createIndexes(cursor, table, column, partitions):
+  for p in partitions :
+    name = PARTITIONFORMAT % (table.tablename, p)
+    sql = "create index if not exists main.%s on %s(%s)" % (INDEXFORMAT % (name, column), name, column)
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+
+
+def dropIndexes(cursor, table, column, partitions):
+  for p in partitions :
+    sql = "drop index if exists main.%s" % (INDEXFORMAT % (PARTITIONFORMAT % (table.tablename, p), column))
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+
+
+def getSelectivity(cursor, table, column, partitions):
+  """ distinct values / rows of column in sample of newest partition """
+
+  if len(partitions) == 0 :
+    return 0.0
+  sql = "select count(distinct %s), count(*) from (select %s from main.%s limit %s)" % (column, column, PARTITIONFORMAT % (table.tablename, partitions[-1]), INDEXSAMPLEROWS)
+  for distinct, rows in cursor.execute(sql) : break
+  return float(distinct) / rows if rows > 0 else 0.0
+
+
+def getIndexScore(frequency, selectivity):
+  """ decayed frequency weighted by selectivity, selectivity is None if it's not sampled yet """
+
+  return frequency * max(selectivity or 0, INDEXMINWEIGHT)
+
+
+def adviseIndexes(cursor, tables, workload):
+  """ create or drop secondary indexes on partitions by workload
+  Arguments:
+    tables: list of partitioned tables
+    workload: {tablename: {columnName: times used in predicates}} since last call
+  Return: (number of created indexes, number of dropped indexes)
+  """
+
+  sql = "create table if not exists main.%s (table_name varchar(128), column_name varchar(128), frequency float, updated float, selectivity float, size_bytes integer, indexed integer, PRIMARY KEY(table_name, column_name)) WITHOUT ROWID" % INDEXTABLE
+  cursor.execute(sql)
+  tables = dict([ (t.tablename, t) for t in tables ])
+  now = time.time()
+
+  # decay frequency and add new workload
+  stats = {}
+  sql = "select table_name, column_name, frequency, updated, selectivity, size_bytes, indexed from main.%s" % INDEXTABLE
+  for tablename, column, frequency, updated, selectivity, size, indexed in cursor.execute(sql).fetchall() :
+    stats[(tablename, column)] = [frequency * 0.5 ** ((now - updated) / INDEXHALFLIFE), selectivity, size, indexed]
+  for tablename, columns in workload.iteritems() :
+    for column, count in columns.iteritems() :
+      if tablename in tables and column in tables[tablename].columns[1:] :
+        stats.setdefault((tablename, column), [0.0, None, 0, 0])[0] += count
+
+  partitions = dict([ (t, getPartitions(cursor, t)) for t in tables ])
+  for (tablename, column), stat in stats.iteritems() :
+    if stat[1] is None and stat[0] >= INDEXMINSCORE and tablename in tables :
+      stat[1] = getSelectivity(cursor, tables[tablename], column, partitions[tablename])
+
+  # keep most valuable indexes under budget, then create new ones while budget allows
+  created, dropped = 0, 0
+  used = 0
+  for (tablename, column), stat in sorted(stats.iteritems(), key=lambda x: -getIndexScore(x[1][0], x[1][1])) :
+    frequency, selectivity, size, indexed = stat
+    score = getIndexScore(frequency, selectivity)
+    table = tables.get(tablename, None)
+    if table is None :
+      continue
+    if indexed and (score < INDEXDROPSCORE or used + size > INDEXBUDGET) :
+      dropIndexes(cursor, table, column, partitions[tablename])
+      stat[2], stat[3] = 0, 0
+      dropped += 1
+    elif indexed :
+      used += size
+    elif score >= INDEXMINSCORE and used < INDEXBUDGET :
+      before = getUsedSize(cursor)
+      createIndexes(cursor, table, column, partitions[tablename])
+      size = max(getUsedSize(cursor) - before, 0)
+      if used + size > INDEXBUDGET :
+        dropIndexes(cursor, table, column, partitions[tablename])
+        continue
+      stat[2], stat[3] = size, 1
+      used += size
+      created += 1
+      logger.info("[index] created index on column [%s] of table [%s], %s bytes." % (column, tablename, size))
+
+  # forget columns not queried any more
+  cursor.execute("delete from main.%s" % INDEXTABLE)
+  sql = "insert into main.%s values (?, ?, ?, ?, ?, ?, ?)" % INDEXTABLE
+  cursor.executemany(sql, [ (tablename, column, frequency, now, selectivity, size, indexed) for (tablename, column), (frequency, selectivity, size, indexed) in stats.iteritems() \
+      if indexed or frequency >= INDEXDROPSCORE ])
+
+  if created + dropped > 0 :
+    logger.info("[index] created %s, dropped %s secondary indexes, %s bytes used by them." % (created, dropped, used))
+  return created, dropped
+
+
+# full text storage(eg. vertica_log, messages): rows are kept in a plain content table, eg. vertica_log_rows(not _content, which is shadow table of FTS), 
+# and an external content full text index with original table name only indexes full text columns.
+FTSCONTENTFORMAT = "%s_rows"
+# pages merged by each incremental merge of full text index segments
+FTSMERGEPAGES = 1000
+# FTS5 if SQLite is compiled with it, or FTS4
+FTSMODULE = None
+
+
+def getFullTextModule(cursor):
+  global FTSMODULE
+  if FTSMODULE is None :
+    try :
+      cursor.execute("create virtual table temp.sync_fts5_probe using fts5(x)")
+      cursor.execute("drop table temp.sync_fts5_probe")
+      FTSMODULE = "fts5"
+    except Exception :
+      FTSMODULE = "fts4"
+  return FTSMODULE
+
+
+def getFullTextDDL(table, module):
+  """ DDL of external content full text index of table, only full text columns are indexed """
+
+  tablename = table.tablename
+  content = FTSCONTENTFORMAT % tablename
+  columns = table.columns[1:]
+  if module == "fts5" :
+    return "CREATE VIRTUAL TABLE main.%s USING fts5(%s, content='%s', content_rowid='rowid')" % (tablename, \
+        ", ".join([ c if c in table.fullTextColumns else c + " UNINDEXED" for c in columns ]), content)
+  return "CREATE VIRTUAL TABLE main.%s USING fts4(content='%s', %s%s)" % (tablename, content, \
+      ", ".join([ "%s %s" % (c, table.columnTypes[c]) for c in columns ]), \
+      "".join([ ", notindexed=%s" % c for c in columns if not c in table.fullTextColumns ]))
+
+
+def createFullText(cursor, table):
+  """ create content table, full text index and triggers keeping them in sync if not exist. 
+  Full text table storing content itself(FTS4 before) is migrated.
+  Return: True if a new empty content table is created
+  """
+
+  tablename = table.tablename
+  content = FTSCONTENTFORMAT % tablename
+  sql = "select lower(tbl_name), sql from main.sqlite_master where type = 'table' and lower(tbl_name) in (?, ?)"
+  existing = dict(cursor.execute(sql, (tablename.lower(), content.lower())).fetchall())
+  if tablename.lower() in existing and content.lower() in existing :
+    return False
+
+  module = getFullTextModule(cursor)
+  columns = table.columns[1:]
+  newColumns = ", ".join([ "new.%s" % c for c in columns ])
+  oldColumns = ", ".join([ "old.%s" % c for c in columns ])
+  sqls = [ "create table if not exists main.%s (%s)" % (content, ", ".join([ "%s %s" % (c, table.columnTypes[c]) for c in columns ])), 
+      "create index if not exists main.%s_time on %s(time)" % (content, content) ]
+  legacy = tablename.lower() in existing
+  if legacy :
+    sqls.append("insert into main.%s(%s) select %s from main.%s" % (content, ", ".join(columns), ", ".join(columns), tablename))
+    sqls.append("drop table main.%s" % tablename)
+  sqls.append(getFullTextDDL(table, module))
+  if module == "fts5" :
+    sqls.append("create trigger if not exists main.%s_ai after insert on %s begin insert into %s(rowid, %s) values(new.rowid, %s); end" % (content, content, tablename, ", ".join(columns), newColumns))
+    sqls.append("create trigger if not exists main.%s_ad after delete on %s begin insert into %s(%s, rowid, %s) values('delete', old.rowid, %s); end" % (content, content, tablename, tablename, ", ".join(columns), oldColumns))
+  else :
+    sqls.append("create trigger if not exists main.%s_ai after insert on %s begin insert into %s(docid, %s) values(new.rowid, %s); end" % (content, content, tablename, ", ".join(columns), newColumns))
+    sqls.append("create trigger if not exists main.%s_ad before delete on %s begin delete from %s where docid = old.rowid; end" % (content, content, tablename))
+  # index rows already in content table
+  sqls.append("insert into main.%s(%s) values('rebuild')" % (tablename, tablename))
+
+  logger.info("[storage] creating %s full text storage of table [%s] ..." % (module, tablename))
+  for sql in sqls :
+    logger.debug("sql=%s" % sql)
+    cursor.execute(sql)
+  return not legacy and not content.lower() in existing
+
+
+def mergeFullText(cursor, tablename, pages=FTSMERGEPAGES):
+  """ merge segments of full text index incrementally, at most about pages of work
+  Return: True if there may be more segments to merge
+  """
+
+  sql = "select sql from main.sqlite_master where type = 'table' and lower(tbl_name) = ?"
+  ddls = [ ddl for (ddl, ) in cursor.execute(sql, (tablename.lower(), )) ]
+  if len(ddls) == 0 :
+    return False
+  connection = cursor.getconnection()
+  changes = connection.totalchanges()
+  if "using fts5" in ddls[0].lower() :
+    cursor.execute("insert into main.%s(%s, rank) values('merge', %s)" % (tablename, tablename, pages))
+  else :
+    cursor.execute("insert into main.%s(%s) values('merge=%s,8')" % (tablename, tablename, pages))
+  # less than 2 changes means nothing left to merge
+  return connection.totalchanges() - changes >= 2
+
+
+def optimizeFullText(cursor, tablename):
+  """ merge all segments of full text index into one, it may take long time on large index """
+
+  sql = "insert into main.%s(%s) values('optimize')" % (tablename, tablename)
+  logger.debug("sql=%s" % sql)
+  cursor.execute(sql)
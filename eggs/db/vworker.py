@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P. 
+# Description: resident worker on each Vertica node, keeping filter modules loaded and serving requests over channels
+# Author: DingQiang Liu
+
+import os, sys
+import imp
+import threading
+import traceback
+
+
+def loadModule(name, source):
+    """
+    compile source into a new module and register it in sys.modules, so its globals(caches, indexes...) live as long as this worker.
+
+    args :
+    * name: full module name on coordinator, eg. 'db.vdatacollectors_filterdata'
+    * source: source code of module
+
+    return : module
+    """
+
+    parts = name.split('.')
+    # parent packages only need to exist in sys.modules for "import db.xxx" of other loaded modules
+    for i in range(1, len(parts)) :
+        pkgname = '.'.join(parts[:i])
+        if not pkgname in sys.modules :
+            pkg = imp.new_module(pkgname)
+            pkg.__path__ = []
+            sys.modules[pkgname] = pkg
+
+    module = imp.new_module(name)
+    module.__file__ = '<%s>' % name
+    sys.modules[name] = module
+    exec compile(source, module.__file__, 'exec') in module.__dict__
+    if len(parts) > 1 :
+        setattr(sys.modules['.'.join(parts[:-1])], parts[-1], module)
+
+    return module
+
+
+def runRequest(module, channel, args):
+    """
+    run module.filterdata(channel, args) and close channel when finished.
+    """
+
+    try :
+        module.filterdata(channel, args)
+    except Exception :
+        if not channel.isclosed() :
+            channel.close(traceback.format_exc())
+        return
+    if not channel.isclosed() :
+        channel.close()
+
+
+def serve(channel):
+    """
+    serve requests from coordinator until channel closed.
+
+    requests :
+    * ("load", modulename, source, reqchannel): load module, keep it for following requests. Reply None through reqchannel when it's loaded.
+    * ("call", modulename, args, reqchannel): run modulename.filterdata(reqchannel, args) in a new thread, results sent through reqchannel.
+    * ("ping", reqchannel): heartbeat, reply "pong" through reqchannel.
+
+    errors of a request are sent back by closing its reqchannel with the traceback, worker keeps serving other requests.
+    """
+
+    modules = {}
+    while True :
+        try :
+            request = channel.receive()
+        except EOFError :
+            break
+        if request is None :
+            break
+
+        reqchannel = request[-1]
+        try :
+            cmd = request[0]
+            if cmd == "load" :
+                _, name, source, reqchannel = request
+                modules[name] = loadModule(name, source)
+                reqchannel.send(None)
+                reqchannel.close()
+            elif cmd == "call" :
+                _, name, args, reqchannel = request
+                if not name in modules :
+                    raise KeyError("module [%s] is not loaded" % name)
+                t = threading.Thread(target=runRequest, args=(modules[name], reqchannel, args))
+                t.daemon = True
+                t.start()
+            elif cmd == "ping" :
+                _, reqchannel = request
+                reqchannel.send("pong")
+                reqchannel.close()
+        except Exception :
+            try :
+                if not reqchannel.isclosed() :
+                    reqchannel.close(traceback.format_exc())
+            except Exception :
+                pass
+
+
+if __name__ == '__channelexec__' or __name__ == '__main__' :
+    # ignore stderr message when 'non-unicode character' == u'...' : UnicodeWarning: Unicode equal comparison failed to convert both arguments to Unicode - interpreting them as being unequal
+    sys.stderr = open(os.devnull, 'w')
+
+    serve(channel)
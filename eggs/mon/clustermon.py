@@ -11,10 +11,12 @@ import logging
 import time
 from cStringIO import StringIO
 import re
+import imp
 
 import db.vcluster as vcluster
 import db.dbmanager as dbmanager
 import util.reflection as reflection
+from util.threadlocal import threadlocal_set
 
 old_stdout = sys.stdout
 sys.stdout = mystdout = StringIO() 
@@ -25,13 +27,42 @@ srcclusterdstatmodule = reflection.overridemodule(dstatmodule, clusterdstatmodul
 
 logger = logging.getLogger("clustermon")
 
+# dstat overrided for cluster, served by resident worker on each node, so counters of dstat are kept between updates
+srcfilterdata = """
+def filterdata(channel, args) :
+    global nodeName
+    nodeName = channel.gateway.id.split('-')[0] # remove the tailing '-slave'
 
-def remotecall(src, args, nodeNamesPattern) :
-    """ remotely execute script on Vertica cluster.
+    old_stdout = sys.stdout
+    from cStringIO import StringIO
+    sys.stdout = mystdout = StringIO() 
+    try :
+        if "args" in args :
+            dstatmodule.initterm()
+            dstatmodule.op = dstatmodule.Options(args["args"])
+            dstatmodule.theme = dstatmodule.set_theme()
+            dstatmodule.main()
+            dstatmodule.perform(0)
+            result = header(totlist, totlist)
+        else :
+            dstatmodule.perform(args["update"])
+            result = mystdout.getvalue()
+    finally :
+        sys.stdout = old_stdout
+    channel.send(result)
+"""
+filterdatamodule = imp.new_module("mon.clustermon_filterdata")
+# source is sent to workers instead of file of module
+filterdatamodule.REMOTESOURCE = srcclusterdstatmodule + srcfilterdata
+sys.modules[filterdatamodule.__name__] = filterdatamodule
+
+
+def remotecall(args, nodeNamesPattern) :
+    """ remotely execute dstat on Vertica cluster, in "ui" scan class. 
+      Nodes not finished before deadlines of queries(see vcluster.receive) are skipped in this update.
 
       Arguments:
-        - src: string, python scriptlet.
-        - args: dictionary of arguments for script.
+        - args: dictionary of arguments for dstat.
         - nodeNamesPattern: regular expression pattern for select Vertica nodes.
 
       Returns: list of result from each nodes of Vertica cluster.
@@ -39,22 +70,19 @@ def remotecall(src, args, nodeNamesPattern) :
     
     ret = {}
     vc = vcluster.getVerticaCluster()
-    mch = vc.executors.remote_exec(src)
-    mch.send_each(args)
-    q = mch.make_receive_queue(endmarker=None)
-    terminated = 0
-    while 1:
-      channel, result = q.get()
-      if result is None :
-        terminated += 1
-        if terminated == len(mch):
-          break
-        continue
-      else: 
-        nodeName = channel.gateway.id
-        ret.update({nodeName: result}) 
-
-    return [ret[k] for k in [key for key in sorted(ret) if nodeNamesPattern.match(key) ]]
+    nodeNames = [ gw.id for gw in vc.executors if nodeNamesPattern.match(gw.id) ]
+    if len(nodeNames) == 0 :
+      return []
+    args = dict(args, predicates={})
+    # monitoring is interactive, scans of it are not queued behind sync
+    threadlocal_set("SCANCLASS", "ui")
+    mch = vc.remoteCall(filterdatamodule, args, nodeNames)
+    status = vcluster.receive(mch, lambda channel, result: ret.update({channel.gateway.id: result}))
+    for nodeName, (nodeStatus, seconds) in status.iteritems() :
+      if nodeStatus != "finished" :
+        logger.warning("node %s did not finish in %.1f seconds, its result is %s." % (nodeName, seconds, "partial" if nodeName in ret else "skipped"))
+
+    return [ret[k] for k in sorted(ret)]
 
 
 def initmonitor(args, nodeNamesPattern) :
@@ -68,25 +96,7 @@ def initmonitor(args, nodeNamesPattern) :
     """
 
     headers = ""
-    src = srcclusterdstatmodule + """
-if __name__ == '__channelexec__' or __name__ == '__main__' :
-    nodeName = channel.gateway.id.split('-')[0] # remove the tailing '-slave'
-
-    remoteargs = channel.receive()
-    args = remoteargs["args"]
-    dstatmodule.initterm()
-    dstatmodule.op = dstatmodule.Options(args)
-    dstatmodule.theme = dstatmodule.set_theme()
-    dstatmodule.main()
-
-    old_stdout = sys.stdout
-    from cStringIO import StringIO
-    sys.stdout = mystdout = StringIO() 
-    dstatmodule.perform(0)
-    sys.stdout = old_stdout
-    channel.send(header(totlist, totlist))
-    """
-    for line in remotecall(src, {"args": args}, nodeNamesPattern) :
+    for line in remotecall({"args": args}, nodeNamesPattern) :
         #only get headers from 1st node
         headers = line
         break
@@ -104,21 +114,7 @@ def monitoring(update, nodeNamesPattern) :
       Returns: ansi monitoring lines
     """
 
-    src = """
-if __name__ == '__channelexec__' or __name__ == '__main__' :
-    nodeName = channel.gateway.id.split('-')[0] # remove the tailing '-slave'
-
-    remoteargs = channel.receive()
-    update = remoteargs["update"]
-
-    old_stdout = sys.stdout
-    from cStringIO import StringIO
-    sys.stdout = mystdout = StringIO() 
-    dstatmodule.perform(update)
-    sys.stdout = old_stdout
-    channel.send(mystdout.getvalue())
-    """
-    return remotecall(src, {"update": update}, nodeNamesPattern) 
+    return remotecall({"update": update}, nodeNamesPattern) 
 
 
 if __name__ == "__main__":
@@ -134,12 +130,14 @@ if __name__ == "__main__":
         parser.add_option("--file", dest="vMetaFile", default="/opt/vertica/config/admintools.conf") 
         parser.add_option("--user", dest="vAdminOSUser", default="dbadmin") 
         parser.add_option("--nodes", dest="nodeNamesExpress", default=".*") 
+        # seconds waiting for each monitoring update from nodes, slow nodes are skipped in this update
+        parser.add_option("--timeout", dest="timeout", type="float", default=5) 
         (options, _) = parser.parse_args()
 
     args = ["--time", "--nodename", "--all", "--color", "--noupdate", "--noheaders"]
     skipnext = False
     for arg in sys.argv[1:] :
-        if arg in ['--database', '--file', '--user', '--nodes']:
+        if arg in ['--database', '--file', '--user', '--nodes', '--timeout']:
             skipnext = True
             continue
         if skipnext :
@@ -155,6 +153,7 @@ if __name__ == "__main__":
 
     dbmanager.setup(options.vDBName, options.vMetaFile, options.vAdminOSUser, "")
     nodeNamesPattern = re.compile(options.nodeNamesExpress)
+    threadlocal_set("QUERYTIMEOUT", options.timeout)
 
     # init, get headers
     headers = initmonitor(args, nodeNamesPattern)
@@ -34,12 +34,12 @@ Usage Example::
         return HTTPError(404, "Page not found")
 '''
 
-import time
 import inspect
 
 from bottle import PluginError
 
-import db.vsource as vsource
+import db.dbmanager as dbmanager
+from util.threadlocal import threadlocal_set
 
 
 def getConnection() :
@@ -96,21 +96,21 @@ class APSWPlugin(object):
             return callback
 
         def wrapper(*args, **kwargs):
+            # remote scans of web UI share nodes fairly with shell and sync job
+            threadlocal_set("SCANCLASS", "ui")
             # Connect to the database
             db = None
             con = getConnection()
             if not con is None:
-                db = con.cursor()
+                # wait for tables registered in background
+                db = dbmanager.Cursor(con.cursor())
             # Add the connection handle as a keyword argument.
             kwargs[keyword] = db
 
-            con.interrupt()
-            vsource.setLastSQLiteActivityTime(time.time())
             res = callback(*args, **kwargs)
             kwargs[keyword] = None
             db.close()
             db = None
-            vsource.setLastSQLiteActivityTime(time.time())
             return res
 
         # Replace the route callback with the wrapped one.
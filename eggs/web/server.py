@@ -157,7 +157,8 @@ if __name__ == "__main__":
     if len(args) > 0 :
         sqliteDBFile = args[0]
     
-    connection = dbmanager.setup(options.vDBName, options.vMetaFile, options.vAdminOSUser, sqliteDBFile)
+    # web UI is usable at once, tables of Vertica cluster are registered in background
+    connection = dbmanager.setup(options.vDBName, options.vMetaFile, options.vAdminOSUser, sqliteDBFile, lazy=True)
     setConnection(connection)
 
 
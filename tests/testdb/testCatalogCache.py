@@ -0,0 +1,128 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: testing cases for local cache of datacollectors catalog
+# Author: DingQiang Liu
+
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import apsw
+
+import db.vcluster as vcluster
+import db.vsource as vsource
+import db.vdatacollectors as vdatacollectors
+
+
+DDLS = {
+  "dc_good": "CREATE TABLE dc_good (\n  time timestamp,\n  node_name varchar(128),\n  value integer\n);",
+  "dc_bad": "CREATE TABLE dc_bad (\n  time timestamp,\n  node_name varchar(128),\n);",
+}
+
+
+class FakeChannel:
+  def __init__(self, result):
+    self.result = result
+
+  def receive(self) :
+    return self.result
+
+
+class FakeGateway:
+  """ gateway replying getSignature and getDDLs """
+
+  def __init__(self, signature):
+    self.signature = signature
+
+  def remote_exec(self, function, **kwargs) :
+    return FakeChannel(self.signature if function == vdatacollectors.getSignature else dict(DDLS))
+
+
+class FakeCluster:
+  catPath = "/data"
+
+  def __init__(self, signature):
+    self.executors = [ FakeGateway(signature) ] if not signature is None else []
+
+
+class TestCatalogCache(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.filename = os.path.join(self.path, "test.db")
+    self.connections = []
+    self.getVerticaCluster = vcluster.getVerticaCluster
+
+  def tearDown(self):
+    vcluster.getVerticaCluster = self.getVerticaCluster
+    for connection in self.connections :
+      connection.close()
+    shutil.rmtree(self.path)
+
+  def startup(self, signature) :
+    """ register datacollectors of cluster with signature, None for cluster not accessible """
+
+    vcluster.getVerticaCluster = lambda *args, **kwargs: FakeCluster(signature)
+    connection = apsw.Connection(self.filename)
+    self.connections.append(connection)
+    vs = vsource.setup(connection, lazy=True)
+    self.connections.append(vs.writer)
+    return vs, vs.registerCatalog()
+
+  def cached(self, vs) :
+    sql = "select table_name, signature, columns is null from main.%s order by 1" % vdatacollectors.CACHETABLE
+    return vs.writer.cursor().execute(sql).fetchall()
+
+  def testCacheWithoutCluster(self):
+    """testing datacollectors are registered from last cache when cluster is not accessible """
+
+    vs, fetched = self.startup("v1")
+    self.assertTrue(fetched)
+    self.assertTrue("dc_good" in vs.tables and not "dc_bad" in vs.tables)
+    # table failed registering is cached without columns
+    self.assertEqual([("dc_bad", "v1", 1), ("dc_good", "v1", 0)], self.cached(vs))
+
+    vs, fetched = self.startup(None)
+    self.assertFalse(fetched)
+    self.assertTrue("dc_good" in vs.tables)
+    self.assertEqual(["rowid", "time", "node_name", "value"], vs.tables["dc_good"].columns)
+
+    # cluster is accessible later
+    vcluster.getVerticaCluster = lambda *args, **kwargs: FakeCluster("v1")
+    self.assertTrue(vs.registerCatalog())
+    self.assertEqual([("dc_bad", "v1", 1), ("dc_good", "v1", 0)], self.cached(vs))
+
+  def testCacheOutOfSyncTransaction(self):
+    """testing catalog is cached by its own transaction, not inside transaction of sync job on writer connection """
+
+    vs, fetched = self.startup(None)
+    self.assertFalse(fetched)
+    vcluster.getVerticaCluster = lambda *args, **kwargs: FakeCluster("v1")
+
+    # sync job is writing when bootstrap is retried in background
+    cursor = vs.writer.cursor()
+    cursor.execute("create table main.t (x)")
+    cursor.execute("begin immediate; insert into main.t values (1)")
+    results = []
+    t = threading.Thread(target=lambda: results.append(vs.registerCatalog()))
+    t.start()
+    time.sleep(0.2)
+    cursor.execute("rollback")
+    t.join(10)
+    self.assertEqual([True], results)
+    self.assertEqual([("dc_bad", "v1", 1), ("dc_good", "v1", 0)], self.cached(vs))
+
+  def testNoCache(self):
+    """testing nothing is registered when cluster is not accessible at first startup """
+
+    vs, fetched = self.startup(None)
+    self.assertFalse(fetched)
+    self.assertFalse("dc_good" in vs.tables)
+
+
+if __name__ == "__main__":
+  unittest.main()
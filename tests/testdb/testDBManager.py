@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: testing cases for waiting tables registered in background
+# Author: DingQiang Liu
+
+import unittest
+from cStringIO import StringIO
+
+import apsw
+
+import db.dbmanager as dbmanager
+import db.vsource as vsource
+
+
+class TestLateTable(unittest.TestCase):
+  def setUp(self):
+    self.connection = apsw.Connection(":memory:")
+    self.connection.cursor().execute("create table t(x integer)")
+    self.waits = []
+    self.waitTable = vsource.waitTable
+    def waitTable(tablename, timeout=None) :
+      # table is registered while waiting
+      self.waits.append(tablename)
+      self.connection.cursor().execute("create table %s(y integer)" % tablename)
+      return True
+    vsource.waitTable = waitTable
+
+  def tearDown(self):
+    vsource.waitTable = self.waitTable
+    self.connection.close()
+
+  def count(self) :
+    return self.connection.cursor().execute("select count(*) from t").fetchall()[0][0]
+
+  def testCursorBatch(self):
+    """testing statements of batch executed before missing table are not executed again """
+
+    cursor = dbmanager.Cursor(self.connection.cursor())
+    self.assertEqual([(0, )], list(cursor.execute("insert into t values(1); select count(*) from late;")))
+    self.assertEqual(1, self.count())
+    self.assertEqual(["late"], self.waits)
+
+  def testCursorBatchBindings(self):
+    """testing bindings consumed by executed statements are not bound again """
+
+    cursor = dbmanager.Cursor(self.connection.cursor())
+    self.assertEqual([(0, )], list(cursor.execute("insert into t values(?); insert into t values(?); select count(*) from late where y > ?;", (1, 2, 0))))
+    self.assertEqual([(1, ), (2, )], self.connection.cursor().execute("select x from t order by x").fetchall())
+
+  def testShellBatch(self):
+    """testing shell processes statements of batch once """
+
+    shell = dbmanager.Shell(db=self.connection, stdout=StringIO(), stderr=StringIO())
+    shell.process_sql("insert into t values(1); create trigger tr after insert on t begin insert into t values(0); end; select count(*) from late;")
+    self.assertEqual(1, self.count())
+    self.assertEqual(["late"], self.waits)
+    self.assertEqual(["late", "t", "tr"], sorted([ n for (n, ) in self.connection.cursor().execute("select name from sqlite_master") ]))
+
+  def testSplitStatements(self):
+    """testing split of batch into complete statements """
+
+    self.assertEqual(["select 1;", " select ';';", " select 2"], dbmanager.splitStatements("select 1; select ';'; select 2"))
+
+
+if __name__ == "__main__":
+  unittest.main()
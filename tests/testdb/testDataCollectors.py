@@ -9,8 +9,14 @@ import unittest
 import traceback, sys
 import re
 
+import threading
+
 import apsw
 
+import db.vcluster as vcluster
+import db.vsource as vsource
+import db.vdatacollectors as vdatacollectors
+import db.vdatacollectors_filterdata as vdatacollectors_filterdata
 from testdb.dbtestcase import DBTestCase
 
 
@@ -136,6 +142,49 @@ class TestDataCollectors(DBTestCase):
         cursor.close();
 
 
+  def testAggregatesConcurrently(self):
+    """testing overlapping aggregate scans running concurrently get same partial aggregates as running alone """
+
+    cursor = None 
+    try :
+      cursor = self.connection.cursor()
+      for (t1, t2) in cursor.execute("select min(time), max(time) from dc_resource_acquisitions") : pass
+      if t1 is None :
+        return
+      low, high = vsource.parseVerticaTime(t1), vsource.parseVerticaTime(t2)
+      middle = low + (high - low) / 2
+      info = vdatacollectors.getColumnsInfo(cursor, "dc_resource_acquisitions")
+      vc = vcluster.getVerticaCluster()
+
+      def aggregate(timePredicates, results) :
+        args = {"catalogpath": vc.catPath, "tablename": "dc_resource_acquisitions", "columns": info["columns"], 
+            "columnTypes": [ info["columnTypes"][c] for c in info["columns"] ], "predicates": {0: timePredicates}, "keywords": None, 
+            "aggregate": {"columns": ["memory_inuse_kb"], "bucket": 0}}
+        groups = {}
+        def combine(channel, item) :
+          for row in item["aggregates"] :
+            vdatacollectors_filterdata.mergeAggregate(groups, tuple(row[:3]), row[3:])
+        vcluster.receive(vc.remoteCall(vdatacollectors_filterdata, args), combine)
+        results.append(groups)
+
+      alone = []
+      aggregate([[32, middle]], alone)
+
+      # narrower scan starts while wider one is in flight
+      wide, narrow = [], []
+      threads = [ threading.Thread(target=aggregate, args=([[32, low]], wide)), threading.Thread(target=aggregate, args=([[32, middle]], narrow)) ]
+      for t in threads :
+        t.start()
+      for t in threads :
+        t.join()
+      self.assertEqual(alone, narrow, "partial aggregates of overlapping scans running concurrently are different from running alone")
+    except :
+      self.fail(traceback.format_exc().decode(sys.stdout.encoding))
+    finally :
+      if not cursor is None :
+        cursor.close();
+
+
   def testZ_OtherTables(self):
     """testing other tables except dc_storage_layer_statistics, dc_requests_completed """
     
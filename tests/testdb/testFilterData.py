@@ -0,0 +1,136 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: testing cases for remote filter of Vertica data collectors on local files
+# Author: DingQiang Liu
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import db.vdatacollectors_filterdata as vdatacollectors_filterdata
+
+
+class TestReadRows(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    self.filename = os.path.join(self.path, "RequestsIssued_1.log")
+    with open(self.filename, "w") as f :
+      for t in range(100) :
+        f.write(":DCRequestsIssued\n.time:%d\n.request_id:%d\n.\n" % (t * 10, t))
+    self.args = {"columns": ["rowid", "time", "request_id"], "predicates": {}, "tabletag": "RequestsIssued"}
+
+  def tearDown(self):
+    vdatacollectors_filterdata.FILETIMERANGES.pop(self.filename, None)
+    shutil.rmtree(self.path)
+
+  def readTimes(self, **kwargs) :
+    args = dict(self.args)
+    args.update(kwargs)
+    return [ int(row[0]) for row in vdatacollectors_filterdata.readRows(self.filename, args) ]
+
+  def testTimePredicates(self):
+    """testing binary search on time predicates """
+
+    self.assertEqual(range(50, 90, 10), self.readTimes(predicates={0: [[32, 50], [16, 90]]}))
+    self.assertEqual([50], self.readTimes(predicates={0: [[2, 50]]}))
+    self.assertEqual([], self.readTimes(predicates={0: [[4, 990]]}))
+    self.assertEqual([], self.readTimes(predicates={0: [[32, 50], [16, 50]]}))
+
+  def testTimeRanges(self):
+    """testing union of time ranges searched in one file """
+
+    timeRanges = [[[32, 50], [8, 80]], [[4, 200], [16, 230]], [[32, 900], [8, 5000]]]
+    self.assertEqual(range(50, 90, 10) + [210, 220] + range(900, 1000, 10), self.readTimes(timeRanges=timeRanges))
+    # other time predicates apply to each range
+    self.assertEqual([220] + range(900, 1000, 10), self.readTimes(predicates={0: [[4, 210]]}, timeRanges=timeRanges))
+    self.assertEqual([], self.readTimes(timeRanges=[[[32, 5000]]]))
+
+  def testSample(self):
+    """testing sampled rows are a stable subset for same seed, and time predicates still apply """
+
+    sample = {"rate": 0.3, "seed": 1}
+    times = self.readTimes(sample=sample)
+    self.assertEqual(times, self.readTimes(sample=sample))
+    self.assertTrue(10 <= len(times) <= 50)
+    self.assertTrue(set(times).issubset(range(0, 1000, 10)))
+    times = self.readTimes(sample=sample, predicates={0: [[32, 500]]})
+    self.assertTrue(len(times) > 0 and min(times) >= 500)
+    self.assertNotEqual(times, self.readTimes(sample={"rate": 0.3, "seed": 2}, predicates={0: [[32, 500]]}))
+
+  def testSketchFile(self):
+    """testing sketches are built on node for each time bucket """
+
+    filename = os.path.join(self.path, "RequestsIssued_2.log")
+    with open(filename, "w") as f :
+      # one row every 0.1 second, request_id repeats every 25 rows
+      for t in range(100) :
+        f.write(":DCRequestsIssued\n.time:%d\n.request_id:%d\n.\n" % (t * 100000, t % 25))
+    groups = {}
+    args = dict(self.args, columnTypes=["integer", "timestamp", "integer"], sketch={"columns": ["request_id"], "bucket": 5, "groupColumn": None})
+    vdatacollectors_filterdata.sketchFile(filename, args, groups)
+    self.assertEqual([(0, "request_id", None), (5000000, "request_id", None)], sorted(groups.keys()))
+    count, hll, ddsketch = groups[(0, "request_id", None)]
+    self.assertEqual(50, count)
+    self.assertEqual(25, round(hll.count()))
+    self.assertTrue(abs(ddsketch.quantile(0.5) - 12) <= 1)
+
+
+class FakeGateway:
+  def __init__(self, nodeName):
+    self.id = nodeName
+
+
+class FakeChannel:
+  def __init__(self, nodeName):
+    self.gateway = FakeGateway(nodeName)
+    self.items = []
+
+  def isclosed(self) :
+    return False
+
+  def send(self, item) :
+    self.items.append(item)
+
+
+class TestFollow(unittest.TestCase):
+  def setUp(self):
+    self.path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.path, "v_db_node0001_catalog", "DataCollector"))
+    self.filename = os.path.join(self.path, "v_db_node0001_catalog", "DataCollector", "RequestsIssued_1.log")
+    with open(self.filename, "w") as f :
+      for t in range(100) :
+        f.write(":DCRequestsIssued\n.time:%d\n.request_id:%d\n.\n" % (t * 10, t))
+      # record being written
+      f.write(":DCRequestsIssued\n.time:1000\n")
+    self.tailBytes = vdatacollectors_filterdata.TAILBYTES
+
+  def tearDown(self):
+    vdatacollectors_filterdata.TAILBYTES = self.tailBytes
+    vdatacollectors_filterdata.FILEOFFSETS.pop(self.filename, None)
+    shutil.rmtree(self.path)
+
+  def testLastRecordTime(self):
+    """testing time of last complete record read from tail of file """
+
+    self.assertEqual(990, vdatacollectors_filterdata.lastRecordTime(self.filename, ":DCRequestsIssued"))
+    # tail is extended until a complete record is found
+    vdatacollectors_filterdata.TAILBYTES = 8
+    self.assertEqual(990, vdatacollectors_filterdata.lastRecordTime(self.filename, ":DCRequestsIssued"))
+    self.assertEqual(None, vdatacollectors_filterdata.lastRecordTime(os.path.join(self.path, "none.log"), ":DCRequestsIssued"))
+
+  def testNewestFirst(self):
+    """testing newest time on node is sent before rows of sync """
+
+    channel = FakeChannel("v_db_node0001")
+    args = {"catalogpath": self.path, "tablename": "dc_requests_issued", "columns": ["rowid", "time", "request_id"], "predicates": {}, "keywords": None, \
+        "follow": {"checkpoints": {}, "since": {"v_db_node0001": 500}}}
+    vdatacollectors_filterdata.filterdata(channel, args)
+    self.assertEqual({"newest": {"node": "v_db_node0001", "time": 990}}, channel.items[0])
+    self.assertEqual({"checkpoints": {"node": "v_db_node0001", "files": {"RequestsIssued_1.log": 990}}}, channel.items[-1])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,443 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: testing cases for Vertica cluster communication without cluster
+# Author: DingQiang Liu
+
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import imp
+import threading
+import time
+import getpass
+
+import execnet
+
+import db.vcluster as vcluster
+import db.vdatacollectors_filterdata as vdatacollectors_filterdata
+
+
+class FakeGateway:
+  def __init__(self, nodeName):
+    self.id = nodeName
+
+
+class FakeChannel:
+  """ channel of a node, items are delivered by calling its callback """
+
+  def __init__(self, nodeName):
+    self.gateway = FakeGateway(nodeName)
+    self.callback = None
+    self.closed = False
+
+  def setcallback(self, callback, endmarker=None) :
+    self.callback = callback
+
+  def close(self) :
+    self.closed = True
+
+
+class FakeCluster:
+  def removeScan(self, scan) :
+    pass
+
+
+def scanArgs(timePredicates, **kwargs) :
+  args = {"catalogpath": "/data", "tablename": "dc_requests_issued", "columns": ["rowid", "time", "node_name"], "predicates": {0: timePredicates}, "keywords": None}
+  args.update(kwargs)
+  return args
+
+
+class TestTimeRange(unittest.TestCase):
+  def testTimeRange(self):
+    """testing time range is the tightest bounds of time predicates """
+
+    self.assertEqual((None, True, None, True), vcluster.getTimeRange({}))
+    self.assertEqual((100, True, 200, False), vcluster.getTimeRange({0: [[32, 50], [32, 100], [16, 200], [8, 300]]}))
+    self.assertEqual((100, False, 100, True), vcluster.getTimeRange({0: [[32, 100], [4, 100], [8, 100]]}))
+    self.assertEqual((100, True, 100, True), vcluster.getTimeRange({0: [[2, 100]], 1: [[2, "v_db_node0001"]]}))
+
+  def testCovered(self):
+    """testing whether a time range is inside another one """
+
+    outer = (100, True, 200, False)
+    self.assertTrue(vcluster.isTimeRangeCovered(outer, outer))
+    self.assertTrue(vcluster.isTimeRangeCovered(outer, (120, False, 150, True)))
+    self.assertTrue(vcluster.isTimeRangeCovered(outer, (100, False, 200, False)))
+    self.assertFalse(vcluster.isTimeRangeCovered(outer, (50, True, 150, True)))
+    self.assertFalse(vcluster.isTimeRangeCovered(outer, (120, True, 200, True)))
+    self.assertFalse(vcluster.isTimeRangeCovered(outer, (120, True, None, True)))
+    self.assertFalse(vcluster.isTimeRangeCovered((100, False, None, True), (100, True, None, True)))
+    self.assertTrue(vcluster.isTimeRangeCovered((None, True, None, True), (None, True, 150, True)))
+    # time strings and Vertica inner format are not comparable
+    self.assertFalse(vcluster.isTimeRangeCovered(("2017-04-02 00:00:00", True, None, True), (100, True, None, True)))
+
+
+class TestSharedScan(unittest.TestCase):
+  def setUp(self):
+    self.channels = [ FakeChannel("v_db_node0001"), FakeChannel("v_db_node0002") ]
+
+  def startScan(self, args) :
+    scan = vcluster.SharedScan(FakeCluster(), vdatacollectors_filterdata, args, self.channels, {})
+    scan.subscribe(scan.channels.keys())
+    scan.start()
+    return scan
+
+  def testAttachCovered(self):
+    """testing rows scan attaches to scan in flight with wider time range """
+
+    scan = self.startScan(scanArgs([[32, 100], [16, 200]]))
+    self.assertFalse(scan.attach(vdatacollectors_filterdata, scanArgs([[32, 120], [8, 150]]), ["v_db_node0001"]) is None)
+    self.assertTrue(scan.attach(vdatacollectors_filterdata, scanArgs([[32, 50], [16, 200]]), ["v_db_node0001"]) is None)
+    self.assertTrue(scan.attach(vdatacollectors_filterdata, scanArgs([[32, 120], [16, 200]], sample={"rate": 0.1, "seed": None}), ["v_db_node0001"]) is None)
+
+  def testAttachAggregate(self):
+    """testing partial aggregates are only shared on same time range, as SQLite does not re-filter them """
+
+    aggregate = {"columns": ["memory_inuse_kb"], "bucket": 0}
+    scan = self.startScan(scanArgs([[32, 100], [16, 200]], aggregate=aggregate))
+    self.assertTrue(scan.attach(vdatacollectors_filterdata, scanArgs([[32, 120], [8, 150]], aggregate=aggregate), ["v_db_node0001"]) is None)
+    self.assertFalse(scan.attach(vdatacollectors_filterdata, scanArgs([[16, 200], [32, 100]], aggregate=aggregate), ["v_db_node0001"]) is None)
+
+    sketch = {"columns": ["memory_inuse_kb"], "bucket": 0, "groupColumn": None}
+    scan = self.startScan(scanArgs([], sketch=sketch))
+    self.assertTrue(scan.attach(vdatacollectors_filterdata, scanArgs([[32, 120]], sketch=sketch), ["v_db_node0001"]) is None)
+
+  def testBufferedResults(self):
+    """testing subscription attaching later gets results received before """
+
+    scan = self.startScan(scanArgs([[32, 100]]))
+    self.channels[0].callback("rows1")
+    self.channels[0].callback(None)
+    subscription = scan.attach(vdatacollectors_filterdata, scanArgs([[32, 150]]), ["v_db_node0001"])
+    self.assertFalse(subscription is None)
+    items = []
+    while not subscription.queue.empty() :
+      channel, item = subscription.queue.get()
+      items.append((channel.gateway.id, item))
+    self.assertEqual([("v_db_node0001", "rows1"), ("v_db_node0001", None)], items)
+
+
+class FakeExecutors(list):
+  def _register(self, gw) :
+    self.append(gw)
+
+  def _unregister(self, gw) :
+    self.remove(gw)
+
+
+class FakePingChannel:
+  def __init__(self, alive):
+    self.alive = alive
+
+  def receive(self, timeout=None) :
+    if not self.alive :
+      raise IOError("no reply in %s seconds" % timeout)
+    return "pong"
+
+
+class FakeWorker:
+  def __init__(self, nodeName):
+    self.gateway = FakeGateway(nodeName)
+    self.alive = True
+
+  def call(self, module, args) :
+    return FakeChannel(self.gateway.id)
+
+  def ping(self) :
+    return FakePingChannel(self.alive)
+
+
+class FakeNodeGateway(FakeGateway):
+  """ gateway of a reconnected node, starting its resident worker """
+
+  def remote_exec(self, source) :
+    return None
+
+
+class NodesCluster(vcluster.VerticaCluster):
+  """ cluster state of nodes without connecting them """
+
+  def __init__(self, nodeNames):
+    self.lock = threading.RLock()
+    self.workers = {}
+    self.executors = FakeExecutors()
+    self.reconnects = {}
+    self.admissions = dict([ (nodeName, vcluster.Admission()) for nodeName in nodeNames ])
+    self.scansLock = threading.Lock()
+    self.scans = []
+
+  def addWorkers(self) :
+    for nodeName in self.admissions :
+      worker = FakeWorker(nodeName)
+      self.workers[nodeName] = worker
+      self.executors.append(worker.gateway)
+
+
+class TestRelays(unittest.TestCase):
+  def setUp(self):
+    self.relayThreshold, self.relayFanout = vcluster.RELAYTHRESHOLD, vcluster.RELAYFANOUT
+    vcluster.RELAYTHRESHOLD, vcluster.RELAYFANOUT = 3, 2
+
+  def tearDown(self):
+    vcluster.RELAYTHRESHOLD, vcluster.RELAYFANOUT = self.relayThreshold, self.relayFanout
+
+  def testTopology(self):
+    """testing relays are connected first, and each of them reaches following nodes """
+
+    nodeNames = [ "v_db_node%04d" % i for i in range(1, 8) ]
+    vc = NodesCluster(nodeNames)
+    vc.nodeNames, vc.hostIPs, vc.relays = nodeNames, [ "10.0.0.%s" % i for i in range(1, 8) ], {}
+    connected = []
+    def createExecuter(i, verbose=True) :
+      relay = vc.getRelay(nodeNames[i])
+      connected.append((nodeNames[i], relay.id if not relay is None else None))
+      return FakeGateway(nodeNames[i])
+    vc.createExecuter = createExecuter
+    vc.initExecutersParallel()
+
+    relays = ["v_db_node0001", "v_db_node0004", "v_db_node0007"]
+    self.assertEqual(sorted([ (n, None) for n in relays ]), sorted(connected[:3]))
+    self.assertEqual([("v_db_node0002", "v_db_node0001"), ("v_db_node0003", "v_db_node0001"), ("v_db_node0005", "v_db_node0004"), ("v_db_node0006", "v_db_node0004")], \
+        sorted(connected[3:]))
+    self.assertEqual(sorted(nodeNames), sorted([ gw.id for gw in vc.executors ]))
+
+
+class FakeGroup:
+  """ execnet group recording specs of gateways """
+
+  specs = []
+
+  def makegateway(self, spec):
+    FakeGroup.specs.append(spec)
+    gw = FakeGateway(spec.split("//id=")[1].split("//")[0])
+    gw._group = self
+    return gw
+
+  def _unregister(self, gw):
+    pass
+
+
+class TestLocalNode(unittest.TestCase):
+  def setUp(self):
+    self.group = vcluster.execnet.Group
+    vcluster.execnet.Group = FakeGroup
+    FakeGroup.specs = []
+    nodeNames = ["v_db_node0001", "v_db_node0002"]
+    self.vc = NodesCluster(nodeNames)
+    # 192.0.2.0/24 is reserved for documentation, never an address of this host
+    self.vc.nodeNames, self.vc.hostIPs, self.vc.relays = nodeNames, ["127.0.0.1", "192.0.2.1"], {}
+    self.vc.vAdminOSUser = getpass.getuser()
+
+  def tearDown(self):
+    vcluster.execnet.Group = self.group
+
+  def testIsLocal(self):
+    """testing only address of this host with the same OS user is local """
+
+    self.assertTrue(self.vc.isLocal(0))
+    self.assertFalse(self.vc.isLocal(1))
+    self.vc.vAdminOSUser = getpass.getuser() + "_other"
+    self.assertFalse(self.vc.isLocal(0))
+
+  def testLocalGateway(self):
+    """testing local node is connected with popen instead of ssh """
+
+    gw = self.vc.createExecuter(0)
+    self.assertEqual("v_db_node0001", gw.id)
+    self.assertFalse(hasattr(gw, "_group"))
+    self.assertEqual(["popen//id=v_db_node0001//python=/opt/vertica/oss/python/bin/python"], FakeGroup.specs)
+
+
+class TestHeartbeat(unittest.TestCase):
+  def testRemoveAndReadmit(self):
+    """testing node not replying heartbeat is removed, then re-admitted with backoff """
+
+    vc = NodesCluster(["v_db_node0001", "v_db_node0002"])
+    vc.nodeNames = ["v_db_node0001", "v_db_node0002"]
+    vc.addWorkers()
+    vc.workers["v_db_node0002"].alive = False
+    vc.checkWorkers()
+    self.assertEqual(["v_db_node0001"], sorted(vc.workers.keys()))
+    self.assertEqual(["v_db_node0001"], [ gw.id for gw in vc.executors ])
+    self.assertTrue("v_db_node0002" in vc.reconnects)
+
+    # node is still unreachable, next attempt is delayed longer
+    vc.reconnects["v_db_node0002"] = (0, 0)
+    vc.createExecuter = lambda index, verbose=True: None
+    vc.readmitNodes()
+    attempts, nextTime = vc.reconnects["v_db_node0002"]
+    self.assertEqual(1, attempts)
+    self.assertTrue(nextTime >= time.time() + vcluster.RECONNECTDELAY)
+
+    vc.reconnects["v_db_node0002"] = (attempts, 0)
+    vc.createExecuter = lambda index, verbose=True: FakeNodeGateway(vc.nodeNames[index])
+    vc.readmitNodes()
+    self.assertEqual(["v_db_node0001", "v_db_node0002"], sorted(vc.workers.keys()))
+    self.assertEqual(["v_db_node0001", "v_db_node0002"], sorted([ gw.id for gw in vc.executors ]))
+    self.assertEqual({}, vc.reconnects)
+
+
+class TestAdmission(unittest.TestCase):
+  def setUp(self):
+    self.maxNodeScans = vcluster.MAXNODESCANS
+    vcluster.MAXNODESCANS = 1
+
+  def tearDown(self):
+    vcluster.MAXNODESCANS = self.maxNodeScans
+
+  def testTimeout(self):
+    """testing scan waiting for slot gives up at timeout, and others behind it are admitted later """
+
+    admission = vcluster.Admission()
+    admission.acquire("shell")
+    self.assertRaises(StandardError, admission.acquire, "shell", 0.1)
+    self.assertEqual(0, len(admission.waiting["shell"]))
+    admission.release()
+    admission.acquire("shell", 0.1)
+
+  def testRemoveNode(self):
+    """testing scans waiting for slot of removed node give it up, and slots of node are free after it's removed """
+
+    vc = NodesCluster(["v_db_node0001"])
+    admission = vc.admissions["v_db_node0001"]
+    admission.acquire("shell")
+
+    errors = []
+    def waitSlot() :
+      try :
+        admission.acquire("shell")
+      except StandardError, e:
+        errors.append(e)
+    t = threading.Thread(target=waitSlot)
+    t.start()
+    time.sleep(0.1)
+    vc.removeNode("v_db_node0001", "test")
+    t.join(5)
+    self.assertFalse(t.is_alive())
+    self.assertEqual(1, len(errors))
+    vc.admissions["v_db_node0001"].acquire("shell", 0.1)
+
+  def testSkippedNodes(self):
+    """testing nodes without slot are skipped at one deadline for all nodes, and reported as timeout """
+
+    admissionTimeout = vcluster.ADMISSIONTIMEOUT
+    vcluster.ADMISSIONTIMEOUT = 0.3
+    try :
+      vc = NodesCluster(["v_db_node0001", "v_db_node0002", "v_db_node0003"])
+      vc.addWorkers()
+      vc.admissions["v_db_node0001"].acquire("shell")
+      vc.admissions["v_db_node0002"].acquire("shell")
+      tbegin = time.time()
+      subscription = vc.remoteCall(vdatacollectors_filterdata, scanArgs([[32, 100]]))
+      self.assertTrue(time.time() - tbegin < 0.5)
+      self.assertEqual(["v_db_node0003"], [ channel.gateway.id for channel in subscription ])
+
+      subscription.scan.onItem("v_db_node0003", None)
+      status = vcluster.receive(subscription, lambda channel, item: None)
+      self.assertEqual(["timeout", "timeout", "finished"], [ status[n][0] for n in sorted(status) ])
+    finally :
+      vcluster.ADMISSIONTIMEOUT = admissionTimeout
+
+  def testAttachInFlight(self):
+    """testing covered request attaches to scan in flight instead of calling nodes again """
+
+    vc = NodesCluster(["v_db_node0001", "v_db_node0002"])
+    vc.addWorkers()
+    calls = []
+    for worker in vc.workers.values() :
+      worker.call = lambda module, args, nodeName=worker.gateway.id: (calls.append(nodeName), FakeChannel(nodeName))[1]
+    subscription = vc.remoteCall(vdatacollectors_filterdata, scanArgs([[32, 100]]))
+    attached = vc.remoteCall(vdatacollectors_filterdata, scanArgs([[32, 150]]), ["v_db_node0001"])
+    self.assertTrue(attached.scan is subscription.scan)
+    self.assertEqual(["v_db_node0001", "v_db_node0002"], sorted(calls))
+
+    # finished scan is not shared any more
+    for nodeName in ["v_db_node0001", "v_db_node0002"] :
+      subscription.scan.onItem(nodeName, None)
+    vcluster.receive(subscription, lambda channel, item: None)
+    vcluster.receive(attached, lambda channel, item: None)
+    self.assertEqual([], vc.scans)
+    vc.remoteCall(vdatacollectors_filterdata, scanArgs([[32, 150]]), ["v_db_node0001"])
+    self.assertEqual(3, len(calls))
+
+
+class FakeWorkerChannel:
+  """ channel to worker recording kinds of requests sent """
+
+  def __init__(self, send, sent):
+    self.send = lambda request: (sent.append(request[0]), send(request))
+
+
+class TestWorker(unittest.TestCase):
+  def setUp(self):
+    self.gw = execnet.makegateway("popen//python=%s" % sys.executable)
+    self.worker = vcluster.Worker(self.gw)
+    self.path = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.gw.exit()
+    sys.modules.pop("db.brokenfilter", None)
+    sys.modules.pop("db.slowfilter", None)
+    sys.modules.pop("db.generatedfilter", None)
+    shutil.rmtree(self.path)
+
+  def testLoadFailure(self):
+    """testing module failed loading on node is not taken as loaded, and worker keeps serving """
+
+    filename = os.path.join(self.path, "brokenfilter.py")
+    with open(filename, "w") as f :
+      # only fails on node, where module is compiled from source without file
+      f.write("if __file__.startswith('<') :\n  raise ValueError('broken filter')\n")
+    imp.load_source("db.brokenfilter", filename)
+    self.assertRaises(execnet.RemoteError, self.worker.call, sys.modules["db.brokenfilter"], {})
+    self.assertFalse("db.brokenfilter" in self.worker.loaded)
+    self.assertEqual("pong", self.worker.ping().receive(timeout=10))
+
+  def testSlowLoad(self):
+    """testing heartbeat is not blocked by module loading on node, and concurrent calls share one loading """
+
+    filename = os.path.join(self.path, "slowfilter.py")
+    with open(filename, "w") as f :
+      # only slow on node, where module is compiled from source without file
+      f.write("import time\nif __file__.startswith('<') :\n  time.sleep(1)\n\ndef filterdata(channel, args) :\n  pass\n")
+    imp.load_source("db.slowfilter", filename)
+    sent = []
+    send = self.worker.channel.send
+    self.worker.channel = FakeWorkerChannel(send, sent)
+
+    threads = [ threading.Thread(target=self.worker.call, args=(sys.modules["db.slowfilter"], {})) for i in range(2) ]
+    for t in threads :
+      t.start()
+    time.sleep(0.2)
+    tbegin = time.time()
+    self.worker.ping()
+    self.assertTrue(time.time() - tbegin < 0.5)
+    for t in threads :
+      t.join(10)
+    self.assertTrue("db.slowfilter" in self.worker.loaded)
+    self.assertEqual(["load", "ping", "call", "call"], sent)
+
+  def testGeneratedModule(self):
+    """testing module generated on coordinator is loaded on node from its source, eg. dstat of clustermon """
+
+    module = imp.new_module("db.generatedfilter")
+    module.REMOTESOURCE = "def filterdata(channel, args) :\n  channel.send(args['value'] * 2)\n"
+    sys.modules[module.__name__] = module
+    self.assertEqual(4, self.worker.call(module, {"value": 2}).receive(10))
+
+  def testCallNotLoaded(self):
+    """testing call of module not loaded on node is replied with error """
+
+    channel = self.gw.newchannel()
+    self.worker.channel.send(("call", "db.vdatacollectors_filterdata", {}, channel))
+    self.assertRaises(execnet.RemoteError, channel.receive, 10)
+    self.assertEqual("pong", self.worker.ping().receive(timeout=10))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: testing cases for mergeable sketches without cluster
+# Author: DingQiang Liu
+
+import unittest
+import random
+
+import db.vsketch as vsketch
+
+
+class TestHyperLogLog(unittest.TestCase):
+  def testErrorBound(self):
+    """testing distinct count is in 3 standard errors """
+
+    for n in (100, 10000, 100000) :
+      hll = vsketch.HyperLogLog()
+      for i in range(n) :
+        hll.add("value%d" % i)
+        # duplicated values are not counted
+        hll.add("value%d" % i)
+      self.assertTrue(abs(hll.count() - n) <= 3 * 1.04 / (hll.m ** 0.5) * n, "%s distinct values counted as %s" % (n, hll.count()))
+
+  def testMerge(self):
+    """testing merged sketch counts union of values """
+
+    hlls = [ vsketch.HyperLogLog() for _ in range(3) ]
+    for i in range(30000) :
+      # overlapping values of nodes
+      hlls[i % 3].add(i % 20000)
+    merged = vsketch.HyperLogLog().merge(hlls[0]).merge(hlls[1]).merge(hlls[2])
+    self.assertTrue(abs(merged.count() - 20000) <= 3 * 1.04 / (merged.m ** 0.5) * 20000)
+    self.assertRaises(ValueError, merged.merge, vsketch.HyperLogLog(p=10))
+
+  def testSerialize(self):
+    """testing deserialized sketch is same as original one """
+
+    hll = vsketch.HyperLogLog(p=10)
+    for i in range(1000) :
+      hll.add(u"значение%d" % i)
+    other = vsketch.HyperLogLog.deserialize(hll.serialize())
+    self.assertEqual(10, other.p)
+    self.assertEqual(hll.registers, other.registers)
+    self.assertEqual(hll.count(), other.count())
+
+
+class TestDDSketch(unittest.TestCase):
+  def setUp(self):
+    rng = random.Random(1)
+    self.values = [ rng.lognormvariate(0, 2) * rng.choice([1, 1, 1, -1]) for _ in range(10000) ] + [0.0] * 100
+
+  def assertQuantiles(self, sketch, values):
+    values = sorted(values)
+    for q in (0, 0.01, 0.25, 0.5, 0.75, 0.99, 1) :
+      exact = values[int(q * (len(values) - 1))]
+      self.assertTrue(abs(sketch.quantile(q) - exact) <= sketch.relativeAccuracy * abs(exact) + 1e-9, \
+          "%s-quantile is %s, but exact value is %s" % (q, sketch.quantile(q), exact))
+
+  def testErrorBound(self):
+    """testing quantiles are in relative accuracy """
+
+    sketch = vsketch.DDSketch()
+    for v in self.values :
+      sketch.add(v)
+    self.assertEqual(len(self.values), sketch.count)
+    self.assertTrue(min(self.values) <= sketch.quantile(0) and sketch.quantile(1) <= max(self.values))
+    self.assertQuantiles(sketch, self.values)
+    self.assertEqual(None, sketch.quantile(1.5))
+    self.assertEqual(None, vsketch.DDSketch().quantile(0.5))
+
+  def testMerge(self):
+    """testing merged sketch gets quantiles of all values """
+
+    sketches = [ vsketch.DDSketch() for _ in range(3) ]
+    for i, v in enumerate(self.values) :
+      sketches[i % 3].add(v)
+    merged = vsketch.DDSketch().merge(sketches[0]).merge(sketches[1]).merge(sketches[2])
+    self.assertEqual(len(self.values), merged.count)
+    self.assertQuantiles(merged, self.values)
+    self.assertRaises(ValueError, merged.merge, vsketch.DDSketch(0.05))
+
+  def testSerialize(self):
+    """testing deserialized sketch is same as original one """
+
+    sketch = vsketch.DDSketch()
+    for v in self.values :
+      sketch.add(v)
+    other = vsketch.DDSketch.deserialize(sketch.serialize())
+    for name in ("relativeAccuracy", "positive", "negative", "zeros", "count", "min", "max") :
+      self.assertEqual(getattr(sketch, name), getattr(other, name))
+    # empty sketch
+    other = vsketch.DDSketch.deserialize(vsketch.DDSketch().serialize())
+    self.assertEqual((0, None, None), (other.count, other.min, other.max))
+
+
+class TestMergeSketch(unittest.TestCase):
+  def testMergeSketch(self):
+    """testing partial sketches of nodes are merged by group """
+
+    def partial(values, numeric=True) :
+      hll, dd = vsketch.HyperLogLog(), vsketch.DDSketch() if numeric else None
+      for v in values :
+        hll.add(v)
+        if numeric :
+          dd.add(v)
+      return [len(values), hll, dd]
+
+    groups = {}
+    vsketch.mergeSketch(groups, ("g1", ), partial([1, 2, 3]))
+    vsketch.mergeSketch(groups, ("g1", ), partial([3, 4]))
+    vsketch.mergeSketch(groups, ("g2", ), partial(["a", "b"], numeric=False))
+    self.assertEqual(5, groups[("g1", )][0])
+    self.assertEqual(4, groups[("g1", )][1].count())
+    self.assertEqual(5, groups[("g1", )][2].count)
+    self.assertEqual(4, groups[("g1", )][2].quantile(1))
+    self.assertEqual(None, groups[("g2", )][2])
+
+    # numeric sketch of a node is kept when the first one has none
+    vsketch.mergeSketch(groups, ("g2", ), partial([7]))
+    self.assertEqual(3, groups[("g2", )][0])
+    self.assertEqual(1, groups[("g2", )][2].count)
+
+
+if __name__ == "__main__":
+  unittest.main()
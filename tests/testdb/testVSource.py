@@ -0,0 +1,291 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: testing cases for helpers of SQLite virtual tables without cluster
+# Author: DingQiang Liu
+
+import unittest
+import Queue
+import os
+import shutil
+import tempfile
+import time
+
+import apsw
+
+import db.vcluster as vcluster
+import db.vsource as vsource
+import db.vdatacollectors as vdatacollectors
+
+
+class TestTimeRanges(unittest.TestCase):
+  def setUp(self):
+    self.t = [ vsource.parseVerticaTime("2017-04-02 %02d:00:00" % h) for h in range(24) ]
+
+  def testDisjunction(self):
+    """testing time ranges in disjunction are sorted and merged """
+
+    sql = "select * from dc_requests_issued where time between ? and ? or time >= ? and time < ? or time between ? and ?"
+    bindings = ("2017-04-02 20:00:00", "2017-04-02 21:00:00", "2017-04-02 01:00:00", "2017-04-02 02:00:00", "2017-04-02 20:30:00", "2017-04-02 22:00:00")
+    self.assertEqual({"dc_requests_issued": [(self.t[1], True, self.t[2], False), (self.t[20], True, self.t[22], True)]}, \
+        vsource.getTimeRanges(sql, bindings, ["dc_requests_issued"]))
+
+    sql = "select * from dc_requests_issued where time > :t1 and time <= :t2 or time between '2017-04-02 03:00:00' and '2017-04-02 04:00:00'"
+    self.assertEqual({"dc_requests_issued": [(self.t[1], False, self.t[2], True), (self.t[3], True, self.t[4], True)]}, \
+        vsource.getTimeRanges(sql, {"t1": "2017-04-02 01:00:00", "t2": "2017-04-02 02:00:00"}, ["dc_requests_issued"]))
+
+  def testSingleRange(self):
+    """testing statement without multiple time ranges in disjunction """
+
+    sql = "select * from dc_requests_issued where time between ? and ? or node_name = ?"
+    self.assertEqual({}, vsource.getTimeRanges(sql, ("2017-04-02 01:00:00", "2017-04-02 02:00:00", "v_db_node0001"), ["dc_requests_issued"]))
+
+  def testScope(self):
+    """testing time ranges are only taken from statement on a single table """
+
+    bindings = ("2017-04-02 01:00:00", "2017-04-02 02:00:00", "2017-04-02 03:00:00", "2017-04-02 04:00:00")
+    ranges = {"dc_requests_issued": [(self.t[1], True, self.t[2], True), (self.t[3], True, self.t[4], True)]}
+    sql = "select * from v_internal.dc_requests_issued as r where r.time between ? and ? or time between ? and ? order by time"
+    self.assertEqual(ranges, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued"]))
+    sql = "select * from dc_requests_issued(0.1) where dc_requests_issued.time between ? and ? or time between ? and ?"
+    self.assertEqual(ranges, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued"]))
+
+    # ambiguous in joins, subqueries and compound selects
+    sql = """select * from dc_requests_issued r join dc_requests_completed as c on r.request_id = c.request_id
+      where r.time between ? and ? or r.time between ? and ?"""
+    self.assertEqual({}, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued", "dc_requests_completed"]))
+    sql = "select * from dc_requests_issued r, dc_requests_completed c where r.time between ? and ? or r.time between ? and ?"
+    self.assertEqual({}, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued", "dc_requests_completed"]))
+    sql = "select * from dc_requests_issued where time between ? and ? or time between ? and ? or request_id in (select request_id from v_monitor.x)"
+    self.assertEqual({}, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued"]))
+    sql = "select * from dc_requests_issued where time between ? and ? union all select * from dc_requests_issued where time between ? and ?"
+    self.assertEqual({}, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued"]))
+    # time of other things
+    sql = "select * from dc_requests_issued r where x.time between ? and ? or r.time between ? and ?"
+    self.assertEqual({}, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued"]))
+    sql = "select * from dc_requests_issued not indexed where time between ? and ? or time between ? and ?"
+    self.assertEqual({}, vsource.getTimeRanges(sql, bindings, ["dc_requests_issued"]))
+
+  def testRangePredicates(self):
+    """testing time predicates of time range """
+
+    self.assertEqual([[32, self.t[1]], [16, self.t[2]]], vsource.getRangePredicates((self.t[1], True, self.t[2], False)))
+    self.assertEqual([[4, self.t[1]], [8, self.t[2]]], vsource.getRangePredicates((self.t[1], False, self.t[2], True)))
+
+
+class FakeGateway:
+  def __init__(self, nodeName):
+    self.id = nodeName
+
+
+class FakeChannel:
+  def __init__(self, nodeName):
+    self.gateway = FakeGateway(nodeName)
+
+  def close(self) :
+    pass
+
+
+class FakeMultiChannel(list):
+  """ channels delivering all items at once """
+
+  def __init__(self, items):
+    list.__init__(self, set([ channel for channel, _ in items ]))
+    self.items = items
+
+  def make_receive_queue(self, endmarker=None) :
+    q = Queue.Queue()
+    for item in self.items :
+      q.put(item)
+    return q
+
+
+class FakeCluster:
+  """ one node with rows [time, node_name, value] of table, time is Vertica inner format """
+
+  catPath = "/data"
+  nodeNames = ["v_db_node0001"]
+
+  def __init__(self, rows):
+    self.executors = [ FakeGateway(n) for n in self.nodeNames ]
+    self.rows = rows
+    self.calls = []
+
+  def remoteCall(self, module, args, nodeNames=None) :
+    self.calls.append(args)
+    timeRanges = args.get("timeRanges", [ args["predicates"].get(0, []) ])
+    ops = {2: lambda a, b: a == b, 4: lambda a, b: a > b, 8: lambda a, b: a <= b, 16: lambda a, b: a < b, 32: lambda a, b: a >= b}
+    # time strings are converted on nodes
+    timeValue = lambda v: vsource.parseVerticaTime(v) if isinstance(v, basestring) else v
+    rows = [ r for r in self.rows if any([ all([ ops[op](r[0], timeValue(value)) for op, value in predicates ]) for predicates in timeRanges ]) ]
+    # hybrid scans only fetch rows after high-water marks
+    since = args.get("since", {})
+    rows = [ r for r in rows if not r[1] in since or r[0] > since[r[1]] ]
+    channel = FakeChannel(self.nodeNames[0])
+    data = "\2".join([ "%s\1%s\1%s\1%s" % (r[0] * 10000 + 1, r[0], r[1], r[2]) for r in rows ])
+    return FakeMultiChannel(([ (channel, data) ] if len(rows) > 0 else []) + [ (channel, None) ])
+
+
+class TestStatementTimeRanges(unittest.TestCase):
+  def setUp(self):
+    self.t = [ vsource.parseVerticaTime("2017-04-02 %02d:00:00" % h) for h in range(24) ]
+    self.cluster = FakeCluster([ [self.t[h], "v_db_node0001", h] for h in (1, 3, 5) ])
+    self.getVerticaCluster = vcluster.getVerticaCluster
+    vcluster.getVerticaCluster = lambda *args, **kwargs: self.cluster
+    self.connection = apsw.Connection(":memory:")
+    vs = vsource.setup(self.connection, lazy=True)
+    vdatacollectors.register(vs, "dc_test", {"ddl": "CREATE TABLE dc_test (\n  time timestamp,\n  node_name varchar(128),\n  value integer\n);"})
+    self.connection.cursor().execute("create view v_test as select * from dc_test")
+
+  def tearDown(self):
+    vcluster.getVerticaCluster = self.getVerticaCluster
+    self.connection.close()
+
+  def values(self, sql, bindings=None) :
+    return [ v for (v, ) in self.connection.cursor().execute(sql, bindings) ]
+
+  def testStatementScope(self):
+    """testing rows fetched for time ranges of a statement are not reused by following statement through view """
+
+    sql = "select value from dc_test where time between ? and ? or time between ? and ? order by 1"
+    self.assertEqual([1, 3], self.values(sql, ("2017-04-02 01:00:00", "2017-04-02 02:00:00", "2017-04-02 03:00:00", "2017-04-02 04:00:00")))
+    self.assertEqual(1, len(self.cluster.calls))
+    self.assertTrue("timeRanges" in self.cluster.calls[0])
+
+    # new row in range of previous statement
+    self.cluster.rows.append([self.t[1] + 1, "v_db_node0001", 100])
+    sql = "select value from v_test where time between ? and ? order by 1"
+    self.assertEqual([1, 100], self.values(sql, ("2017-04-02 01:00:00", "2017-04-02 02:00:00")))
+    self.assertEqual(2, len(self.cluster.calls))
+    self.assertFalse("timeRanges" in self.cluster.calls[1])
+
+
+class TestSamplePushdown(unittest.TestCase):
+  def setUp(self):
+    self.cluster = FakeCluster([ [vsource.parseVerticaTime("2017-04-02 01:00:00"), "v_db_node0001", 1] ])
+    self.getVerticaCluster = vcluster.getVerticaCluster
+    vcluster.getVerticaCluster = lambda *args, **kwargs: self.cluster
+    self.connection = apsw.Connection(":memory:")
+    vs = vsource.setup(self.connection, lazy=True)
+    vdatacollectors.register(vs, "dc_test", {"ddl": "CREATE TABLE dc_test (\n  time timestamp,\n  node_name varchar(128),\n  value integer\n);"})
+
+  def tearDown(self):
+    vcluster.getVerticaCluster = self.getVerticaCluster
+    self.connection.close()
+
+  def testSampleArguments(self):
+    """testing sample rate and seed of table arguments are pushed down to nodes """
+
+    cursor = self.connection.cursor()
+    self.assertEqual([(1, )], cursor.execute("select value from dc_test(0.5, 7)").fetchall())
+    self.assertEqual({"rate": 0.5, "seed": 7}, self.cluster.calls[-1]["sample"])
+    # full table is not sampled, empty sample does not reach nodes
+    cursor.execute("select value from dc_test(1)").fetchall()
+    self.assertFalse("sample" in self.cluster.calls[-1])
+    calls = len(self.cluster.calls)
+    self.assertEqual([], cursor.execute("select value from dc_test(0)").fetchall())
+    self.assertEqual(calls, len(self.cluster.calls))
+    self.assertRaises(Exception, lambda: cursor.execute("select value from dc_test(2)").fetchall())
+
+
+class TestLocalStorage(unittest.TestCase):
+  def setUp(self):
+    self.t = [ vsource.parseVerticaTime("2017-04-02 %02d:00:00" % h) for h in range(24) ]
+    self.cluster = FakeCluster([ [self.t[h], "v_db_node0001", h] for h in (1, 3) ])
+    self.getVerticaCluster = vcluster.getVerticaCluster
+    vcluster.getVerticaCluster = lambda *args, **kwargs: self.cluster
+    self.path = tempfile.mkdtemp()
+    self.connection = apsw.Connection(os.path.join(self.path, "test.db"))
+    self.vs = vsource.setup(self.connection, lazy=True)
+    vdatacollectors.register(self.vs, "dc_test", {"ddl": "CREATE TABLE dc_test (\n  time timestamp,\n  node_name varchar(128),\n  value integer\n);"})
+    self.vs.createHybridAndLocalTables("dc_test")
+    self.cursor = self.vs.writer.cursor()
+    self.cursor.execute("create table main.%s (table_name, node_name, file_name, max_time)" % vsource.WATERMARKTABLE)
+    # first row has been synced
+    self.vs.writeRows(self.cursor, "dc_test", [ [self.t[1], "v_db_node0001", 1] ], {"v_db_node0001": {"": self.t[1]}})
+
+  def tearDown(self):
+    vcluster.getVerticaCluster = self.getVerticaCluster
+    self.vs.writer.close()
+    self.connection.close()
+    shutil.rmtree(self.path)
+
+  def values(self, sql) :
+    return [ v for (v, ) in self.connection.cursor().execute(sql) ]
+
+  def testHybrid(self):
+    """testing hybrid table gets local rows up to high-water marks, and only newer rows from cluster """
+
+    self.assertEqual([1, 3], self.values("select value from v_hybrid.dc_test order by 1"))
+    self.assertEqual({"v_db_node0001": self.t[1]}, self.cluster.calls[-1]["since"])
+
+  def testLocal(self):
+    """testing predicates on time and node_name are pushed down to encoded partitions, and rows are decoded """
+
+    sql = "select time, node_name, value from dc_test where node_name = 'v_db_node0001' and time >= '2017-04-02 00:00:00'"
+    self.assertEqual([("2017-04-02 01:00:00.000000", "v_db_node0001", 1)], self.connection.cursor().execute(sql).fetchall())
+    self.assertEqual([], self.values("select value from dc_test where node_name = 'v_db_node0002'"))
+    self.assertEqual([], self.values("select value from dc_test where time >= '2017-04-03 00:00:00'"))
+    # synced table is not fetched from cluster
+    self.assertEqual(0, len(self.cluster.calls))
+
+
+class TestSyncByTime(unittest.TestCase):
+  def setUp(self):
+    self.t = [ vsource.parseVerticaTime("2017-04-02 %02d:00:00" % h) for h in range(24) ]
+    self.cluster = FakeCluster([ [self.t[1], "v_db_node0001", 1] ])
+    self.getVerticaCluster = vcluster.getVerticaCluster
+    vcluster.getVerticaCluster = lambda *args, **kwargs: self.cluster
+    self.path = tempfile.mkdtemp()
+    self.connection = apsw.Connection(os.path.join(self.path, "test.db"))
+    self.vs = vsource.setup(self.connection, lazy=True)
+    vdatacollectors.register(self.vs, "dc_test", {"ddl": "CREATE TABLE dc_test (\n  time timestamp,\n  node_name varchar(128),\n  value integer\n);"})
+    # table synced by time without primary keys, eg. vertica_log
+    table = self.vs.tables["dc_test"]
+    table.watermarked, table.partitioned, table.primaryKeys = False, False, None
+    self.cursor = self.vs.writer.cursor()
+    self.cursor.execute("create table main.dc_test (time timestamp, node_name varchar(128), value integer)")
+    self.cursor.execute("create table main.%s (table_name, node_name, file_name, max_time)" % vsource.WATERMARKTABLE)
+
+  def tearDown(self):
+    vcluster.getVerticaCluster = self.getVerticaCluster
+    self.vs.writer.close()
+    self.connection.close()
+    shutil.rmtree(self.path)
+
+  def sync(self, since) :
+    rows, marks, stats = self.vs.fetchByTime("dc_test", since)
+    self.vs.writeRows(self.cursor, "dc_test", rows, marks)
+    return dict([ (nodeName, files[""]) for nodeName, files in marks.iteritems() ])
+
+  def testRowsAtHighWaterMark(self):
+    """testing rows arrived later with same time as high-water mark are synced, and rows synced before are not duplicated """
+
+    since = self.sync({})
+    self.cluster.rows.extend([ [self.t[1], "v_db_node0001", 2], [self.t[3], "v_db_node0001", 3] ])
+    since = self.sync(since)
+    self.assertEqual([1, 2, 3], [ v for (v, ) in self.cursor.execute("select value from main.dc_test order by 1") ])
+    self.sync(since)
+    self.assertEqual([1, 2, 3], [ v for (v, ) in self.cursor.execute("select value from main.dc_test order by 1") ])
+
+  def testSyncStats(self):
+    """testing metrics of sync passes are kept in history table and v_sync_stats, lag is behind newest row on node when it was fetched """
+
+    self.cursor.execute("create table main.%s (time timestamp, table_name, node_name, rows_fetched, bytes_fetched, remote_seconds, parse_seconds, insert_seconds, lag_seconds)" % vsource.SYNCHISTORYTABLE)
+    rows = [ ["2017-04-02 01:00:00.000000", "v_db_node0001", 1], ["2017-04-02 01:00:01.000000", "v_db_node0001", 2] ]
+    marks = {"v_db_node0001": {"": "2017-04-02 01:00:01.000000"}}
+    nodeStats = {"v_db_node0001": {"bytes": 100, "parseSeconds": 0.1, "remoteSeconds": 0.5, "newest": "2017-04-02 01:00:11.000000"}}
+    for i in range(2) :
+      self.vs.recordSyncStats(self.cursor, "dc_test", rows, marks, nodeStats, 0.2)
+    self.vs.syncFailures["dc_other"] = (time.time(), "cluster is not accessible")
+
+    sql = "select table_name, node_name, rows_fetched, bytes_fetched, lag_seconds, total_rows, total_bytes, last_failure from v_internal.%s order by 1" % vsource.SYNCSTATSTABLE
+    self.assertEqual([("dc_other", None, None, None, None, None, None, "cluster is not accessible"), ("dc_test", "v_db_node0001", 2, 100, 10.0, 4, 200, None)], \
+        self.connection.cursor().execute(sql).fetchall())
+    sql = "select table_name, node_name, rows_fetched, lag_seconds from main.%s" % vsource.SYNCHISTORYTABLE
+    self.assertEqual([("dc_test", "v_db_node0001", 2, 10.0)] * 2, self.cursor.execute(sql).fetchall())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,321 @@
+#!/usr/bin/python
+#encoding: utf-8
+#
+# Copyright (c) 2006 - 2017, Hewlett-Packard Development Co., L.P.
+# Description: testing cases for time partitioned local storage without cluster
+# Author: DingQiang Liu
+
+import unittest
+from datetime import datetime, timedelta
+
+import apsw
+
+import db.vstorage as vstorage
+
+
+class FakeTable:
+  def __init__(self, tablename):
+    self.tablename = tablename
+    self.columns = ["rowid", "time", "node_name", "request_type", "request"]
+    self.columnTypes = {"rowid": "integer", "time": "timestamp", "node_name": "varchar", "request_type": "varchar", "request": "varchar"}
+    self.primaryKeys = ["time", "node_name"]
+
+
+class TestEncoding(unittest.TestCase):
+  def setUp(self):
+    self.connection = apsw.Connection(":memory:")
+    self.cursor = self.connection.cursor()
+    self.table = FakeTable("dc_requests_issued")
+
+  def tearDown(self):
+    self.connection.close()
+
+  def testEncodeTime(self):
+    """testing time string is encoded into Vertica inner format, and decoded back by SQL """
+
+    self.assertEqual(None, vstorage.encodeTime(None))
+    self.assertEqual(None, vstorage.encodeTime(-0x8000000000000000))
+    self.assertEqual(544452155737558, vstorage.encodeTime(544452155737558))
+    for value in ("2017-04-02 20:42:35.737558", "2017-04-02 20:42:35.000000", "2000-01-01 00:00:00.000001") :
+      encoded = vstorage.encodeTime(value)
+      # only microseconds are kept
+      self.assertEqual(encoded, vstorage.encodeTime(value + "999"))
+      for (decoded, ) in self.cursor.execute("select %s from (select ? as time)" % vstorage.getDecodeExpression(self.table, "time"), (encoded, )) : break
+      self.assertEqual(value, decoded)
+    self.assertEqual(vstorage.encodeTime("2017-04-02 20:42:35.7"), vstorage.encodeTime("2017-04-02 20:42:35.700000"))
+    self.assertEqual(vstorage.encodeTime("2017-04-02 20:42:35"), vstorage.encodeTime("2017-04-02 20:42:35.000000"))
+
+  def testDictionary(self):
+    """testing low-cardinality strings are encoded into stable ids kept in dictionary table """
+
+    self.assertTrue(vstorage.isDictionaryColumn("node_name", "varchar"))
+    self.assertTrue(vstorage.isDictionaryColumn("request_type", "varchar"))
+    self.assertFalse(vstorage.isDictionaryColumn("request", "varchar"))
+    self.assertFalse(vstorage.isDictionaryColumn("node_name", "integer"))
+
+    dictionary = vstorage.Dictionary()
+    ids = [ dictionary.encode(self.cursor, v) for v in ("v_db_node0001", "v_db_node0002", "v_db_node0001") ]
+    self.assertEqual([1, 2, 1], ids)
+    self.assertEqual(None, dictionary.encode(self.cursor, None))
+    # ids are loaded from dictionary table
+    other = vstorage.Dictionary()
+    self.assertEqual(2, other.encode(self.cursor, "v_db_node0002"))
+    self.assertEqual(3, other.encode(self.cursor, "v_db_node0003"))
+
+    rows = vstorage.encodeRows(self.cursor, self.table, [["2017-04-02 20:42:35.737558", "v_db_node0002", "QUERY", "select 1"]], other)
+    self.assertEqual([[vstorage.encodeTime("2017-04-02 20:42:35.737558"), 2, 4, "select 1"]], rows)
+    for (nodeName, requestType) in self.cursor.execute("select %s, %s from (select 2 as node_name, 4 as request_type)" % \
+        (vstorage.getDecodeExpression(self.table, "node_name"), vstorage.getDecodeExpression(self.table, "request_type"))) : break
+    self.assertEqual(("v_db_node0002", "QUERY"), (nodeName, requestType))
+
+  def testRowid(self):
+    """testing rowid of partition row is same as rowid of remote row: time * 10000 + node number """
+
+    dictionary = vstorage.Dictionary()
+    sql = "insert into main.%s values (?, ?, ?, ?)"
+    vstorage.writeRows(self.cursor, self.table, sql, [["2017-04-02 20:42:35.737558", "v_db_node0003", "QUERY", "select 1"]], dictionary)
+    partition = vstorage.getPartitionKey(vstorage.encodeTime("2017-04-02 20:42:35.737558"))
+    rows = list(self.cursor.execute(vstorage.getSelectSQL(self.table, [partition], rowid=True)))
+    self.assertEqual([(vstorage.encodeTime("2017-04-02 20:42:35.737558") * 10000 + 3, "2017-04-02 20:42:35.737558", "v_db_node0003", "QUERY", "select 1")], rows)
+
+
+class TestPartitions(unittest.TestCase):
+  def setUp(self):
+    self.connection = apsw.Connection(":memory:")
+    self.cursor = self.connection.cursor()
+    self.tables = [ FakeTable("dc_requests_issued"), FakeTable("dc_requests_completed") ]
+    # views of partitions decode strings by dictionary table
+    vstorage.Dictionary().load(self.cursor)
+    self.retentionDays = vstorage.RETENTIONDAYS
+    self.diskBudget = vstorage.DISKBUDGET
+
+  def tearDown(self):
+    vstorage.RETENTIONDAYS = self.retentionDays
+    vstorage.DISKBUDGET = self.diskBudget
+    self.connection.close()
+
+  def testPartitionKey(self):
+    """testing rows are partitioned by local day of time """
+
+    self.assertEqual("20170402", vstorage.getPartitionKey(vstorage.encodeTime("2017-04-02 00:00:00")))
+    self.assertEqual("20170402", vstorage.getPartitionKey(vstorage.encodeTime("2017-04-02 23:59:59.999999")))
+    self.assertEqual("20170403", vstorage.getPartitionKey(vstorage.encodeTime("2017-04-03 00:00:00")))
+    self.assertEqual(vstorage.NULLPARTITION, vstorage.getPartitionKey(None))
+    self.assertEqual("dc_requests_issued_p20170402", vstorage.PARTITIONFORMAT % ("dc_requests_issued", "20170402"))
+
+  def testPartitionInRange(self):
+    """testing partitions out of time predicates are skipped """
+
+    begin, end = vstorage.encodeTime("2017-04-02 00:00:00"), vstorage.encodeTime("2017-04-03 00:00:00")
+    self.assertTrue(vstorage.isPartitionInRange("20170402", []))
+    self.assertTrue(vstorage.isPartitionInRange("20170402", [[32, begin], [16, end]]))
+    self.assertTrue(vstorage.isPartitionInRange("20170402", [[2, begin]]))
+    self.assertFalse(vstorage.isPartitionInRange("20170402", [[32, end]]))
+    self.assertFalse(vstorage.isPartitionInRange("20170402", [[16, begin]]))
+    self.assertTrue(vstorage.isPartitionInRange("20170402", [[8, begin]]))
+    self.assertFalse(vstorage.isPartitionInRange("20170402", [[4, end - 1]]))
+    self.assertFalse(vstorage.isPartitionInRange(vstorage.NULLPARTITION, [[32, begin]]))
+    self.assertTrue(vstorage.isPartitionInRange(vstorage.NULLPARTITION, []))
+
+  def createPartitions(self, days) :
+    for t in self.tables :
+      vstorage.ensurePartitions(self.cursor, t, days)
+
+  def testMigrateLocalTable(self):
+    """testing rows of local table synced before partitioning are moved into partitions of their days """
+
+    self.cursor.execute("create table main.dc_requests_issued (time timestamp, node_name varchar(128), request_type varchar(128), request varchar(64000))")
+    rows = [ ("2017-04-02 23:59:59.000000", "v_db_node0001", "QUERY", "select 1"), ("2017-04-03 00:00:01.000000", "v_db_node0002", "QUERY", "select 2") ]
+    self.cursor.executemany("insert into main.dc_requests_issued values (?, ?, ?, ?)", rows)
+
+    vstorage.migrate(self.cursor, self.tables[0], vstorage.Dictionary())
+    self.assertEqual(["20170402", "20170403"], vstorage.getPartitions(self.cursor, "dc_requests_issued"))
+    self.assertEqual([("view", )], list(self.cursor.execute("select type from main.sqlite_master where name = 'dc_requests_issued'")))
+    self.assertEqual(rows, list(self.cursor.execute("select time, node_name, request_type, request from main.dc_requests_issued order by time")))
+    # nothing left to migrate
+    vstorage.migrate(self.cursor, self.tables[0], vstorage.Dictionary())
+    self.assertEqual(2, len(list(self.cursor.execute("select * from main.dc_requests_issued"))))
+
+  def testMigrateOriginalLayout(self):
+    """testing partitions of original layout(time strings, plain strings) are encoded in place """
+
+    name = vstorage.PARTITIONFORMAT % ("dc_requests_issued", "20170402")
+    self.cursor.execute("create table main.%s (time timestamp, node_name varchar(128), request_type varchar(128), request varchar(64000), PRIMARY KEY(time, node_name)) WITHOUT ROWID" % name)
+    row = ("2017-04-02 10:00:00.000001", "v_db_node0001", "QUERY", "select 1")
+    self.cursor.execute("insert into main.%s values (?, ?, ?, ?)" % name, row)
+
+    vstorage.migrate(self.cursor, self.tables[0], vstorage.Dictionary())
+    encoded = list(self.cursor.execute("select * from main.%s" % name))
+    self.assertEqual([(vstorage.encodeTime(row[0]), 1, 2, "select 1")], encoded)
+    self.assertEqual([row], list(self.cursor.execute("select time, node_name, request_type, request from main.dc_requests_issued")))
+
+  def testRetentionByAge(self):
+    """testing partitions older than retention days are dropped """
+
+    today = datetime.now()
+    days = [ (today - timedelta(days=d)).strftime("%Y%m%d") for d in (0, 1, 5, 10) ] + [vstorage.NULLPARTITION]
+    self.createPartitions(days)
+    # other tables are not partitions
+    self.cursor.execute("create table main.dc_requests_issued_p2017 (x)")
+    self.assertEqual(sorted(days), vstorage.getPartitions(self.cursor, "dc_requests_issued"))
+
+    vstorage.RETENTIONDAYS = 3
+    self.assertEqual(6, vstorage.enforceRetention(self.cursor, self.tables))
+    for t in self.tables :
+      self.assertEqual(sorted(days[:2]), vstorage.getPartitions(self.cursor, t.tablename))
+    # view is on remained partitions
+    self.assertEqual([(0, )], list(self.cursor.execute("select count(*) from main.dc_requests_issued")))
+
+  def testRetentionBySize(self):
+    """testing oldest days of all tables are dropped until used size is under disk budget """
+
+    today = datetime.now()
+    days = [ (today - timedelta(days=d)).strftime("%Y%m%d") for d in (0, 1, 2) ]
+    self.createPartitions(days)
+    dictionary = vstorage.Dictionary()
+    sql = "insert into main.%s values (?, ?, ?, ?)"
+    for d in (0, 1, 2) :
+      day = (today - timedelta(days=d)).strftime("%Y-%m-%d")
+      rows = [ ["%s 10:00:00.%06d" % (day, i), "v_db_node0001", "QUERY", "x" * 1000] for i in range(100) ]
+      vstorage.writeRows(self.cursor, self.tables[0], sql, rows, dictionary)
+
+    # budget for the newest day only
+    vstorage.DISKBUDGET = vstorage.getUsedSize(self.cursor) * 2 / 5
+    self.assertEqual(4, vstorage.enforceRetention(self.cursor, self.tables))
+    for t in self.tables :
+      self.assertEqual([days[0]], vstorage.getPartitions(self.cursor, t.tablename))
+    self.assertTrue(vstorage.getUsedSize(self.cursor) <= vstorage.DISKBUDGET)
+
+  def testRetentionOfOtherData(self):
+    """testing data other than partitions is not budgeted and partitions of current day are kept """
+
+    today = datetime.now()
+    days = [ (today - timedelta(days=d)).strftime("%Y%m%d") for d in (0, 1) ]
+    self.createPartitions(days)
+    dictionary = vstorage.Dictionary()
+    sql = "insert into main.%s values (?, ?, ?, ?)"
+    for d in (0, 1) :
+      day = (today - timedelta(days=d)).strftime("%Y-%m-%d")
+      rows = [ ["%s 10:00:00.%06d" % (day, i), "v_db_node0001", "QUERY", "x" * 1000] for i in range(20) ]
+      vstorage.writeRows(self.cursor, self.tables[0], sql, rows, dictionary)
+    vstorage.DISKBUDGET = vstorage.getUsedSize(self.cursor)
+
+    # history alone exceeds budget
+    self.cursor.execute("create table main.sync_history (x)")
+    self.cursor.executemany("insert into main.sync_history values (?)", [ ("x" * 1000, ) for i in range(200) ])
+    dropped = vstorage.enforceRetention(self.cursor, self.tables)
+    if vstorage.getTableSizes(self.cursor) is None :
+      # without dbstat whole database is budgeted, but current day is still kept
+      self.assertEqual(2, dropped)
+    else :
+      self.assertEqual(0, dropped)
+    for t in self.tables :
+      self.assertTrue(days[0] in vstorage.getPartitions(self.cursor, t.tablename))
+    self.assertEqual([(20, )], list(self.cursor.execute("select count(*) from main.dc_requests_issued")))
+
+
+class TestCompaction(unittest.TestCase):
+  def setUp(self):
+    self.connection = apsw.Connection(":memory:")
+    self.cursor = self.connection.cursor()
+    vstorage.Dictionary().load(self.cursor)
+
+  def tearDown(self):
+    self.connection.close()
+
+  def testCompactWithoutKeys(self):
+    """testing rows of table without primary keys are rolled by bucket and node, and their rowids stay unique """
+
+    table = FakeTable("dc_requests_issued")
+    table.primaryKeys = None
+    dictionary = vstorage.Dictionary()
+    sql = "insert into main.%s values (?, ?, ?, ?)"
+    rows = [ ["2017-04-02 10:00:%02d.000000" % s, "v_db_node000%s" % n, "QUERY", "x"] for s in (1, 20, 40) for n in (1, 2) ]
+    vstorage.writeRows(self.cursor, table, sql, rows, dictionary)
+    partition = vstorage.getPartitionKey(vstorage.encodeTime("2017-04-02 10:00:00"))
+
+    vstorage.compactPartition(self.cursor, table, partition, 60)
+    rows = list(self.cursor.execute(vstorage.getSelectSQL(table, [partition], rowid=True)))
+    self.assertEqual(2, len(rows))
+    self.assertEqual(2, len(set([ r[0] for r in rows ])))
+    self.assertEqual([("2017-04-02 10:00:00.000000", "v_db_node0001"), ("2017-04-02 10:00:00.000000", "v_db_node0002")], sorted([ r[1:3] for r in rows ]))
+
+
+class TestIndexes(unittest.TestCase):
+  def setUp(self):
+    self.connection = apsw.Connection(":memory:")
+    self.cursor = self.connection.cursor()
+    vstorage.Dictionary().load(self.cursor)
+    self.table = FakeTable("dc_resource_acquisitions")
+    self.table.columns = ["rowid", "time", "node_name", "pool_name", "request"]
+    self.table.columnTypes = {"rowid": "integer", "time": "timestamp", "node_name": "varchar", "pool_name": "varchar", "request": "varchar"}
+    self.table.primaryKeys = ["time", "node_name", "request"]
+    dictionary = vstorage.Dictionary()
+    sql = "insert into main.%s values (?, ?, ?, ?)"
+    rows = [ ["2017-04-02 10:00:00.%06d" % i, "v_db_node0001", ("general", "sysquery", "tm")[i % 3], "select %s" % i] for i in range(300) ]
+    vstorage.writeRows(self.cursor, self.table, sql, rows, dictionary)
+
+  def tearDown(self):
+    self.connection.close()
+
+  def indexed(self) :
+    return sorted(vstorage.getIndexedColumns(self.cursor, self.table.tablename))
+
+  def testLowCardinalityColumn(self):
+    """testing low-cardinality column is indexed when it's filtered frequently, selective column is indexed sooner """
+
+    self.assertEqual((1, 0), vstorage.adviseIndexes(self.cursor, [self.table], {self.table.tablename: {"pool_name": 5, "request": 5}}))
+    self.assertEqual(["request"], self.indexed())
+    self.assertEqual((1, 0), vstorage.adviseIndexes(self.cursor, [self.table], {self.table.tablename: {"pool_name": 30}}))
+    self.assertEqual(["pool_name", "request"], self.indexed())
+
+
+class FakeLogTable:
+  def __init__(self, tablename):
+    self.tablename = tablename
+    self.columns = ["rowid", "time", "node_name", "message"]
+    self.columnTypes = {"rowid": "integer", "time": "timestamp", "node_name": "varchar", "message": "varchar"}
+    self.fullTextColumns = ["message"]
+
+
+class TestFullText(unittest.TestCase):
+  def setUp(self):
+    self.connection = apsw.Connection(":memory:")
+    self.cursor = self.connection.cursor()
+    self.table = FakeLogTable("vertica_log")
+    self.content = vstorage.FTSCONTENTFORMAT % "vertica_log"
+
+  def tearDown(self):
+    self.connection.close()
+
+  def match(self, word) :
+    return [ v for (v, ) in self.cursor.execute("select node_name from main.vertica_log where vertica_log match ? order by 1", (word, )) ]
+
+  def testContentTable(self):
+    """testing full text index follows inserts and deletes on content table """
+
+    self.assertTrue(vstorage.createFullText(self.cursor, self.table))
+    self.assertFalse(vstorage.createFullText(self.cursor, self.table))
+    sql = "insert into main.%s values (?, ?, ?)" % self.content
+    self.cursor.executemany(sql, [ ("2017-04-02 10:00:00", "v_db_node0001", "lock timeout"), ("2017-04-02 10:00:01", "v_db_node0002", "query timeout") ])
+    self.assertEqual(["v_db_node0001", "v_db_node0002"], self.match("timeout"))
+    # only full text columns are indexed
+    self.assertEqual([], self.match("v_db_node0001"))
+    self.cursor.execute("delete from main.%s where node_name = 'v_db_node0001'" % self.content)
+    self.assertEqual(["v_db_node0002"], self.match("timeout"))
+    vstorage.mergeFullText(self.cursor, "vertica_log")
+    vstorage.optimizeFullText(self.cursor, "vertica_log")
+    self.assertEqual(["v_db_node0002"], self.match("query"))
+
+  def testMigrate(self):
+    """testing full text table storing content itself is migrated into content table """
+
+    self.cursor.execute("create table main.vertica_log (time timestamp, node_name varchar, message varchar)")
+    self.cursor.execute("insert into main.vertica_log values ('2017-04-02 10:00:00', 'v_db_node0001', 'lock timeout')")
+    self.assertFalse(vstorage.createFullText(self.cursor, self.table))
+    self.assertEqual([(1, )], list(self.cursor.execute("select count(*) from main.%s" % self.content)))
+    self.assertEqual(["v_db_node0001"], self.match("lock"))
+
+
+if __name__ == "__main__":
+  unittest.main()